@@ -0,0 +1,225 @@
+"""
+In-process S3 and KMS stand-ins for offline benchmarks and tests.
+
+They implement just the client methods the handlers call, with
+configurable latency, jitter and error rates, so throughput and tail
+latency can be measured without AWS. Failures are raised as botocore
+ClientErrors, exactly as the real clients would raise them.
+"""
+
+import hashlib
+import io
+import random
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from botocore.exceptions import ClientError
+
+FAKE_KMS_PREFIX = b'FAKEKMS1'
+
+
+class FakeBackend:
+    """Latency, jitter and error injection shared by the fake services."""
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, error_rate: float = 0.0,
+                 error_code: str = 'InternalError', seed: Optional[int] = None,
+                 tail_rate: float = 0.0, tail_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_code = error_code
+        # A tail_rate fraction of calls is slowed down by another tail_ms
+        self.tail_rate = tail_rate
+        self.tail_ms = tail_ms
+        self.calls: Dict[str, int] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _call(self, operation: str) -> None:
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+            delay = self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)
+            if self.tail_rate and self._random.random() < self.tail_rate:
+                delay += self.tail_ms
+            fail = self._random.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay / 1000)
+        if fail:
+            raise ClientError({
+                'Error': {'Code': self.error_code, 'Message': 'Injected failure'},
+                'ResponseMetadata': {'HTTPStatusCode': 500}
+            }, operation)
+
+
+class FakeBody:
+    """StreamingBody stand-in supporting read(amt)."""
+
+    def __init__(self, data: bytes):
+        self._stream = io.BytesIO(data)
+
+    def read(self, amt: Optional[int] = None) -> bytes:
+        return self._stream.read(-1 if amt is None else amt)
+
+    def close(self) -> None:
+        self._stream.close()
+
+
+class FakeS3(FakeBackend):
+    """S3 client stand-in holding objects in memory, keyed by bucket and key."""
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.objects: Dict[tuple, Dict[str, Any]] = {}
+
+    def put(self, bucket: str, key: str, data: bytes, content_type: str = 'binary/octet-stream',
+            metadata: Optional[Dict[str, str]] = None) -> None:
+        """Seed an object without counting a call."""
+        self.objects[(bucket, key)] = {
+            'Body': bytes(data),
+            'ETag': '"%s"' % hashlib.md5(data).hexdigest(),
+            'ContentType': content_type,
+            'Metadata': dict(metadata or {}),
+            'LastModified': time.time(),
+        }
+
+    def _object(self, operation: str, bucket: str, key: str) -> Dict[str, Any]:
+        obj = self.objects.get((bucket, key))
+        if obj is None:
+            raise ClientError({
+                'Error': {'Code': 'NoSuchKey', 'Message': 'The specified key does not exist.'},
+                'ResponseMetadata': {'HTTPStatusCode': 404}
+            }, operation)
+        return obj
+
+    def get_object(self, Bucket: str, Key: str, Range: Optional[str] = None,
+                   IfNoneMatch: Optional[str] = None, IfMatch: Optional[str] = None,
+                   **kwargs: Any) -> Dict[str, Any]:
+        self._call('GetObject')
+        obj = self._object('GetObject', Bucket, Key)
+        if IfMatch is not None and IfMatch != obj['ETag']:
+            raise ClientError({
+                'Error': {'Code': 'PreconditionFailed',
+                          'Message': 'At least one of the pre-conditions you specified did not hold'},
+                'ResponseMetadata': {'HTTPStatusCode': 412}
+            }, 'GetObject')
+        if IfNoneMatch is not None and IfNoneMatch == obj['ETag']:
+            raise ClientError({
+                'Error': {'Code': '304', 'Message': 'Not Modified'},
+                'ResponseMetadata': {'HTTPStatusCode': 304}
+            }, 'GetObject')
+        data = obj['Body']
+        response = {'ETag': obj['ETag'], 'ContentType': obj['ContentType'], 'ContentLength': len(data),
+                    'Metadata': dict(obj['Metadata']), 'LastModified': obj['LastModified']}
+        if Range is not None:
+            start, _, end = Range[len('bytes='):].partition('-')
+            if not start:
+                # Suffix range: the last `end` bytes
+                start, end = str(max(0, len(data) - int(end))), ''
+            start = int(start)
+            end = min(int(end) if end else len(data) - 1, len(data) - 1)
+            if start >= len(data):
+                raise ClientError({
+                    'Error': {'Code': 'InvalidRange', 'Message': 'The requested range is not satisfiable'},
+                    'ResponseMetadata': {'HTTPStatusCode': 416}
+                }, 'GetObject')
+            response['ContentRange'] = f'bytes {start}-{end}/{len(data)}'
+            response['ContentLength'] = end - start + 1
+            data = data[start:end + 1]
+        response['Body'] = FakeBody(data)
+        return response
+
+    def head_object(self, Bucket: str, Key: str, IfNoneMatch: Optional[str] = None,
+                    **kwargs: Any) -> Dict[str, Any]:
+        self._call('HeadObject')
+        obj = self._object('HeadObject', Bucket, Key)
+        if IfNoneMatch is not None and IfNoneMatch == obj['ETag']:
+            raise ClientError({
+                'Error': {'Code': '304', 'Message': 'Not Modified'},
+                'ResponseMetadata': {'HTTPStatusCode': 304}
+            }, 'HeadObject')
+        return {'ETag': obj['ETag'], 'ContentType': obj['ContentType'], 'ContentLength': len(obj['Body']),
+                'Metadata': dict(obj['Metadata']), 'LastModified': obj['LastModified']}
+
+    def put_object(self, Bucket: str, Key: str, Body: Any, ContentType: str = 'binary/octet-stream',
+                   IfMatch: Optional[str] = None, IfNoneMatch: Optional[str] = None,
+                   Metadata: Optional[Dict[str, str]] = None, **kwargs: Any) -> Dict[str, Any]:
+        self._call('PutObject')
+        data = Body.encode('utf-8') if isinstance(Body, str) else bytes(Body)
+        # Check and write under the lock so conditional writes are atomic, as in S3
+        with self._lock:
+            existing = self.objects.get((Bucket, Key))
+            if (IfNoneMatch == '*' and existing is not None) or \
+                    (IfMatch is not None and (existing is None or existing['ETag'] != IfMatch)):
+                raise ClientError({
+                    'Error': {'Code': 'PreconditionFailed',
+                              'Message': 'At least one of the pre-conditions you specified did not hold'},
+                    'ResponseMetadata': {'HTTPStatusCode': 412}
+                }, 'PutObject')
+            self.put(Bucket, Key, data, ContentType, Metadata)
+        return {'ETag': self.objects[(Bucket, Key)]['ETag']}
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = '', ContinuationToken: Optional[str] = None,
+                        MaxKeys: int = 1000, StartAfter: str = '', **kwargs: Any) -> Dict[str, Any]:
+        self._call('ListObjectsV2')
+        with self._lock:
+            keys = sorted(key for bucket, key in self.objects
+                          if bucket == Bucket and key.startswith(Prefix) and key > StartAfter)
+            start = int(ContinuationToken or 0)
+            contents = [{'Key': key, 'Size': len(self.objects[(Bucket, key)]['Body']),
+                         'LastModified': self.objects[(Bucket, key)]['LastModified']}
+                        for key in keys[start:start + MaxKeys]]
+        response = {'Contents': contents, 'KeyCount': len(contents), 'IsTruncated': start + MaxKeys < len(keys)}
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = str(start + MaxKeys)
+        return response
+
+    def delete_objects(self, Bucket: str, Delete: Dict[str, Any], **kwargs: Any) -> Dict[str, Any]:
+        self._call('DeleteObjects')
+        objects = Delete['Objects']
+        if len(objects) > 1000:
+            raise ClientError({
+                'Error': {'Code': 'MalformedXML', 'Message': 'At most 1000 keys per request'},
+                'ResponseMetadata': {'HTTPStatusCode': 400}
+            }, 'DeleteObjects')
+        with self._lock:
+            for obj in objects:
+                self.objects.pop((Bucket, obj['Key']), None)
+        response: Dict[str, Any] = {'Errors': []}
+        if not Delete.get('Quiet'):
+            response['Deleted'] = [{'Key': obj['Key']} for obj in objects]
+        return response
+
+    def generate_presigned_url(self, ClientMethod: str, Params: Dict[str, Any], ExpiresIn: int = 3600) -> str:
+        return f"https://fake-s3.local/{Params['Bucket']}/{Params['Key']}?method={ClientMethod}&expires={ExpiresIn}"
+
+
+class FakeKMS(FakeBackend):
+    """
+    KMS client stand-in. Its "ciphertext" is the plaintext behind a fixed
+    prefix, which is enough to exercise every decrypt path.
+    """
+
+    @staticmethod
+    def encrypt(plaintext: bytes) -> bytes:
+        return FAKE_KMS_PREFIX + plaintext
+
+    def decrypt(self, CiphertextBlob: bytes, KeyId: Optional[str] = None, **kwargs: Any) -> Dict[str, Any]:
+        self._call('Decrypt')
+        blob = bytes(CiphertextBlob)
+        if not blob.startswith(FAKE_KMS_PREFIX):
+            raise ClientError({
+                'Error': {'Code': 'InvalidCiphertextException', 'Message': ''},
+                'ResponseMetadata': {'HTTPStatusCode': 400}
+            }, 'Decrypt')
+        return {'Plaintext': blob[len(FAKE_KMS_PREFIX):], 'KeyId': KeyId}
+
+    def describe_key(self, KeyId: str, **kwargs: Any) -> Dict[str, Any]:
+        self._call('DescribeKey')
+        return {'KeyMetadata': {'KeyId': KeyId, 'Enabled': True}}
+
+    def generate_data_key(self, KeyId: str, KeySpec: str = 'AES_256', **kwargs: Any) -> Dict[str, Any]:
+        self._call('GenerateDataKey')
+        with self._lock:
+            data_key = bytes(self._random.getrandbits(8) for _ in range(32))
+        return {'Plaintext': data_key, 'CiphertextBlob': self.encrypt(data_key), 'KeyId': KeyId}
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Offline memory sweep that recommends a Lambda memory_size.
+
+Runs one request scenario against the fakes at several payload sizes,
+each in a fresh child process with PROFILE_MEMORY=on so peak RSS is not
+inflated by earlier, larger runs. A straight line fitted through the
+measured peak RSS is then evaluated at the chosen percentile of the blob
+size distribution, multiplied by a headroom factor, and rounded up to a
+64 MB step within Lambda's 128-10240 MB range.
+
+    python3 bench/memory_sweep.py --sizes 2048,8192,65536,1048576,3145728 --percentile 99
+    python3 bench/memory_sweep.py --sizes @blob_sizes.txt --scenario batch
+
+--sizes is a sample of real blob sizes (or @file with one size per line);
+the peak RSS of a local CPython process is close to, but not exactly,
+what the Lambda runtime reports, so keep the headroom.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import subprocess
+import sys
+from typing import Any, Dict, List, Tuple
+from unittest.mock import patch
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+MIN_MEMORY_MB = 128
+MAX_MEMORY_MB = 10240
+MEMORY_STEP_MB = 64
+
+
+def measure(scenario: str, size: int, requests: int) -> Dict[str, Any]:
+    """Profile requests of one scenario and size in this process; returns the largest profile."""
+    import run_bench
+    from fakes import FakeKMS, FakeS3
+
+    s3, kms = FakeS3(latency_ms=0, jitter_ms=0), FakeKMS(latency_ms=0, jitter_ms=0)
+    run_bench.seed_objects(s3, [size])
+    fn, event = run_bench.make_request(scenario, size)
+    env = {'S3_BUCKET': run_bench.DECRYPT_BUCKET, 'KMS_KEY_ID': 'bench-key',
+           'METRICS_SAMPLE_RATE': '0', 'PROFILE_MEMORY': 'on', 'PROFILE_MEMORY_TOP': '5'}
+
+    profiles = []
+    with patch.dict(os.environ, env), \
+            patch.object(run_bench.handler, 's3_client', s3), \
+            patch.object(run_bench.handler, 'kms_client', kms), \
+            patch.object(run_bench.solacesdk_handler, 's3', s3):
+        for _ in range(requests):
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                response = fn(event, None)
+            if response['statusCode'] >= 400:
+                raise RuntimeError(f"{scenario} at {size}B failed: {response['body']}")
+            for line in output.getvalue().splitlines():
+                if line.startswith('{"memoryProfile"'):
+                    profiles.append(json.loads(line)['memoryProfile'])
+    return max(profiles, key=lambda profile: profile['peakRssMb'])
+
+
+def measure_in_child(scenario: str, size: int, requests: int) -> Dict[str, Any]:
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', '--scenario', scenario,
+         '--sizes', str(size), '--requests', str(requests)],
+        capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout)
+
+
+def parse_sizes(value: str) -> List[int]:
+    if value.startswith('@'):
+        with open(value[1:]) as f:
+            return [int(line) for line in f if line.strip()]
+    return [int(size) for size in value.split(',') if size]
+
+
+def percentile(values: List[int], pct: float) -> int:
+    """Nearest-rank percentile."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))]
+
+
+def probe_sizes(sizes: List[int], points: int) -> List[int]:
+    """Up to `points` distinct sizes spread over the distribution, always including min and max."""
+    if points <= 1:
+        return [max(sizes)]
+    return sorted({percentile(sizes, 100 * i / (points - 1)) for i in range(points)})
+
+
+def fit(samples: List[Tuple[int, float]]) -> Tuple[float, float]:
+    """Least-squares (intercept MB, slope MB per byte) of peak RSS against payload size."""
+    if len(samples) == 1:
+        return samples[0][1], 0.0
+    n = len(samples)
+    mean_x = sum(x for x, _ in samples) / n
+    mean_y = sum(y for _, y in samples) / n
+    var_x = sum((x - mean_x) ** 2 for x, _ in samples)
+    if not var_x:
+        return mean_y, 0.0
+    slope = max(0.0, sum((x - mean_x) * (y - mean_y) for x, y in samples) / var_x)
+    return mean_y - slope * mean_x, slope
+
+
+def recommend(peak_mb: float, headroom: float) -> int:
+    memory = math.ceil(peak_mb * headroom / MEMORY_STEP_MB) * MEMORY_STEP_MB
+    return min(MAX_MEMORY_MB, max(MIN_MEMORY_MB, memory))
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', default='decrypt', help='decrypt, batch, upload or download')
+    parser.add_argument('--sizes', default='1024,65536,1048576,4194304',
+                        help='comma-separated blob sizes in bytes, or @file with one per line')
+    parser.add_argument('--percentile', type=float, default=99, help='size percentile to provision for')
+    parser.add_argument('--headroom', type=float, default=1.5, help='multiplier over the predicted peak RSS')
+    parser.add_argument('--points', type=int, default=5, help='sizes measured across the distribution')
+    parser.add_argument('--requests', type=int, default=3, help='profiled requests per size')
+    parser.add_argument('--output', help='where to write the JSON report')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'src'))
+    sys.path.insert(0, BENCH_DIR)
+    sizes = parse_sizes(args.sizes)
+    if args.child:
+        print(json.dumps(measure(args.scenario, sizes[0], args.requests)))
+        return 0
+
+    measurements = []
+    for size in probe_sizes(sizes, args.points):
+        profile = measure_in_child(args.scenario, size, args.requests)
+        measurements.append({'payloadBytes': size, 'peakRssMb': profile['peakRssMb'],
+                             'tracemallocPeakBytes': profile['tracemallocPeakBytes'],
+                             'peakToPayload': profile['peakToPayload'],
+                             'topAllocations': profile['topAllocations']})
+        print(f"{args.scenario:>8} {size:>9}B  peak RSS {profile['peakRssMb']:8.1f} MB  "
+              f"traced peak {profile['tracemallocPeakBytes'] / 1024:10.1f} KiB  "
+              f"x{profile['peakToPayload'] or 0:.1f} payload")
+
+    intercept, slope = fit([(m['payloadBytes'], m['peakRssMb']) for m in measurements])
+    target_size = percentile(sizes, args.percentile)
+    predicted = intercept + slope * target_size
+    report = {
+        'scenario': args.scenario,
+        'percentile': args.percentile,
+        'targetPayloadBytes': target_size,
+        'baselineMb': round(intercept, 2),
+        'mbPerPayloadMb': round(slope * 1024 * 1024, 3),
+        'predictedPeakRssMb': round(predicted, 2),
+        'headroom': args.headroom,
+        'recommendedMemoryMb': recommend(predicted, args.headroom),
+        'measurements': measurements,
+    }
+    print(f"\np{args.percentile:g} blob {target_size}B -> predicted peak {predicted:.1f} MB; "
+          f"recommended lambda_memory_size = {report['recommendedMemoryMb']}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for the Solace Lambda handlers.
+
+Drives handler.lambda_handler and solacesdk_handler.lambda_handler
+in-process against the fake S3/KMS backends in fakes.py, sweeping payload
+sizes, request mixes and concurrency, and writes the results as JSON so
+runs can be compared between commits.
+
+    python3 bench/run_bench.py --output bench_results.json
+    python3 bench/run_bench.py --baseline bench_results.json --fail-on-regression 20
+"""
+
+import argparse
+import base64
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+from unittest.mock import patch
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'src'))
+sys.path.insert(0, BENCH_DIR)
+
+import blob_format
+import handler
+import solacesdk_handler
+from fakes import FakeKMS, FakeS3
+
+DECRYPT_BUCKET = 'bench-bucket'
+BATCH_SIZE = 10
+SCENARIOS = ('decrypt', 'batch', 'upload', 'download')
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def seed_objects(s3: FakeS3, sizes: List[int]) -> None:
+    """Store one KMS blob per size for the decrypt handler and one SDK blob per size."""
+    for size in sizes:
+        plaintext = (b'transcript ' * (size // 11 + 1))[:size]
+        for index in range(BATCH_SIZE):
+            s3.put(DECRYPT_BUCKET, f'kms-{size}-{index}', blob_format.pack_blob(
+                blob_format.ALG_AWS_KMS, b'', FakeKMS.encrypt(plaintext)
+            ), blob_format.CONTENT_TYPE)
+        s3.put(solacesdk_handler.BUCKET, f'sdk-{size}', blob_format.pack_blob(
+            blob_format.ALG_AES_256_GCM, b'\0' * 12, os.urandom(size)
+        ), blob_format.CONTENT_TYPE)
+
+
+def make_request(scenario: str, size: int) -> Tuple[Callable, Dict[str, Any]]:
+    """Return (handler, event) for one request of a scenario."""
+    if scenario == 'decrypt':
+        return handler.lambda_handler, {
+            'httpMethod': 'POST', 'body': json.dumps({'blobKey': f'kms-{size}-0'})
+        }
+    if scenario == 'batch':
+        return handler.lambda_handler, {
+            'httpMethod': 'POST',
+            'body': json.dumps({'blobKeys': [f'kms-{size}-{i}' for i in range(BATCH_SIZE)]})
+        }
+    if scenario == 'upload':
+        return solacesdk_handler.lambda_handler, {
+            'httpMethod': 'POST', 'path': '/upload',
+            'body': json.dumps({
+                'iv': base64.b64encode(b'\0' * 12).decode('ascii'),
+                'ciphertext': base64.b64encode(os.urandom(size)).decode('ascii')
+            })
+        }
+    if scenario == 'download':
+        return solacesdk_handler.lambda_handler, {'httpMethod': 'GET', 'path': f'/blob/sdk-{size}'}
+    raise ValueError(f'Unknown scenario: {scenario}')
+
+
+def run_case(scenario: str, size: int, concurrency: int, requests: int) -> Dict[str, Any]:
+    """Measure latency, throughput and per-request peak allocation for one case."""
+    fn, event = make_request(scenario, size)
+
+    # Peak allocation of a single request, measured apart from the timed runs
+    tracemalloc.start()
+    fn(event, None)
+    _, peak_alloc = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    def timed(_: int) -> Tuple[float, int]:
+        started = time.perf_counter()
+        response = fn(event, None)
+        return (time.perf_counter() - started) * 1000, response['statusCode']
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(timed, range(requests)))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, _ in samples)
+    return {
+        'scenario': scenario,
+        'payloadBytes': size,
+        'concurrency': concurrency,
+        'requests': requests,
+        'errors': sum(1 for _, status in samples if status >= 400),
+        'throughputRps': round(requests / wall, 2),
+        'p50Ms': round(percentile(latencies, 0.50), 3),
+        'p90Ms': round(percentile(latencies, 0.90), 3),
+        'p99Ms': round(percentile(latencies, 0.99), 3),
+        'maxMs': round(latencies[-1], 3),
+        'peakAllocBytes': peak_alloc,
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any], threshold: float) -> bool:
+    """Print p50/p99/throughput changes against a baseline; return True if any exceeds threshold %."""
+    previous = {(r['scenario'], r['payloadBytes'], r['concurrency']): r for r in baseline['results']}
+    regressed = False
+    print(f"\nCompared with {baseline['meta'].get('revision', 'baseline')}:")
+    for result in results:
+        old = previous.get((result['scenario'], result['payloadBytes'], result['concurrency']))
+        if old is None:
+            continue
+        changes = {}
+        for field, worse_when_higher in (('p50Ms', True), ('p99Ms', True), ('throughputRps', False)):
+            if old[field]:
+                change = (result[field] - old[field]) / old[field] * 100
+                changes[field] = change
+                if threshold is not None and (change if worse_when_higher else -change) > threshold:
+                    regressed = True
+        print(f"  {result['scenario']:>8} {result['payloadBytes']:>8}B x{result['concurrency']:<3} "
+              + '  '.join(f'{field} {change:+.1f}%' for field, change in changes.items()))
+    return regressed
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help='comma-separated request mix (decrypt,batch,upload,download)')
+    parser.add_argument('--sizes', default='1024,65536,1048576', help='comma-separated payload sizes in bytes')
+    parser.add_argument('--concurrency', default='1,8', help='comma-separated concurrency levels')
+    parser.add_argument('--requests', type=int, default=100, help='requests per case')
+    parser.add_argument('--latency-ms', type=float, default=5.0, help='mean injected S3/KMS latency')
+    parser.add_argument('--jitter-ms', type=float, default=2.0, help='uniform jitter around the latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of backend calls that fail')
+    parser.add_argument('--error-code', default='InternalError',
+                        help='AWS error code of injected failures, e.g. ThrottlingException')
+    parser.add_argument('--tail-rate', type=float, default=0.0,
+                        help='fraction of backend calls slowed down by --tail-ms (to exercise S3_HEDGE)')
+    parser.add_argument('--tail-ms', type=float, default=0.0, help='extra latency of tail calls')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for jitter and errors')
+    parser.add_argument('--output', default='bench_results.json', help='where to write the JSON results')
+    parser.add_argument('--baseline', help='previous results file to compare against')
+    parser.add_argument('--fail-on-regression', type=float, metavar='PCT',
+                        help='exit non-zero if a p50/p99/throughput change vs the baseline exceeds PCT')
+    args = parser.parse_args(argv)
+
+    scenarios = [name for name in args.scenarios.split(',') if name]
+    sizes = [int(size) for size in args.sizes.split(',')]
+    concurrencies = [int(level) for level in args.concurrency.split(',')]
+
+    backend = dict(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                   error_rate=args.error_rate, error_code=args.error_code, seed=args.seed,
+                   tail_rate=args.tail_rate, tail_ms=args.tail_ms)
+    s3, kms = FakeS3(**backend), FakeKMS(**backend)
+    seed_objects(s3, sizes)
+
+    env = {'S3_BUCKET': DECRYPT_BUCKET, 'KMS_KEY_ID': 'bench-key', 'METRICS_SAMPLE_RATE': '0'}
+    results = []
+    with patch.dict(os.environ, env), \
+            patch.object(handler, 's3_client', s3), \
+            patch.object(handler, 'kms_client', kms), \
+            patch.object(solacesdk_handler, 's3', s3):
+        for scenario in scenarios:
+            for size in sizes:
+                for concurrency in concurrencies:
+                    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+                        result = run_case(scenario, size, concurrency, args.requests)
+                    results.append(result)
+                    print(f"{scenario:>8} {size:>8}B x{concurrency:<3} "
+                          f"p50 {result['p50Ms']:8.2f}ms  p99 {result['p99Ms']:8.2f}ms  "
+                          f"{result['throughputRps']:8.1f} req/s  peak {result['peakAllocBytes'] / 1024:9.1f} KiB  "
+                          f"errors {result['errors']}")
+
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': int(time.time()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'backend': backend,
+            'requestsPerCase': args.requests,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'\nWrote {len(results)} results to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            if compare(results, json.load(f), args.fail_on_regression):
+                print(f'Regression above {args.fail_on_regression}% detected')
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
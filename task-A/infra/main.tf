@@ -9,6 +9,10 @@ terraform {
       source  = "hashicorp/archive"
       version = "~> 2.0"
     }
+    null = {
+      source  = "hashicorp/null"
+      version = "~> 3.0"
+    }
   }
 }
 
@@ -186,6 +190,40 @@ resource "aws_cloudwatch_log_group" "lambda_logs" {
   retention_in_days = 14
 }
 
+# Third-party packages from src/requirements.txt (cryptography for envelope
+# blobs is not in the Lambda runtime, and the bundled boto3 predates S3
+# conditional writes), installed as Linux wheels for the runtime
+resource "null_resource" "lambda_dependencies" {
+  triggers = {
+    requirements = filesha256("${path.module}/../src/requirements.txt")
+    runtime      = var.lambda_runtime
+  }
+
+  provisioner "local-exec" {
+    command = join(" ", [
+      "rm -rf ${path.module}/build/layer &&",
+      "pip install -r ${path.module}/../src/requirements.txt",
+      "--target ${path.module}/build/layer/python",
+      "--platform manylinux2014_x86_64 --implementation cp --only-binary=:all:",
+      "--python-version ${trimprefix(var.lambda_runtime, "python")}",
+    ])
+  }
+}
+
+data "archive_file" "dependencies_zip" {
+  type        = "zip"
+  source_dir  = "${path.module}/build/layer"
+  output_path = "${path.module}/build/dependencies.zip"
+  depends_on  = [null_resource.lambda_dependencies]
+}
+
+resource "aws_lambda_layer_version" "dependencies" {
+  layer_name          = "${var.project_name}-dependencies"
+  filename            = data.archive_file.dependencies_zip.output_path
+  source_code_hash    = data.archive_file.dependencies_zip.output_base64sha256
+  compatible_runtimes = [var.lambda_runtime]
+}
+
 # Create ZIP file from Lambda source code
 data "archive_file" "lambda_zip" {
   type        = "zip"
@@ -199,9 +237,10 @@ resource "aws_lambda_function" "decrypt_function" {
   function_name    = "${var.project_name}-decrypt"
   role            = aws_iam_role.lambda_role.arn
   handler         = "handler.lambda_handler"
-  runtime         = "python3.9"
-  timeout         = 15
-  memory_size     = 256
+  runtime         = var.lambda_runtime
+  timeout         = var.lambda_timeout
+  memory_size     = var.lambda_memory_size
+  layers          = [aws_lambda_layer_version.dependencies.arn]
 
   environment {
     variables = {
@@ -260,12 +299,20 @@ resource "aws_lambda_function" "solacesdk_handler" {
   function_name = "solacesdk-handler"
   role          = aws_iam_role.solacesdk_lambda_role.arn
   handler       = "solacesdk_handler.lambda_handler"
-  runtime       = "python3.11"
-  filename      = "../src/solacesdk_handler.zip"
-  source_code_hash = filebase64sha256("../src/solacesdk_handler.zip")
+  # Same package and dependency layer as the decrypt function: conditional
+  # PutObject (manifests, ledgers) needs a newer botocore than the runtime's
+  runtime       = var.lambda_runtime
+  filename      = data.archive_file.lambda_zip.output_path
+  source_code_hash = data.archive_file.lambda_zip.output_base64sha256
+  layers        = [aws_lambda_layer_version.dependencies.arn]
+  # API requests are cut off by the HTTP API at 30 s anyway; the expiry sweep
+  # resumes itself in a new invocation rather than needing a longer timeout
+  timeout       = var.solacesdk_timeout
+  memory_size   = var.solacesdk_memory_size
   environment {
     variables = {
       SOLACE_BLOB_BUCKET = aws_s3_bucket.solace_blob.bucket
+      BLOB_TTL_SECONDS   = var.blob_ttl_seconds
     }
   }
 }
@@ -277,7 +324,8 @@ resource "aws_apigatewayv2_api" "solacesdk_api" {
   cors_configuration {
     allow_origins = ["*"]
     allow_methods = ["OPTIONS", "GET", "POST"]
-    allow_headers = ["Content-Type", "Authorization"]
+    allow_headers = ["Content-Type", "Authorization", "X-Owner-Id", "If-None-Match", "Range", "If-Range"]
+    expose_headers = ["ETag", "Content-Range", "Accept-Ranges"]
     max_age = 86400
   }
 }
@@ -288,16 +336,140 @@ resource "aws_apigatewayv2_integration" "solacesdk_lambda_integration" {
   integration_uri  = aws_lambda_function.solacesdk_handler.invoke_arn
 }
 
+# Owner-scoped routes (listing, delete, compaction, manifest recording) need
+# an authenticated principal; without an issuer every caller is anonymous
+resource "aws_apigatewayv2_authorizer" "solacesdk_jwt" {
+  count            = var.solacesdk_jwt_issuer != null ? 1 : 0
+  api_id           = aws_apigatewayv2_api.solacesdk_api.id
+  authorizer_type  = "JWT"
+  identity_sources = ["$request.header.Authorization"]
+  name             = "solacesdk-jwt"
+
+  jwt_configuration {
+    issuer   = var.solacesdk_jwt_issuer
+    audience = var.solacesdk_jwt_audience
+  }
+}
+
+locals {
+  solacesdk_authorization_type = var.solacesdk_jwt_issuer != null ? "JWT" : "NONE"
+  solacesdk_authorizer_id      = var.solacesdk_jwt_issuer != null ? aws_apigatewayv2_authorizer.solacesdk_jwt[0].id : null
+}
+
 resource "aws_apigatewayv2_route" "solacesdk_upload" {
-  api_id    = aws_apigatewayv2_api.solacesdk_api.id
-  route_key = "POST /upload"
-  target    = "integrations/${aws_apigatewayv2_integration.solacesdk_lambda_integration.id}"
+  api_id             = aws_apigatewayv2_api.solacesdk_api.id
+  route_key          = "POST /upload"
+  target             = "integrations/${aws_apigatewayv2_integration.solacesdk_lambda_integration.id}"
+  authorization_type = local.solacesdk_authorization_type
+  authorizer_id      = local.solacesdk_authorizer_id
+}
+
+resource "aws_apigatewayv2_route" "solacesdk_upload_batch" {
+  api_id             = aws_apigatewayv2_api.solacesdk_api.id
+  route_key          = "POST /upload/batch"
+  target             = "integrations/${aws_apigatewayv2_integration.solacesdk_lambda_integration.id}"
+  authorization_type = local.solacesdk_authorization_type
+  authorizer_id      = local.solacesdk_authorizer_id
 }
 
 resource "aws_apigatewayv2_route" "solacesdk_blob" {
-  api_id    = aws_apigatewayv2_api.solacesdk_api.id
-  route_key = "GET /blob/{blobKey+}"
-  target    = "integrations/${aws_apigatewayv2_integration.solacesdk_lambda_integration.id}"
+  api_id             = aws_apigatewayv2_api.solacesdk_api.id
+  route_key          = "GET /blob/{blobKey+}"
+  target             = "integrations/${aws_apigatewayv2_integration.solacesdk_lambda_integration.id}"
+  authorization_type = local.solacesdk_authorization_type
+  authorizer_id      = local.solacesdk_authorizer_id
+}
+
+resource "aws_apigatewayv2_route" "solacesdk_upload_url" {
+  api_id             = aws_apigatewayv2_api.solacesdk_api.id
+  route_key          = "POST /upload-url"
+  target             = "integrations/${aws_apigatewayv2_integration.solacesdk_lambda_integration.id}"
+  authorization_type = local.solacesdk_authorization_type
+  authorizer_id      = local.solacesdk_authorizer_id
+}
+
+resource "aws_apigatewayv2_route" "solacesdk_blob_url" {
+  api_id             = aws_apigatewayv2_api.solacesdk_api.id
+  route_key          = "GET /blob-url/{blobKey+}"
+  target             = "integrations/${aws_apigatewayv2_integration.solacesdk_lambda_integration.id}"
+  authorization_type = local.solacesdk_authorization_type
+  authorizer_id      = local.solacesdk_authorizer_id
+}
+
+resource "aws_apigatewayv2_route" "solacesdk_list_blobs" {
+  api_id             = aws_apigatewayv2_api.solacesdk_api.id
+  route_key          = "GET /blobs"
+  target             = "integrations/${aws_apigatewayv2_integration.solacesdk_lambda_integration.id}"
+  authorization_type = local.solacesdk_authorization_type
+  authorizer_id      = local.solacesdk_authorizer_id
+}
+
+resource "aws_apigatewayv2_route" "solacesdk_delete_blobs" {
+  api_id             = aws_apigatewayv2_api.solacesdk_api.id
+  route_key          = "POST /blobs/delete"
+  target             = "integrations/${aws_apigatewayv2_integration.solacesdk_lambda_integration.id}"
+  authorization_type = local.solacesdk_authorization_type
+  authorizer_id      = local.solacesdk_authorizer_id
+}
+
+resource "aws_apigatewayv2_route" "solacesdk_compact_blobs" {
+  api_id             = aws_apigatewayv2_api.solacesdk_api.id
+  route_key          = "POST /blobs/compact"
+  target             = "integrations/${aws_apigatewayv2_integration.solacesdk_lambda_integration.id}"
+  authorization_type = local.solacesdk_authorization_type
+  authorizer_id      = local.solacesdk_authorizer_id
+}
+
+# Hourly expiry sweep, only when a blob TTL is configured
+resource "aws_cloudwatch_event_rule" "solacesdk_expiry" {
+  count               = var.blob_ttl_seconds > 0 ? 1 : 0
+  name                = "solacesdk-blob-expiry"
+  schedule_expression = "rate(1 hour)"
+}
+
+resource "aws_cloudwatch_event_target" "solacesdk_expiry" {
+  count = var.blob_ttl_seconds > 0 ? 1 : 0
+  rule  = aws_cloudwatch_event_rule.solacesdk_expiry[0].name
+  arn   = aws_lambda_function.solacesdk_handler.arn
+  input = jsonencode({ action = "expire" })
+}
+
+# An expiry sweep that runs out of time invokes the function again to resume
+resource "aws_iam_role_policy" "solacesdk_expiry_resume" {
+  count = var.blob_ttl_seconds > 0 ? 1 : 0
+  name  = "solacesdk-expiry-resume"
+  role  = aws_iam_role.solacesdk_lambda_role.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [{
+      Effect   = "Allow"
+      Action   = "lambda:InvokeFunction"
+      Resource = aws_lambda_function.solacesdk_handler.arn
+    }]
+  })
+}
+
+resource "aws_lambda_permission" "events_solacesdk_expiry" {
+  count         = var.blob_ttl_seconds > 0 ? 1 : 0
+  statement_id  = "AllowEventBridgeExpirySweep"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.solacesdk_handler.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.solacesdk_expiry[0].arn
+}
+
+# Browsers PUT/GET blob bytes directly against presigned URLs
+resource "aws_s3_bucket_cors_configuration" "solace_blob" {
+  bucket = aws_s3_bucket.solace_blob.id
+
+  cors_rule {
+    allowed_methods = ["GET", "PUT"]
+    allowed_origins = ["*"]
+    allowed_headers = ["Content-Type", "Content-Length"]
+    expose_headers  = ["ETag"]
+    max_age_seconds = 3000
+  }
 }
 
 resource "aws_lambda_permission" "apigw_solacesdk" {
@@ -323,4 +495,34 @@ variable "solace_blob_bucket" {
   description = "S3 bucket for storing encrypted blobs."
   type        = string
   default     = "solace-blob-bucket"
-} 
\ No newline at end of file
+} 
+
+variable "solacesdk_timeout" {
+  description = "Solace SDK Lambda timeout in seconds; each expiry sweep run fits in it and resumes in the next."
+  type        = number
+  default     = 29
+}
+
+variable "solacesdk_memory_size" {
+  description = "Solace SDK Lambda memory size in MB."
+  type        = number
+  default     = 512
+}
+
+variable "blob_ttl_seconds" {
+  description = "Delete Solace SDK blobs older than this many seconds (0 keeps them forever)."
+  type        = number
+  default     = 0
+}
+
+variable "solacesdk_jwt_issuer" {
+  description = "Issuer URL of the JWTs that authenticate Solace SDK callers; the token's sub is the blob owner. Null leaves the API unauthenticated."
+  type        = string
+  default     = null
+}
+
+variable "solacesdk_jwt_audience" {
+  description = "Accepted audiences of Solace SDK JWTs."
+  type        = list(string)
+  default     = []
+}
@@ -46,7 +46,7 @@ fi
 
 # Install dependencies if needed
 print_status "Installing Python dependencies..."
-pip install boto3 botocore
+pip install -r src/requirements.txt
 
 # Run unit tests
 print_status "Running unit tests..."
@@ -60,6 +60,26 @@ else
     exit 1
 fi
 
+print_status "Running SDK handler tests..."
+python3 test_solacesdk_handler.py
+
+if [ $? -eq 0 ]; then
+    print_success "SDK handler tests passed!"
+else
+    print_error "SDK handler tests failed!"
+    exit 1
+fi
+
+print_status "Running server tests..."
+python3 test_server.py
+
+if [ $? -eq 0 ]; then
+    print_success "Server tests passed!"
+else
+    print_error "Server tests failed!"
+    exit 1
+fi
+
 cd ..
 
 # Run local function test
@@ -0,0 +1,123 @@
+"""
+Shared, lazily constructed AWS clients for the Lambda handlers.
+
+boto3 is only imported, and a client only built, the first time a handler
+actually calls an AWS API. OPTIONS preflights and validation errors never
+pay for it. All clients come from one boto3 session, so credentials,
+endpoint data and the botocore loader are resolved once per container.
+
+Every client gets the same botocore Config, driven by environment
+variables so timeouts and retries can be tuned to fit the Lambda timeout:
+
+    AWS_CLIENT_MAX_POOL_CONNECTIONS  keep-alive connections per client (16)
+    AWS_CLIENT_TCP_KEEPALIVE         enable TCP keep-alive probes (true)
+    AWS_CLIENT_CONNECT_TIMEOUT       seconds to establish a connection (1)
+    AWS_CLIENT_READ_TIMEOUT          seconds to wait for a response (3)
+    AWS_CLIENT_RETRY_MODE            botocore retry mode: legacy, standard, adaptive (standard)
+    AWS_CLIENT_MAX_ATTEMPTS          total attempts including the first (3)
+    AWS_KMS_MAX_ATTEMPTS             botocore attempts for KMS (1); the handler's
+                                     KmsGuard (throttle.py) owns KMS retries
+"""
+
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+_session = None
+_clients: Dict[str, Any] = {}
+_lock = threading.Lock()
+
+
+def get_session() -> Any:
+    """Return the container-wide boto3 session, creating it on first use."""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                import boto3
+                _session = boto3.session.Session()
+    return _session
+
+
+def client_config(service_name: Optional[str] = None) -> Any:
+    """Build the botocore Config shared by all clients from the environment."""
+    from botocore.config import Config
+    return Config(
+        # SigV4 presigned S3 URLs sign Content-Type and Content-Length
+        signature_version='s3v4' if service_name == 's3' else None,
+        max_pool_connections=int(os.environ.get('AWS_CLIENT_MAX_POOL_CONNECTIONS', '16')),
+        tcp_keepalive=os.environ.get('AWS_CLIENT_TCP_KEEPALIVE', 'true').lower() in ('1', 'true', 'yes'),
+        connect_timeout=float(os.environ.get('AWS_CLIENT_CONNECT_TIMEOUT', '1')),
+        read_timeout=float(os.environ.get('AWS_CLIENT_READ_TIMEOUT', '3')),
+        retries={
+            'mode': os.environ.get('AWS_CLIENT_RETRY_MODE', 'standard'),
+            'total_max_attempts': int(
+                os.environ.get('AWS_KMS_MAX_ATTEMPTS', '1') if service_name == 'kms'
+                else os.environ.get('AWS_CLIENT_MAX_ATTEMPTS', '3')
+            ),
+        },
+    )
+
+
+def get_client(service_name: str, region_name: Optional[str] = None) -> Any:
+    """Return the shared client for service_name (in region_name, if given), creating it on first use."""
+    name = f'{service_name}@{region_name}' if region_name else service_name
+    client = _clients.get(name)
+    if client is None:
+        session = get_session()
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                regional = {'region_name': region_name} if region_name else {}
+                client = session.client(service_name, config=client_config(service_name), **regional)
+                _clients[name] = client
+    return client
+
+
+def built_clients() -> List[str]:
+    """Names of the services whose clients have been constructed so far."""
+    return sorted(_clients)
+
+
+def reset() -> None:
+    """Drop the shared session and clients (used by tests)."""
+    global _session
+    with _lock:
+        _session = None
+        _clients.clear()
+
+
+def error_code(error: Exception) -> str:
+    """The AWS error code of a botocore ClientError ('' for anything else), without importing botocore."""
+    response = getattr(error, 'response', None) or {}
+    return str(response.get('Error', {}).get('Code', ''))
+
+
+def epoch_seconds(value: Any) -> float:
+    """A timestamp from an AWS response (boto3 returns datetimes) as epoch seconds; plain numbers pass through."""
+    return value.timestamp() if hasattr(value, 'timestamp') else float(value)
+
+
+class LazyClient:
+    """
+    Module-level stand-in for a boto3 client that builds it on first attribute access.
+
+    Handlers bind these at import time (s3_client = LazyClient('s3')) so the
+    rest of the code, and tests that patch those names, use them exactly
+    like eager clients.
+    """
+
+    def __init__(self, service_name: str, region_name: Optional[str] = None):
+        self._service_name = service_name
+        self._region_name = region_name
+
+    def __getattr__(self, name: str) -> Any:
+        # Introspection (e.g. by mock.patch) must not build the client
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(get_client(self._service_name, self._region_name), name)
+
+    def __repr__(self) -> str:
+        if self._region_name:
+            return f'LazyClient({self._service_name!r}, {self._region_name!r})'
+        return f'LazyClient({self._service_name!r})'
@@ -0,0 +1,194 @@
+"""
+Versioned binary container for stored Solace blobs.
+
+Replaces JSON-wrapped base64 (`{"iv": ..., "ciphertext": ...}`) at rest,
+which inflates every blob by about a third and has to be parsed on every
+read. Layout:
+
+    magic        4 bytes   b'SBLB'
+    version      1 byte    1
+    algorithm    1 byte    ALG_AES_256_GCM or ALG_AWS_KMS
+    iv length    1 byte    0 when the algorithm has no IV
+    iv           n bytes
+    ciphertext   rest      raw ciphertext bytes
+
+parse_blob returns memoryview slices into the original buffer, so reading
+a container never copies the ciphertext.
+
+parse_upload turns an SDK upload document straight into a container,
+validating sizes and base64 on the way. orjson is used for the JSON
+parse when it is installed.
+"""
+
+import base64
+import binascii
+import json
+import struct
+from typing import Any, Dict, List, Union
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:  # pragma: no cover - optional speed-up
+    _json_loads = json.loads
+
+BLOB_MAGIC = b'SBLB'
+BLOB_VERSION = 1
+CONTENT_TYPE = 'application/vnd.solace.blob'
+
+# Client-side AES-256-GCM (the SDK's encryptBlob); the IV is in the header
+ALG_AES_256_GCM = 1
+# A KMS Encrypt CiphertextBlob; no IV
+ALG_AWS_KMS = 2
+
+_HEADER = struct.Struct('>4sBBB')
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+class BlobFormatError(ValueError):
+    """Raised when a buffer is not a valid blob container."""
+
+
+class UploadTooLarge(BlobFormatError):
+    """Raised when an upload exceeds the configured size limits."""
+
+
+class BlobContainer:
+    """Parsed container fields; iv and ciphertext are views into the source buffer."""
+
+    __slots__ = ('version', 'algorithm', 'iv', 'ciphertext')
+
+    def __init__(self, version: int, algorithm: int, iv: memoryview, ciphertext: memoryview):
+        self.version = version
+        self.algorithm = algorithm
+        self.iv = iv
+        self.ciphertext = ciphertext
+
+    def to_legacy_json(self) -> str:
+        """Render as the legacy {"iv", "ciphertext"} JSON document SDK clients expect."""
+        return json.dumps({
+            'iv': base64.b64encode(self.iv).decode('ascii'),
+            'ciphertext': base64.b64encode(self.ciphertext).decode('ascii'),
+        })
+
+
+def is_blob(data: Buffer) -> bool:
+    """Return True if data starts with the container magic number."""
+    return bytes(data[:len(BLOB_MAGIC)]) == BLOB_MAGIC
+
+
+def pack_blob(algorithm: int, iv: Buffer, ciphertext: Buffer) -> bytes:
+    """Serialize a container."""
+    if len(iv) > 255:
+        raise BlobFormatError('IV is too long')
+    return b''.join((_HEADER.pack(BLOB_MAGIC, BLOB_VERSION, algorithm, len(iv)), iv, ciphertext))
+
+
+def parse_blob(data: Buffer) -> BlobContainer:
+    """Parse a container without copying its payload."""
+    view = memoryview(data)
+    if len(view) < _HEADER.size:
+        raise BlobFormatError('Blob is truncated')
+    magic, version, algorithm, iv_length = _HEADER.unpack_from(view)
+    if magic != BLOB_MAGIC:
+        raise BlobFormatError('Blob is not a container')
+    if version != BLOB_VERSION:
+        raise BlobFormatError(f'Unsupported blob version: {version}')
+
+    iv_end = _HEADER.size + iv_length
+    if len(view) < iv_end:
+        raise BlobFormatError('Blob is truncated')
+    return BlobContainer(version, algorithm, view[_HEADER.size:iv_end], view[iv_end:])
+
+
+def _max_encoded_length(decoded_bytes: int) -> int:
+    """Length of the padded base64 encoding of decoded_bytes bytes."""
+    return 4 * ((decoded_bytes + 2) // 3)
+
+
+def parse_upload(body: Union[str, bytes], iv_length: int = 12, max_ciphertext_bytes: int = 4 * 1024 * 1024) -> bytes:
+    """
+    Validate an {"iv", "ciphertext"} upload document and return it packed as a container.
+
+    Sizes are checked on the encoded text before anything is decoded, so
+    an oversized upload is refused without decoding it. Each field is then
+    decoded exactly once with strict base64 validation. Raises
+    UploadTooLarge or BlobFormatError with a client-facing message.
+    """
+    # Generous allowance for the IV, the field names and whitespace
+    if len(body) > _max_encoded_length(max_ciphertext_bytes) + 1024:
+        raise UploadTooLarge(f'Upload exceeds {max_ciphertext_bytes} bytes of ciphertext')
+    try:
+        document = _json_loads(body)
+    except ValueError:
+        raise BlobFormatError('Invalid JSON in request body')
+    if not isinstance(document, dict):
+        raise BlobFormatError('Request body must be a JSON object')
+    return pack_upload(document, iv_length, max_ciphertext_bytes)
+
+
+def parse_upload_batch(body: Union[str, bytes], max_items: int, max_body_bytes: int, iv_length: int = 12,
+                       max_ciphertext_bytes: int = 4 * 1024 * 1024) -> List[Union[bytes, BlobFormatError]]:
+    """
+    Validate an {"items": [{"iv", "ciphertext"}, ...]} batch upload.
+
+    Returns one entry per item, in order: the packed container, or the
+    BlobFormatError explaining why that item was rejected. Errors in the
+    batch as a whole (size, JSON, shape) are raised instead.
+    """
+    if len(body) > max_body_bytes:
+        raise UploadTooLarge(f'Batch upload exceeds {max_body_bytes} bytes')
+    try:
+        document = _json_loads(body)
+    except ValueError:
+        raise BlobFormatError('Invalid JSON in request body')
+    items = document.get('items') if isinstance(document, dict) else None
+    if not isinstance(items, list) or not items:
+        raise BlobFormatError('items must be a non-empty list')
+    if len(items) > max_items:
+        raise BlobFormatError(f'At most {max_items} items per batch')
+
+    results: List[Union[bytes, BlobFormatError]] = []
+    for item in items:
+        try:
+            if not isinstance(item, dict):
+                raise BlobFormatError('Each item must be a JSON object')
+            results.append(pack_upload(item, iv_length, max_ciphertext_bytes))
+        except BlobFormatError as e:
+            results.append(e)
+    return results
+
+
+def pack_upload(document: Dict[str, Any], iv_length: int = 12, max_ciphertext_bytes: int = 4 * 1024 * 1024) -> bytes:
+    """Validate one parsed {"iv", "ciphertext"} document and pack it as a container."""
+    iv = document.get('iv')
+    ciphertext = document.get('ciphertext')
+    if not isinstance(iv, str) or not iv:
+        raise BlobFormatError('iv must be a non-empty base64 string')
+    if not isinstance(ciphertext, str) or not ciphertext:
+        raise BlobFormatError('ciphertext must be a non-empty base64 string')
+    if len(iv) != _max_encoded_length(iv_length):
+        raise BlobFormatError(f'iv must be {iv_length} bytes')
+    if len(ciphertext) > _max_encoded_length(max_ciphertext_bytes):
+        raise UploadTooLarge(f'ciphertext exceeds {max_ciphertext_bytes} bytes')
+
+    try:
+        iv_bytes = base64.b64decode(iv, validate=True)
+        ciphertext_bytes = base64.b64decode(ciphertext, validate=True)
+    except (binascii.Error, ValueError):
+        raise BlobFormatError('iv and ciphertext must be valid base64')
+    if len(iv_bytes) != iv_length:
+        raise BlobFormatError(f'iv must be {iv_length} bytes')
+    return pack_blob(ALG_AES_256_GCM, iv_bytes, ciphertext_bytes)
+
+
+def from_legacy_json(document: Union[str, bytes]) -> BlobContainer:
+    """Read a legacy {"iv", "ciphertext"} JSON document into a container."""
+    try:
+        fields = json.loads(document)
+        iv = base64.b64decode(fields['iv'], validate=True)
+        ciphertext = base64.b64decode(fields['ciphertext'], validate=True)
+    except (ValueError, KeyError, TypeError) as e:
+        raise BlobFormatError(f'Invalid legacy blob: {e}')
+    return BlobContainer(BLOB_VERSION, ALG_AES_256_GCM, memoryview(iv), memoryview(ciphertext))
@@ -0,0 +1,193 @@
+"""
+Bulk blob deletion and TTL expiry.
+
+Keys are deleted with DeleteObjects, up to 1000 keys per call, with the
+calls running in parallel. S3 reports success or failure for each key,
+so every key gets its own result and a partial failure never hides which
+blobs are gone. Deleting a key that does not exist succeeds, as in S3.
+
+The expiry sweep lists the bucket, deletes blobs uploaded before the
+cutoff, and drops the blobs it deleted from every manifest. Entries of
+blobs a truncated run left, or failed to delete, stay listed so their
+owners can still delete them. A run stops listing at its key limit, or
+when only reserve_ms of its deadline is left for the deletes, and
+reports the last key it looked at, so the next run can resume after it
+with the same cutoff. A
+compacted blob's pointer is rewritten at compaction, so its LastModified
+is not the upload time: pointers are the only empty blobs, and each is
+HEADed for the upload time it records. Deleted pointers are released
+from their segments, and a segment with no live blob left is deleted
+(segments.release). Manifests are never deleted or expired.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import deadline
+import manifest
+import metrics
+import segments
+from aws_clients import epoch_seconds, error_code
+from deadline import DeadlineExceeded
+
+DELETE_BATCH_SIZE = 1000
+
+
+def _objects(s3_client: Any, bucket: str, prefix: str = '',
+             start_after: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Every object under prefix (after start_after, if given), one ListObjectsV2 page at a time."""
+    kwargs = {'Bucket': bucket, 'Prefix': prefix}
+    if start_after:
+        kwargs['StartAfter'] = start_after
+    while True:
+        page = s3_client.list_objects_v2(**kwargs)
+        yield from page.get('Contents', [])
+        if not page.get('IsTruncated'):
+            return
+        kwargs['ContinuationToken'] = page['NextContinuationToken']
+
+
+def list_expired(s3_client: Any, bucket: str, cutoff: float, limit: int, start_after: Optional[str] = None,
+                 reserve_ms: float = 0) -> Tuple[Dict[str, Optional[str]], Optional[str]]:
+    """
+    Blobs uploaded before cutoff (epoch seconds), at most limit, and the key to resume after.
+
+    Maps each blob key to the segment it was compacted into, or None. The
+    resume key is None once the listing is complete; otherwise the run
+    stopped at limit, or with only reserve_ms of its deadline left.
+    """
+    expired: Dict[str, Optional[str]] = {}
+    last = start_after
+    for obj in _objects(s3_client, bucket, start_after=start_after):
+        remaining = deadline.remaining_ms()
+        if remaining is not None and remaining < reserve_ms:
+            return expired, last
+        if obj['Key'].startswith((manifest.MANIFEST_PREFIX, segments.SEGMENT_PREFIX)):
+            last = obj['Key']
+            continue
+        uploaded_at, segment_key = epoch_seconds(obj['LastModified']), None
+        if not obj.get('Size'):
+            try:
+                head = s3_client.head_object(Bucket=bucket, Key=obj['Key'])
+            except Exception as e:
+                if error_code(e) not in ('NoSuchKey', '404', 'NotFound'):
+                    raise
+                last = obj['Key']
+                continue
+            location = segments.pointer_location(head)
+            if location is not None:
+                uploaded_at, segment_key = segments.uploaded_at(head), location.segment
+        if uploaded_at < cutoff:
+            if len(expired) == limit:
+                return expired, last
+            expired[obj['Key']] = segment_key
+        last = obj['Key']
+    return expired, None
+
+
+def delete_keys(s3_client: Any, bucket: str, blob_keys: List[str], max_workers: int = 4) -> List[Dict[str, Any]]:
+    """
+    Delete blobs in parallel DeleteObjects batches; one result per key, in request order.
+
+    A result is {"blobKey", "statusCode": 200} or, for a failed key,
+    {"blobKey", "statusCode", "error"} with S3's error code.
+    """
+    unique_keys = list(dict.fromkeys(blob_keys))
+    batches = [unique_keys[i:i + DELETE_BATCH_SIZE] for i in range(0, len(unique_keys), DELETE_BATCH_SIZE)]
+
+    def delete_batch(batch: List[str]) -> Dict[str, Dict[str, Any]]:
+        try:
+            response = s3_client.delete_objects(Bucket=bucket, Delete={
+                'Objects': [{'Key': key} for key in batch], 'Quiet': True
+            })
+        except DeadlineExceeded as e:
+            return {key: {'blobKey': key, 'statusCode': e.status_code, 'error': str(e)} for key in batch}
+        except Exception as e:
+            code = error_code(e)
+            if not code:
+                metrics.log('unexpected_error', phase='delete_batch', error=type(e).__name__)
+            failure = _failure(code or 'InternalError')
+            return {key: {'blobKey': key, **failure} for key in batch}
+        # Quiet mode lists only the failures; every other key was deleted
+        results = {key: {'blobKey': key, 'statusCode': 200} for key in batch}
+        for error in response.get('Errors', []):
+            results[error['Key']] = {'blobKey': error['Key'], **_failure(error.get('Code', 'InternalError'))}
+        return results
+
+    results: Dict[str, Dict[str, Any]] = {}
+    if batches:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as executor:
+            futures = [metrics.submit(executor, delete_batch, batch) for batch in batches]
+            for future in futures:
+                results.update(future.result())
+    metrics.add('DeleteBatches', len(batches))
+    return [results[key] for key in blob_keys]
+
+
+def _failure(code: str) -> Dict[str, Any]:
+    return {'statusCode': 403 if code == 'AccessDenied' else 500, 'error': code}
+
+
+def release_segments(s3_client: Any, bucket: str, deleted: List[str],
+                     segment_of: Dict[str, Optional[str]]) -> int:
+    """
+    Release deleted compacted blobs from their segments; returns how many segments were deleted.
+
+    The blobs are gone either way, so a failure is logged and counted: the
+    segment then outlives its blobs.
+    """
+    released: Dict[str, List[str]] = {}
+    for blob_key in deleted:
+        if segment_of.get(blob_key):
+            released.setdefault(segment_of[blob_key], []).append(blob_key)
+    if not released:
+        return 0
+    try:
+        with metrics.phase('SegmentRelease'):
+            return len(segments.release(s3_client, bucket, released))
+    except Exception as e:
+        metrics.add('SegmentReleaseErrors', 1)
+        metrics.log('segment_release_error', error=type(e).__name__)
+        return 0
+
+
+def sweep(s3_client: Any, bucket: str, ttl_seconds: float, limit: int, max_workers: int = 4,
+          now: Optional[float] = None, cutoff: Optional[float] = None, start_after: Optional[str] = None,
+          reserve_ms: float = 0) -> Dict[str, Any]:
+    """
+    Delete blobs older than ttl_seconds (at most limit per run) and drop the deleted ones from the manifests.
+
+    A run resuming an earlier one passes that run's cutoff and its
+    report's startAfter, which is None once the whole bucket was listed.
+    """
+    if cutoff is None:
+        cutoff = (time.time() if now is None else now) - ttl_seconds
+    with metrics.phase('ExpiryList'):
+        expired, resume_after = list_expired(s3_client, bucket, cutoff, limit, start_after, reserve_ms)
+    with metrics.phase('ExpiryDelete'):
+        results = delete_keys(s3_client, bucket, list(expired), max_workers)
+    deleted = [result['blobKey'] for result in results if result['statusCode'] == 200]
+    segments_deleted = release_segments(s3_client, bucket, deleted, expired)
+
+    pruned = manifest_errors = 0
+    with metrics.phase('ExpiryManifests'):
+        # Manifests are keyed by owner hash, so any of them may list a deleted blob
+        for obj in _objects(s3_client, bucket, manifest.MANIFEST_PREFIX) if deleted else ():
+            try:
+                pruned += manifest.forget(s3_client, bucket, obj['Key'], deleted)
+            except Exception as e:
+                manifest_errors += 1
+                metrics.log('manifest_error', phase='expiry', error=type(e).__name__)
+
+    metrics.add('ExpiredBlobs', len(deleted))
+    return {
+        'expired': len(deleted),
+        'failed': len(results) - len(deleted),
+        'truncated': resume_after is not None,
+        'startAfter': resume_after,
+        'manifestEntriesExpired': pruned,
+        'manifestErrors': manifest_errors,
+        'segmentsDeleted': segments_deleted,
+        'cutoff': int(cutoff),
+    }
@@ -0,0 +1,61 @@
+"""
+Cold-start measurement for the Lambda handlers.
+
+Each handler records when its module started importing, marks the end of
+its import, and wraps lambda_handler with ColdStart.instrument. The first
+invocation in a container then produces a report with the import time, the
+duration of that first invocation and the total time to first response.
+Set COLD_START_REPORT=1 to also log the report as a JSON line.
+"""
+
+import functools
+import json
+import os
+import time
+from typing import Any, Callable, Dict, Optional
+
+import aws_clients
+
+
+class ColdStart:
+    """Import and time-to-first-response measurements for one handler module."""
+
+    def __init__(self, handler_name: str, import_started: float):
+        self.handler_name = handler_name
+        self.import_started = import_started
+        self.import_finished: Optional[float] = None
+        self.report: Optional[Dict[str, Any]] = None
+
+    def mark_imported(self) -> None:
+        self.import_finished = time.perf_counter()
+
+    @property
+    def import_ms(self) -> Optional[float]:
+        if self.import_finished is None:
+            return None
+        return (self.import_finished - self.import_started) * 1000
+
+    def instrument(self, handler: Callable) -> Callable:
+        """Wrap a Lambda handler so its first invocation produces the cold-start report."""
+
+        @functools.wraps(handler)
+        def wrapper(event: Any, context: Any) -> Any:
+            if self.report is not None:
+                return handler(event, context)
+
+            invoked = time.perf_counter()
+            try:
+                return handler(event, context)
+            finally:
+                responded = time.perf_counter()
+                self.report = {
+                    'handler': self.handler_name,
+                    'importMs': round(self.import_ms or 0.0, 3),
+                    'firstInvocationMs': round((responded - invoked) * 1000, 3),
+                    'timeToFirstResponseMs': round((responded - self.import_started) * 1000, 3),
+                    'clientsBuilt': aws_clients.built_clients(),
+                }
+                if os.environ.get('COLD_START_REPORT', '').lower() in ('1', 'true', 'yes'):
+                    print(json.dumps({'coldStart': self.report}))
+
+        return wrapper
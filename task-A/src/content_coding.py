@@ -0,0 +1,81 @@
+"""
+Response content-coding negotiation for the decrypt handler.
+
+Successful responses are compressed when the request's Accept-Encoding
+allows it and the body is at least RESPONSE_COMPRESSION_MIN_BYTES (1024):
+zstd when the zstandard package is in the deployment package, otherwise
+gzip. Compressed and binary bodies go out base64-encoded with
+isBase64Encoded, which API Gateway and the standalone server decode
+before sending the bytes to the client.
+
+    RESPONSE_COMPRESSION            on (default) or off
+    RESPONSE_COMPRESSION_MIN_BYTES  smaller bodies are sent as they are (1024)
+    RESPONSE_GZIP_LEVEL             gzip level (6)
+    RESPONSE_ZSTD_LEVEL             zstd level (3)
+"""
+
+import base64
+import gzip
+import os
+from typing import Dict, List, Optional, Tuple, Union
+
+try:
+    import zstandard
+except ImportError:  # optional: gzip only
+    zstandard = None
+
+
+def available() -> List[str]:
+    """Codings this container can produce, preferred first."""
+    return ['zstd', 'gzip'] if zstandard is not None else ['gzip']
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """The coding to use for an Accept-Encoding header (with q-values), or None for identity."""
+    if not accept_encoding:
+        return None
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.partition(';')
+        weight = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key.lower() == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if name.strip():
+            weights[name.strip().lower()] = weight
+    ranked = [(weights.get(coding, weights.get('*', 0.0)), -rank, coding)
+              for rank, coding in enumerate(available())]
+    weight, _, coding = max(ranked)
+    return coding if weight > 0 else None
+
+
+def compress(data: bytes, coding: str) -> bytes:
+    if coding == 'zstd':
+        level = int(os.environ.get('RESPONSE_ZSTD_LEVEL', '3'))
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    # mtime=0 keeps the output deterministic for identical bodies
+    return gzip.compress(data, compresslevel=int(os.environ.get('RESPONSE_GZIP_LEVEL', '6')), mtime=0)
+
+
+def encode_body(body: Union[str, bytes],
+                accept_encoding: Optional[str]) -> Tuple[str, bool, Dict[str, str]]:
+    """
+    Return (body, isBase64Encoded, extra headers) for a response body.
+
+    Text bodies that are not compressed are returned unchanged; bytes
+    bodies are always base64-encoded.
+    """
+    data = body.encode('utf-8') if isinstance(body, str) else body
+    coding = None
+    if os.environ.get('RESPONSE_COMPRESSION', 'on').lower() not in ('off', '0', 'false') and \
+            len(data) >= int(os.environ.get('RESPONSE_COMPRESSION_MIN_BYTES', '1024')):
+        coding = negotiate(accept_encoding)
+    if coding is None:
+        if isinstance(body, str):
+            return body, False, {}
+        return base64.b64encode(data).decode('ascii'), True, {}
+    return base64.b64encode(compress(data, coding)).decode('ascii'), True, {'Content-Encoding': coding}
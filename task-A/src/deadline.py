@@ -0,0 +1,149 @@
+"""
+Deadline propagation from the Lambda context to S3 and KMS calls.
+
+Without it, a slow S3 or KMS call runs until Lambda kills the function at
+its timeout, and the client gets an opaque gateway error after paying for
+the full duration. Handlers wrapped with instrument() take their deadline
+from context.get_remaining_time_in_millis(), minus a safety margin kept
+for building the response and flushing logs. Every call made through a
+BoundedClient gets the time left as its timeout:
+
+  - a call still running at the deadline is abandoned and raises
+    DeadlineExceeded (504); its worker finishes in the background, bounded
+    by the client's own AWS_CLIENT_READ_TIMEOUT
+  - a call that would start with less than DEADLINE_MIN_CALL_MS left is
+    not made and raises DeadlineExceeded (503), so the rest of the
+    request's work is shed at once; so is a request that arrives with no
+    time left
+
+The timeout covers the API call up to its response; streamed S3 bodies
+are then read under the client's read timeout. Outside an instrumented
+invocation, or with a context that has no get_remaining_time_in_millis
+(tests, benchmarks), calls run directly.
+
+    DEADLINE_SAFETY_MARGIN_MS  time kept back from the remaining time (500)
+    DEADLINE_MIN_CALL_MS       least time a call is started with (50)
+    DEADLINE_MAX_WORKERS       threads running bounded calls (32)
+
+Every invocation records DeadlineBudgetMs, and DeadlineTimeouts and
+DeadlineShed when calls time out or are shed.
+"""
+
+import contextvars
+import functools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional
+
+import metrics
+
+# Names that build requests locally and never wait on the network
+LOCAL_METHODS = frozenset({'generate_presigned_url', 'generate_presigned_post', 'can_paginate',
+                           'get_paginator', 'get_waiter'})
+
+_expires: 'contextvars.ContextVar[Optional[float]]' = contextvars.ContextVar('deadline', default=None)
+_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('DEADLINE_MAX_WORKERS', '32')),
+                               thread_name_prefix='deadline')
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a call cannot finish before the invocation's deadline; 504 if it timed out, 503 if shed."""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+    def response(self, headers: Dict[str, str]) -> Dict[str, Any]:
+        return {
+            'statusCode': self.status_code,
+            'headers': headers,
+            'body': json.dumps({'error': str(self)})
+        }
+
+
+def remaining_ms() -> Optional[float]:
+    """Milliseconds left before the current invocation's deadline, or None without one."""
+    expires = _expires.get()
+    if expires is None:
+        return None
+    return (expires - time.monotonic()) * 1000
+
+
+def _shed(operation: str, remaining: float) -> DeadlineExceeded:
+    metrics.add('DeadlineShed', 1)
+    metrics.log('deadline_shed', operation=operation, remainingMs=round(remaining, 1))
+    return DeadlineExceeded(503, 'Not enough time left to complete the request')
+
+
+def ensure(ms: float = 0, operation: str = 'request') -> None:
+    """Raise DeadlineExceeded(503) unless ms, plus time for one more call, fit before the deadline."""
+    remaining = remaining_ms()
+    if remaining is not None and remaining - ms < float(os.environ.get('DEADLINE_MIN_CALL_MS', '50')):
+        raise _shed(operation, remaining)
+
+
+def call(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """fn(*args, **kwargs), abandoned with DeadlineExceeded if the deadline passes first."""
+    remaining = remaining_ms()
+    if remaining is None:
+        return fn(*args, **kwargs)
+    operation = getattr(fn, '__name__', 'call')
+    ensure(0, operation)
+    future = metrics.submit(_executor, functools.partial(fn, *args, **kwargs))
+    # wait() rather than result(timeout): fn may raise a TimeoutError of its own
+    done, _ = wait([future], timeout=remaining / 1000)
+    if not done:
+        future.cancel()
+        metrics.add('DeadlineTimeouts', 1)
+        metrics.log('deadline_exceeded', operation=operation, timeoutMs=round(remaining, 1))
+        raise DeadlineExceeded(504, 'The request timed out waiting for AWS')
+    return future.result()
+
+
+class BoundedClient:
+    """
+    Stand-in for a boto3 client whose API calls run under the invocation's deadline.
+
+    Wraps eager clients and LazyClients alike; methods that only build
+    requests locally (presigned URLs) are passed through untouched.
+    """
+
+    def __init__(self, client: Any):
+        self._client = client
+
+    def __getattr__(self, name: str) -> Any:
+        # Introspection (e.g. by mock.patch) must not reach the client
+        if name.startswith('_'):
+            raise AttributeError(name)
+        attr = getattr(self._client, name)
+        if name in LOCAL_METHODS or not callable(attr):
+            return attr
+        return functools.partial(call, attr)
+
+    def __repr__(self) -> str:
+        return f'BoundedClient({self._client!r})'
+
+
+def instrument(handler: Callable) -> Callable:
+    """Wrap a Lambda handler so its calls share a deadline taken from the context."""
+
+    @functools.wraps(handler)
+    def wrapper(event: Any, context: Any) -> Any:
+        get_remaining = getattr(context, 'get_remaining_time_in_millis', None)
+        if get_remaining is None:
+            return handler(event, context)
+        budget = get_remaining() - float(os.environ.get('DEADLINE_SAFETY_MARGIN_MS', '500'))
+        metrics.add('DeadlineBudgetMs', max(0.0, budget), 'Milliseconds')
+        token = _expires.set(time.monotonic() + budget / 1000)
+        try:
+            ensure()
+            return handler(event, context)
+        except DeadlineExceeded as e:
+            # Routes map this with their own headers; this is the fallback
+            return e.response({'Access-Control-Allow-Origin': '*'})
+        finally:
+            _expires.reset(token)
+
+    return wrapper
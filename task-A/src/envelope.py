@@ -0,0 +1,164 @@
+"""
+Envelope encryption for Solace blobs.
+
+An envelope blob carries a KMS-wrapped AES-256 data key next to the
+AES-GCM ciphertext it protects, so readers only need one KMS round trip
+per data key rather than one per blob, and blobs are not limited by the
+4 KB KMS Decrypt payload size.
+
+Layout (all integers big-endian):
+
+    magic        4 bytes   b'SENV'
+    version      1 byte    1
+    key length   2 bytes   length of the wrapped data key
+    wrapped key  n bytes   KMS CiphertextBlob of the data key
+    nonce       12 bytes   AES-GCM nonce
+    ciphertext   rest      AES-GCM ciphertext followed by the 16-byte tag
+
+The header (magic through wrapped key) is bound to the ciphertext as
+AES-GCM associated data.
+"""
+
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Tuple
+
+try:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    from cryptography.exceptions import InvalidTag
+except ImportError:  # pragma: no cover - depends on the deployment package
+    AESGCM = None
+
+    class InvalidTag(Exception):
+        pass
+
+ENVELOPE_MAGIC = b'SENV'
+ENVELOPE_VERSION = 1
+NONCE_SIZE = 12
+
+_PREFIX = struct.Struct('>4sBH')
+
+
+class EnvelopeFormatError(ValueError):
+    """Raised when a blob looks like an envelope but cannot be parsed."""
+
+
+def is_envelope(blob: bytes) -> bool:
+    """Return True if the blob starts with the envelope magic number."""
+    return blob[:len(ENVELOPE_MAGIC)] == ENVELOPE_MAGIC
+
+
+def pack_envelope(wrapped_key: bytes, nonce: bytes, ciphertext: bytes) -> bytes:
+    """Serialize the envelope fields into a single blob."""
+    return _pack_header(wrapped_key) + nonce + ciphertext
+
+
+def unpack_envelope(blob: bytes) -> Tuple[bytes, bytes, bytes, bytes]:
+    """
+    Split an envelope blob into (header, wrapped_key, nonce, ciphertext).
+    """
+    if len(blob) < _PREFIX.size:
+        raise EnvelopeFormatError('Envelope blob is truncated')
+    magic, version, key_length = _PREFIX.unpack_from(blob)
+    if magic != ENVELOPE_MAGIC:
+        raise EnvelopeFormatError('Blob is not an envelope')
+    if version != ENVELOPE_VERSION:
+        raise EnvelopeFormatError(f'Unsupported envelope version: {version}')
+
+    header_end = _PREFIX.size + key_length
+    if len(blob) < header_end + NONCE_SIZE + 16:
+        raise EnvelopeFormatError('Envelope blob is truncated')
+
+    return (
+        blob[:header_end],
+        blob[_PREFIX.size:header_end],
+        blob[header_end:header_end + NONCE_SIZE],
+        blob[header_end + NONCE_SIZE:],
+    )
+
+
+def encrypt_envelope(plaintext: bytes, kms_client: Any, kms_key_id: str) -> bytes:
+    """
+    Encrypt plaintext under a fresh KMS data key and return an envelope blob.
+    """
+    _require_aesgcm()
+    data_key = kms_client.generate_data_key(KeyId=kms_key_id, KeySpec='AES_256')
+    wrapped_key = data_key['CiphertextBlob']
+    nonce = os.urandom(NONCE_SIZE)
+    ciphertext = AESGCM(data_key['Plaintext']).encrypt(nonce, plaintext, _pack_header(wrapped_key))
+    return pack_envelope(wrapped_key, nonce, ciphertext)
+
+
+def decrypt_envelope(blob: bytes, unwrap_data_key: Callable[[bytes], bytes]) -> bytes:
+    """
+    Decrypt an envelope blob.
+
+    unwrap_data_key is called with the wrapped data key and must return the
+    plaintext data key (normally via a DataKeyCache in front of KMS).
+    Raises EnvelopeFormatError or InvalidTag for corrupt blobs.
+    """
+    _require_aesgcm()
+    header, wrapped_key, nonce, ciphertext = unpack_envelope(blob)
+    return AESGCM(unwrap_data_key(wrapped_key)).decrypt(nonce, ciphertext, header)
+
+
+class DataKeyCache:
+    """
+    Thread-safe cache of unwrapped data keys for warm containers.
+
+    Entries expire after ttl_seconds or once they have been handed out
+    max_uses times, whichever comes first, and the least recently used
+    entry is dropped when more than max_entries keys are cached.
+    """
+
+    def __init__(self, ttl_seconds: float = 300, max_uses: int = 1000, max_entries: int = 100,
+                 clock: Callable[[], float] = time.monotonic):
+        self.ttl_seconds = ttl_seconds
+        self.max_uses = max_uses
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries: 'OrderedDict[bytes, list]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, wrapped_key: bytes) -> Optional[bytes]:
+        """Return the cached data key, counting one use, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(wrapped_key)
+            if entry is None:
+                return None
+            data_key, expires_at, uses = entry
+            if self._clock() >= expires_at or uses >= self.max_uses:
+                del self._entries[wrapped_key]
+                return None
+            entry[2] = uses + 1
+            self._entries.move_to_end(wrapped_key)
+            return data_key
+
+    def put(self, wrapped_key: bytes, data_key: bytes) -> None:
+        """Cache a freshly unwrapped data key; the caller's use counts as the first."""
+        if self.ttl_seconds <= 0 or self.max_uses <= 0:
+            return
+        with self._lock:
+            self._entries[wrapped_key] = [data_key, self._clock() + self.ttl_seconds, 1]
+            self._entries.move_to_end(wrapped_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _pack_header(wrapped_key: bytes) -> bytes:
+    return _PREFIX.pack(ENVELOPE_MAGIC, ENVELOPE_VERSION, len(wrapped_key)) + wrapped_key
+
+
+def _require_aesgcm() -> None:
+    if AESGCM is None:
+        raise RuntimeError('The cryptography package is required for envelope encryption')
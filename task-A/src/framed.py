@@ -0,0 +1,184 @@
+"""
+Framed (chunked) envelope encryption for large Solace blobs.
+
+A framed blob splits the plaintext into fixed-size frames, each sealed
+separately with AES-GCM under one KMS-wrapped data key. Because every
+frame has the same ciphertext length (except possibly the last), the
+byte range of any frame can be computed from the header alone, so large
+blobs can be decrypted frame by frame from a stream or fetched in
+ranged pages without holding the whole object in memory.
+
+Layout (all integers big-endian):
+
+    magic         4 bytes   b'SFRM'
+    version       1 byte    1
+    frame size    4 bytes   plaintext bytes per frame
+    key length    2 bytes   length of the wrapped data key
+    wrapped key   n bytes   KMS CiphertextBlob of the data key
+    nonce prefix  8 bytes   random per blob
+    frames        rest      per frame: ciphertext followed by a 16-byte tag
+
+Frame i uses the nonce (nonce prefix || i as 4 bytes) and the associated
+data (header || i as 4 bytes || final flag), so frames cannot be
+reordered, and a truncated blob fails authentication.
+"""
+
+import os
+import struct
+from typing import Any, Callable, Iterator
+
+import envelope
+from envelope import EnvelopeFormatError
+
+FRAMED_MAGIC = b'SFRM'
+FRAMED_VERSION = 1
+DEFAULT_FRAME_SIZE = 64 * 1024
+NONCE_PREFIX_SIZE = 8
+TAG_SIZE = 16
+
+_PREFIX = struct.Struct('>4sBIH')
+_FRAME_AAD = struct.Struct('>IB')
+
+
+class HeaderTruncated(EnvelopeFormatError):
+    """Raised when a buffer is too short to hold the full header."""
+
+    def __init__(self, needed: int):
+        super().__init__(f'Framed header needs {needed} bytes')
+        self.needed = needed
+
+
+def is_framed(blob: bytes) -> bool:
+    """Return True if the blob starts with the framed magic number."""
+    return bytes(blob[:len(FRAMED_MAGIC)]) == FRAMED_MAGIC
+
+
+class FramedHeader:
+    """Parsed header of a framed blob, with frame offset arithmetic."""
+
+    def __init__(self, raw: bytes, frame_size: int, wrapped_key: bytes, nonce_prefix: bytes):
+        self.raw = raw
+        self.frame_size = frame_size
+        self.wrapped_key = wrapped_key
+        self.nonce_prefix = nonce_prefix
+
+    @property
+    def size(self) -> int:
+        """Length of the header in bytes; frame 0 starts here."""
+        return len(self.raw)
+
+    @property
+    def sealed_frame_size(self) -> int:
+        return self.frame_size + TAG_SIZE
+
+    @classmethod
+    def parse(cls, buf: bytes) -> 'FramedHeader':
+        """
+        Parse the header from the start of buf.
+
+        Raises HeaderTruncated (with the number of bytes needed) if buf ends
+        before the header does.
+        """
+        if len(buf) < _PREFIX.size:
+            raise HeaderTruncated(_PREFIX.size)
+        magic, version, frame_size, key_length = _PREFIX.unpack_from(buf)
+        if magic != FRAMED_MAGIC:
+            raise EnvelopeFormatError('Blob is not a framed envelope')
+        if version != FRAMED_VERSION:
+            raise EnvelopeFormatError(f'Unsupported framed envelope version: {version}')
+        if frame_size <= 0:
+            raise EnvelopeFormatError('Invalid frame size')
+
+        key_end = _PREFIX.size + key_length
+        header_end = key_end + NONCE_PREFIX_SIZE
+        if len(buf) < header_end:
+            raise HeaderTruncated(header_end)
+        return cls(bytes(buf[:header_end]), frame_size,
+                   bytes(buf[_PREFIX.size:key_end]), bytes(buf[key_end:header_end]))
+
+    def frame_count(self, blob_size: int) -> int:
+        """Number of frames in a blob of blob_size bytes."""
+        body = blob_size - self.size
+        if body < TAG_SIZE:
+            raise EnvelopeFormatError('Framed blob is truncated')
+        return -(-body // self.sealed_frame_size)
+
+    def frame_offset(self, index: int) -> int:
+        """Byte offset of frame index within the blob."""
+        return self.size + index * self.sealed_frame_size
+
+    def frame_range(self, first: int, count: int, blob_size: int) -> tuple:
+        """Inclusive (start, end) byte range covering frames [first, first + count)."""
+        end = min(self.frame_offset(first + count), blob_size)
+        return self.frame_offset(first), end - 1
+
+
+def encrypt_framed(plaintext: bytes, kms_client: Any, kms_key_id: str,
+                   frame_size: int = DEFAULT_FRAME_SIZE) -> bytes:
+    """
+    Encrypt plaintext under a fresh KMS data key and return a framed blob.
+    """
+    if envelope.AESGCM is None:
+        raise RuntimeError('The cryptography package is required for envelope encryption')
+    data_key = kms_client.generate_data_key(KeyId=kms_key_id, KeySpec='AES_256')
+    wrapped_key = data_key['CiphertextBlob']
+    nonce_prefix = os.urandom(NONCE_PREFIX_SIZE)
+    raw_header = (_PREFIX.pack(FRAMED_MAGIC, FRAMED_VERSION, frame_size, len(wrapped_key))
+                  + wrapped_key + nonce_prefix)
+    header = FramedHeader(raw_header, frame_size, wrapped_key, nonce_prefix)
+
+    aesgcm = envelope.AESGCM(data_key['Plaintext'])
+    view = memoryview(plaintext)
+    total = max(1, -(-len(plaintext) // frame_size))
+    parts = [raw_header]
+    for index in range(total):
+        chunk = view[index * frame_size:(index + 1) * frame_size]
+        parts.append(aesgcm.encrypt(_frame_nonce(header, index), bytes(chunk),
+                                    _frame_aad(header, index, index == total - 1)))
+    return b''.join(parts)
+
+
+def decrypt_frames(header: FramedHeader, data_key: bytes, read: Callable[[int], bytes],
+                   first: int, count: int, total: int) -> Iterator[bytes]:
+    """
+    Decrypt frames [first, first + count) of a blob with total frames.
+
+    read(n) must return the next n bytes of the frame region starting at
+    frame first (fewer only at the end of the blob), e.g. a StreamingBody's
+    read method, so only one sealed frame is held in memory at a time.
+    Raises EnvelopeFormatError or InvalidTag for corrupt blobs.
+    """
+    if envelope.AESGCM is None:
+        raise RuntimeError('The cryptography package is required for envelope encryption')
+    aesgcm = envelope.AESGCM(data_key)
+    for index in range(first, first + count):
+        sealed = read(header.sealed_frame_size)
+        if len(sealed) < TAG_SIZE:
+            raise EnvelopeFormatError('Framed blob is truncated')
+        yield aesgcm.decrypt(_frame_nonce(header, index), bytes(sealed),
+                             _frame_aad(header, index, index == total - 1))
+
+
+def decrypt_framed(blob: bytes, unwrap_data_key: Callable[[bytes], bytes]) -> Iterator[bytes]:
+    """
+    Decrypt every frame of an in-memory framed blob without copying the ciphertext.
+    """
+    view = memoryview(blob)
+    header = FramedHeader.parse(view)
+    total = header.frame_count(len(view))
+    position = [header.size]
+
+    def read(size: int) -> memoryview:
+        chunk = view[position[0]:position[0] + size]
+        position[0] += len(chunk)
+        return chunk
+
+    return decrypt_frames(header, unwrap_data_key(header.wrapped_key), read, 0, total, total)
+
+
+def _frame_nonce(header: FramedHeader, index: int) -> bytes:
+    return header.nonce_prefix + struct.pack('>I', index)
+
+
+def _frame_aad(header: FramedHeader, index: int, final: bool) -> bytes:
+    return header.raw + _FRAME_AAD.pack(index, 1 if final else 0)
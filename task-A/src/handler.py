@@ -1,14 +1,533 @@
+import time
+_import_started = time.perf_counter()
+
 import json
 import os
-import boto3
 import base64
+import re
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError, NoCredentialsError
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple, Union
+
+import blob_format
+import content_coding
+import deadline
+import envelope
+import framed
+import hedging
+import metrics
+import profiling
+import segments
+import throttle
+import warmup
+from aws_clients import LazyClient
+from coldstart import ColdStart
+from http_headers import get_header
+from result_cache import ResultCache
+
+# AWS clients are built on first use, from one shared session; their
+# calls are bounded by the invocation's deadline
+s3_client = deadline.BoundedClient(LazyClient('s3'))
+kms_client = deadline.BoundedClient(LazyClient('kms'))
+
+cold_start = ColdStart('handler', _import_started)
+
+# Limits for the batch ("blobKeys") request form
+MAX_BATCH_KEYS = int(os.environ.get('MAX_BATCH_KEYS', '100'))
+BATCH_MAX_WORKERS = int(os.environ.get('BATCH_MAX_WORKERS', '8'))
+
+# Unwrapped envelope data keys, reused across warm invocations
+data_key_cache = envelope.DataKeyCache(
+    ttl_seconds=float(os.environ.get('DATA_KEY_CACHE_TTL_SECONDS', '300')),
+    max_uses=int(os.environ.get('DATA_KEY_CACHE_MAX_USES', '1000')),
+    max_entries=int(os.environ.get('DATA_KEY_CACHE_MAX_ENTRIES', '100')),
+)
+
+# Paged reads of framed blobs: bytes probed for the header, and the
+# plaintext budget for a single page
+STREAM_HEADER_PROBE_BYTES = 1024
+STREAM_MAX_RESPONSE_BYTES = int(os.environ.get('STREAM_MAX_RESPONSE_BYTES', str(1024 * 1024)))
+
+# Opt-in cache of decrypted blobs, validated against the S3 ETag
+result_cache = ResultCache(
+    max_bytes=int(os.environ.get('RESULT_CACHE_MAX_BYTES', '0')),
+    ttl_seconds=float(os.environ.get('RESULT_CACHE_TTL_SECONDS', '60')),
+)
+
+
+# Requests sending Accept: application/octet-stream get the raw plaintext bytes
+BINARY_CONTENT_TYPE = 'application/octet-stream'
+
+# Rate limit, adaptive retry and circuit breaker shared by all KMS calls
+kms_guard = throttle.KmsGuard.from_env()
+
+# Blob reads, hedged against slow GETs when S3_HEDGE is on
+s3_reads = hedging.HedgedReader.from_env()
+
+# Indexes of segments holding compacted blobs, and how batch reads from them are coalesced
+segment_index = segments.SegmentIndex(
+    max_segments=int(os.environ.get('SEGMENT_INDEX_MAX_SEGMENTS', '256')),
+    ttl_seconds=float(os.environ.get('SEGMENT_INDEX_TTL_SECONDS', '300')),
+)
+SEGMENT_READ_GAP_BYTES = int(os.environ.get('SEGMENT_READ_GAP_BYTES', str(64 * 1024)))
+SEGMENT_READ_MAX_BYTES = int(os.environ.get('SEGMENT_READ_MAX_BYTES', str(8 * 1024 * 1024)))
+# Batches probe unknown keys for segment pointers before reading them one by one: always
+# (true), never (false), or once this container has read a segment's index (auto)
+SEGMENT_BATCH_PROBE = os.environ.get('SEGMENT_BATCH_PROBE', 'auto').lower()
+
+
+class DecryptError(Exception):
+    """A failure to decrypt a single blob, carrying the HTTP status to report."""
+
+    def __init__(self, status_code: int, message: str, retry_after: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.retry_after = retry_after
+
+    def response(self, headers: Dict[str, str]) -> Dict[str, Any]:
+        """The API response for this error, with Retry-After when the client should back off."""
+        if self.retry_after is not None:
+            headers = {**headers, 'Retry-After': str(self.retry_after)}
+        return {
+            'statusCode': self.status_code,
+            'headers': headers,
+            'body': json.dumps({'error': self.message})
+        }
+
+
+def fetch_blob(s3_bucket: str, blob_key: str, if_none_match: Optional[str] = None,
+               stored: Optional[Tuple[bytes, str]] = None) -> Tuple[Optional[bytes], Optional[str]]:
+    """
+    Download an encrypted blob from S3 and return (ciphertext, etag), where the
+    ciphertext is either a KMS CiphertextBlob or an envelope blob.
 
-# Initialize AWS clients
-s3_client = boto3.client('s3')
-kms_client = boto3.client('kms')
+    Compacted blobs are read from their segment, located through the
+    segment index or the blob's pointer object. stored is the blob's
+    (bytes, etag) when a batch already read it.
 
+    When if_none_match is given and the object's ETag still matches, S3 answers
+    with a 304 and (None, if_none_match) is returned without a download.
+    Raises DecryptError for missing blobs/buckets; other S3 errors propagate.
+    """
+    try:
+        location = None
+        if stored is not None:
+            encrypted_blob, etag = stored
+        else:
+            location = segment_index.locate(blob_key)
+            if location is None:
+                get_kwargs = {'Bucket': s3_bucket, 'Key': blob_key}
+                if if_none_match:
+                    get_kwargs['IfNoneMatch'] = if_none_match
+                with metrics.phase('S3Get'):
+                    response, encrypted_blob = s3_reads.get_object(s3_client, **get_kwargs)
+                etag = response.get('ETag')
+                location = segments.pointer_location(response)
+                if location is not None:
+                    with metrics.phase('SegmentIndexLoad'):
+                        segment_index.follow(s3_client, s3_bucket, location)
+            if location is not None:
+                etag = location.etag
+        if if_none_match and etag == if_none_match and (stored is not None or location is not None):
+            # Blobs are immutable, so an unchanged ETag needs no read
+            return None, if_none_match
+        if location is not None:
+            with metrics.phase('S3Get'):
+                _, encrypted_blob = segments.get(s3_client, s3_bucket, location)
+        metrics.add('S3GetBytes', len(encrypted_blob), 'Bytes')
+
+        # Envelope and framed blobs are stored as raw binary
+        if envelope.is_envelope(encrypted_blob) or framed.is_framed(encrypted_blob):
+            return encrypted_blob, etag
+
+        # Binary containers say what they hold, so there is nothing to guess
+        if blob_format.is_blob(encrypted_blob):
+            try:
+                container = blob_format.parse_blob(encrypted_blob)
+            except blob_format.BlobFormatError:
+                raise DecryptError(400, 'Invalid encrypted data')
+            if container.algorithm != blob_format.ALG_AWS_KMS:
+                raise DecryptError(400, 'Blob is not encrypted with KMS')
+            return bytes(container.ciphertext), etag
+
+        # Legacy blobs: try to decode as base64 first (since AWS CLI outputs base64-encoded data)
+        try:
+            # Decode base64 to get raw binary data for KMS
+            with metrics.phase('Base64Decode'):
+                encrypted_blob = base64.b64decode(encrypted_blob)
+        except Exception:
+            # If base64 decode fails, assume it's already raw binary
+            pass
+
+    except ClientError as e:
+        error_code = e.response['Error']['Code']
+        if if_none_match and error_code in ('304', 'NotModified'):
+            return None, if_none_match
+        elif error_code == 'NoSuchKey':
+            raise DecryptError(404, f'Blob not found: {blob_key}')
+        elif error_code == 'NoSuchBucket':
+            raise DecryptError(500, f'S3 bucket not found: {s3_bucket}')
+        else:
+            raise
+
+    return encrypted_blob, etag
+
+
+def unwrap_data_key(wrapped_key: bytes, kms_key_id: str) -> bytes:
+    """
+    Return the plaintext data key for an envelope, calling KMS only on a cache miss.
+    """
+    data_key = data_key_cache.get(wrapped_key)
+    if data_key is None:
+        metrics.add('DataKeyCacheMisses', 1)
+        with metrics.phase('KmsDecrypt'):
+            data_key = kms_guard.call(
+                kms_client.decrypt,
+                CiphertextBlob=wrapped_key,
+                KeyId=kms_key_id
+            )['Plaintext']
+        data_key_cache.put(wrapped_key, data_key)
+    else:
+        metrics.add('DataKeyCacheHits', 1)
+    return data_key
+
+
+def decrypt_blob(encrypted_blob: bytes, kms_key_id: str) -> bytes:
+    """
+    Decrypt a KMS ciphertext, envelope or framed blob and return the plaintext bytes.
+
+    Raises DecryptError for bad ciphertext and denied keys; other KMS
+    errors propagate.
+    """
+    try:
+        if envelope.is_envelope(encrypted_blob):
+            plaintext_bytes = envelope.decrypt_envelope(
+                encrypted_blob,
+                lambda wrapped_key: unwrap_data_key(wrapped_key, kms_key_id)
+            )
+        elif framed.is_framed(encrypted_blob):
+            plaintext_bytes = b''.join(framed.decrypt_framed(
+                encrypted_blob,
+                lambda wrapped_key: unwrap_data_key(wrapped_key, kms_key_id)
+            ))
+        else:
+            with metrics.phase('KmsDecrypt'):
+                decrypt_response = kms_guard.call(
+                    kms_client.decrypt,
+                    CiphertextBlob=encrypted_blob,
+                    KeyId=kms_key_id
+                )
+            plaintext_bytes = decrypt_response['Plaintext']
+        metrics.add('PlaintextBytes', len(plaintext_bytes), 'Bytes')
+    except (envelope.EnvelopeFormatError, envelope.InvalidTag):
+        raise DecryptError(400, 'Invalid encrypted data')
+    except throttle.Throttled as e:
+        raise DecryptError(429, str(e), e.retry_after)
+    except ClientError as e:
+        error_code = e.response['Error']['Code']
+        if error_code == 'InvalidCiphertextException':
+            raise DecryptError(400, 'Invalid encrypted data')
+        elif error_code == 'AccessDeniedException':
+            raise DecryptError(403, 'Access denied to KMS key')
+        else:
+            raise
+
+    return plaintext_bytes
+
+
+def as_text(plaintext: bytes) -> str:
+    """Plaintext as UTF-8 text for JSON responses; DecryptError(400) if it is binary."""
+    try:
+        return plaintext.decode('utf-8')
+    except UnicodeDecodeError as e:
+        raise DecryptError(400, f'Failed to decode decrypted data: {str(e)}; '
+                                f'request Accept: {BINARY_CONTENT_TYPE} for binary plaintext')
+
+
+def read_blob(s3_bucket: str, blob_key: str, kms_key_id: str,
+              stored: Optional[Tuple[bytes, str]] = None) -> bytes:
+    """
+    Fetch and decrypt a blob, going through the result cache when it is enabled.
+    """
+    if not result_cache.enabled:
+        encrypted_blob, _ = fetch_blob(s3_bucket, blob_key, stored=stored)
+        return decrypt_blob(encrypted_blob, kms_key_id)
+
+    entry, fresh = result_cache.lookup(s3_bucket, blob_key)
+    if fresh:
+        return entry.plaintext
+
+    encrypted_blob, etag = fetch_blob(s3_bucket, blob_key, entry.etag if entry else None, stored)
+    if encrypted_blob is None:
+        result_cache.revalidated(entry)
+        return entry.plaintext
+
+    plaintext = decrypt_blob(encrypted_blob, kms_key_id)
+    result_cache.put(s3_bucket, blob_key, etag, plaintext)
+    return plaintext
+
+
+def _get_range(s3_bucket: str, blob_key: str, start: int, end: int) -> Dict[str, Any]:
+    """Ranged GetObject for bytes [start, end], mapping missing blobs to DecryptError."""
+    try:
+        with metrics.phase('S3Get'):
+            response = s3_client.get_object(Bucket=s3_bucket, Key=blob_key, Range=f'bytes={start}-{end}')
+        metrics.add('S3GetBytes', end - start + 1, 'Bytes')
+        return response
+    except ClientError as e:
+        error_code = e.response['Error']['Code']
+        if error_code == 'NoSuchKey':
+            raise DecryptError(404, f'Blob not found: {blob_key}')
+        elif error_code == 'NoSuchBucket':
+            raise DecryptError(500, f'S3 bucket not found: {s3_bucket}')
+        elif error_code == 'InvalidRange':
+            raise DecryptError(400, 'frameStart is past the end of the blob')
+        raise
+
+
+def read_frames(s3_bucket: str, blob_key: str, kms_key_id: str,
+                frame_start: int, max_frames: Optional[int]) -> Dict[str, Any]:
+    """
+    Decrypt one page of frames from a framed blob using ranged reads.
+
+    The header is read with a small ranged GET, then only the byte range of
+    the requested frames is streamed and decrypted one frame at a time, so
+    peak memory is bounded by the page size rather than the blob size.
+    Pages are returned base64-encoded because a page boundary may split a
+    multi-byte character; nextFrame is None once the last frame was returned.
+    """
+    try:
+        probe_end = STREAM_HEADER_PROBE_BYTES - 1
+        while True:
+            response = _get_range(s3_bucket, blob_key, 0, probe_end)
+            probe = response['Body'].read()
+            if not framed.is_framed(probe):
+                raise DecryptError(400, 'Blob is not a framed envelope')
+            try:
+                header = framed.FramedHeader.parse(probe)
+                break
+            except framed.HeaderTruncated as e:
+                if len(probe) <= probe_end:
+                    raise DecryptError(400, 'Invalid encrypted data')
+                probe_end = e.needed - 1
+
+        blob_size = int(re.search(r'/(\d+)$', response['ContentRange']).group(1))
+        total_frames = header.frame_count(blob_size)
+        if frame_start >= total_frames:
+            raise DecryptError(400, 'frameStart is past the end of the blob')
+
+        page_frames = max(1, STREAM_MAX_RESPONSE_BYTES // header.frame_size)
+        if max_frames is not None:
+            page_frames = min(page_frames, max_frames)
+        frame_count = min(page_frames, total_frames - frame_start)
+
+        data_key = unwrap_data_key(header.wrapped_key, kms_key_id)
+        start, end = header.frame_range(frame_start, frame_count, blob_size)
+        body = _get_range(s3_bucket, blob_key, start, end)['Body']
+        plaintext = b''.join(framed.decrypt_frames(
+            header, data_key, body.read, frame_start, frame_count, total_frames
+        ))
+    except (envelope.EnvelopeFormatError, envelope.InvalidTag):
+        raise DecryptError(400, 'Invalid encrypted data')
+    except throttle.Throttled as e:
+        raise DecryptError(429, str(e), e.retry_after)
+    except ClientError as e:
+        error_code = e.response['Error']['Code']
+        if error_code == 'InvalidCiphertextException':
+            raise DecryptError(400, 'Invalid encrypted data')
+        elif error_code == 'AccessDeniedException':
+            raise DecryptError(403, 'Access denied to KMS key')
+        raise
+
+    next_frame = frame_start + frame_count
+    return {
+        'blobKey': blob_key,
+        'plaintextBase64': base64.b64encode(plaintext).decode('ascii'),
+        'frameStart': frame_start,
+        'frameCount': frame_count,
+        'totalFrames': total_frames,
+        'nextFrame': next_frame if next_frame < total_frames else None
+    }
+
+
+def log_result_cache_stats() -> None:
+    """Record result cache counters so the byte budget can be sized from CloudWatch."""
+    if result_cache.enabled:
+        # Container-lifetime totals, so they are properties rather than per-invocation metrics
+        metrics.set_property('ResultCache', result_cache.stats())
+
+
+def read_segments(s3_bucket: str, blob_keys: List[str]) -> Dict[str, Tuple[bytes, str]]:
+    """
+    Read a batch's compacted blobs with a few ranged GETs of their segments.
+
+    Keys the segment index does not know are probed in order with a
+    HeadObject: a pointer loads its segment's index, which usually locates
+    much of the rest of the session, and the first blob that is not
+    compacted ends the probing. Probes are sequential round trips ahead of
+    the parallel reads, so by default they are only made once a read in
+    this container has met a segment. Returns {blobKey: (bytes, etag)}.
+    """
+    wanted = [key for key in blob_keys if not result_cache.fresh(s3_bucket, key)]
+    probe = SEGMENT_BATCH_PROBE in ('1', 'true', 'yes') or (SEGMENT_BATCH_PROBE == 'auto' and segment_index.loads > 0)
+    for blob_key in wanted if probe else ():
+        if segment_index.locate(blob_key) is not None:
+            continue
+        try:
+            with metrics.phase('S3Head'):
+                location = segments.pointer_location(s3_client.head_object(Bucket=s3_bucket, Key=blob_key))
+        except ClientError:
+            # Missing blobs are reported by the per-key read
+            continue
+        if location is None:
+            break
+        with metrics.phase('SegmentIndexLoad'):
+            segment_index.load(s3_client, s3_bucket, location.segment)
+    located = {}
+    for blob_key in wanted:
+        location = segment_index.locate(blob_key)
+        if location is not None:
+            located[blob_key] = location
+    if not located:
+        return {}
+    with metrics.phase('SegmentRead'):
+        blobs = segments.read_many(s3_client, s3_bucket, located, SEGMENT_READ_GAP_BYTES,
+                                   SEGMENT_READ_MAX_BYTES, BATCH_MAX_WORKERS)
+    return {blob_key: (data, located[blob_key].etag) for blob_key, data in blobs.items()}
+
+
+def decrypt_batch(blob_keys: List[str], s3_bucket: str, kms_key_id: str) -> List[Dict[str, Any]]:
+    """
+    Fetch and decrypt many blobs concurrently on a bounded worker pool.
+
+    Every key gets its own result entry, in request order, so a single
+    missing or corrupt blob never fails the whole batch. Duplicate keys
+    are only fetched once, and compacted blobs are read together from
+    their segments.
+    """
+    unique_keys = list(dict.fromkeys(blob_keys))
+    try:
+        prefetched = read_segments(s3_bucket, unique_keys)
+    except Exception as e:
+        # Each key falls back to its own read, and reports its own error
+        if not isinstance(e, deadline.DeadlineExceeded):
+            metrics.log('unexpected_error', phase='segment_read', error=type(e).__name__)
+        prefetched = {}
+
+    def decrypt_one(blob_key: str) -> Dict[str, Any]:
+        try:
+            plaintext = as_text(read_blob(s3_bucket, blob_key, kms_key_id, prefetched.get(blob_key)))
+            return {'blobKey': blob_key, 'statusCode': 200, 'plaintext': plaintext}
+        except DecryptError as e:
+            result = {'blobKey': blob_key, 'statusCode': e.status_code, 'error': e.message}
+            if e.retry_after is not None:
+                result['retryAfter'] = e.retry_after
+            return result
+        except deadline.DeadlineExceeded as e:
+            return {'blobKey': blob_key, 'statusCode': e.status_code, 'error': str(e)}
+        except NoCredentialsError:
+            return {'blobKey': blob_key, 'statusCode': 500, 'error': 'AWS credentials not configured'}
+        except Exception as e:
+            metrics.log('unexpected_error', phase='batch_item', error=type(e).__name__)
+            return {'blobKey': blob_key, 'statusCode': 500, 'error': 'Internal server error'}
+
+    workers = max(1, min(BATCH_MAX_WORKERS, len(unique_keys)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [metrics.submit(executor, decrypt_one, blob_key) for blob_key in unique_keys]
+        results = {blob_key: future.result() for blob_key, future in zip(unique_keys, futures)}
+
+    return [results[blob_key] for blob_key in blob_keys]
+
+
+def warm_data_key(s3_bucket: str, blob_key: str, kms_key_id: str) -> bool:
+    """
+    Unwrap an envelope or framed blob's data key into the data key cache.
+
+    Returns False for a KMS ciphertext blob: with no result cache its
+    plaintext would be thrown away, so it is not decrypted.
+    """
+    encrypted_blob, _ = fetch_blob(s3_bucket, blob_key)
+    try:
+        if envelope.is_envelope(encrypted_blob):
+            wrapped_key = envelope.unpack_envelope(encrypted_blob)[1]
+        elif framed.is_framed(encrypted_blob):
+            wrapped_key = framed.FramedHeader.parse(encrypted_blob).wrapped_key
+        else:
+            return False
+    except envelope.EnvelopeFormatError:
+        return False
+    unwrap_data_key(bytes(wrapped_key), kms_key_id)
+    return True
+
+
+def handle_warmup(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Open S3 and KMS connections and prefetch hot blobs into the caches."""
+    s3_bucket = os.environ.get('S3_BUCKET')
+    kms_key_id = os.environ.get('KMS_KEY_ID')
+
+    def prefetch(blob_keys: List[str]) -> int:
+        if result_cache.enabled:
+            results = decrypt_batch(blob_keys, s3_bucket, kms_key_id)
+            return sum(1 for result in results if result['statusCode'] == 200)
+        # Without a result cache only envelope data keys outlive the warm-up
+        if data_key_cache.ttl_seconds <= 0 or data_key_cache.max_uses <= 0:
+            return 0
+
+        def warm_one(blob_key: str) -> bool:
+            try:
+                return warm_data_key(s3_bucket, blob_key, kms_key_id)
+            except Exception as e:
+                metrics.log('warmup_error', phase='prefetch', error=type(e).__name__)
+                return False
+
+        unique_keys = list(dict.fromkeys(blob_keys))
+        workers = max(1, min(BATCH_MAX_WORKERS, len(unique_keys)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [metrics.submit(executor, warm_one, blob_key) for blob_key in unique_keys]
+            return sum(1 for future in futures if future.result())
+
+    probes = {
+        's3': lambda: s3_client.head_object(Bucket=s3_bucket or 'warmup', Key='warmup-probe'),
+        'kms': lambda: kms_client.describe_key(KeyId=kms_key_id or 'alias/warmup'),
+    }
+    report = warmup.warm(
+        'handler', probes, {'S3_BUCKET': s3_bucket, 'KMS_KEY_ID': kms_key_id},
+        prefetch if s3_bucket and kms_key_id else None, warmup.prefetch_keys(event),
+        cold_start.report is None
+    )
+    return {'statusCode': 200, 'body': json.dumps(report)}
+
+
+def _ok(event: Dict[str, Any], headers: Dict[str, str], body: Union[str, bytes],
+        content_type: Optional[str] = None) -> Dict[str, Any]:
+    """A 200 response, compressed when the client's Accept-Encoding allows it."""
+    accept_encoding = get_header(event, 'Accept-Encoding')
+    with metrics.phase('Encode'):
+        encoded, is_base64, coding_headers = content_coding.encode_body(body, accept_encoding)
+    headers = {**headers, **coding_headers}
+    if content_type:
+        headers['Content-Type'] = content_type
+    if accept_encoding or content_type:
+        headers['Vary'] = 'Accept, Accept-Encoding'
+    response = {
+        'statusCode': 200,
+        'headers': headers,
+        'body': encoded
+    }
+    if is_base64:
+        response['isBase64Encoded'] = True
+    return response
+
+
+def _is_count(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+@cold_start.instrument
+@metrics.instrument('handler', cold_start)
+@profiling.instrument('handler')
+@deadline.instrument
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     Lambda function to decrypt S3 blobs using AWS KMS.
@@ -22,6 +541,45 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     {
         "plaintext": "decrypted-content"
     }
+
+    Batch input:
+    {
+        "blobKeys": ["s3-key-1", "s3-key-2"]
+    }
+
+    Returns one entry per requested key, in request order:
+    {
+        "results": [
+            {"blobKey": "s3-key-1", "statusCode": 200, "plaintext": "..."},
+            {"blobKey": "s3-key-2", "statusCode": 404, "error": "..."}
+        ]
+    }
+
+    With "Accept: application/octet-stream" a single blob's plaintext is
+    returned as raw bytes (isBase64Encoded), so binary payloads such as
+    audio work. Successful responses are gzip- or zstd-compressed when
+    Accept-Encoding allows it (see content_coding.py).
+
+    S3 and KMS calls are bounded by the time the context has left; a
+    request that runs out of time gets a 504 (a call timed out) or 503
+    (remaining work was shed) instead of being killed at the timeout.
+
+    Paged input for framed blobs:
+    {
+        "blobKey": "s3-key",
+        "frameStart": 0,
+        "maxFrames": 16
+    }
+
+    Returns one page of plaintext, decrypted frame by frame from ranged reads:
+    {
+        "blobKey": "s3-key",
+        "plaintextBase64": "...",
+        "frameStart": 0,
+        "frameCount": 16,
+        "totalFrames": 40,
+        "nextFrame": 16
+    }
     """
     
     # CORS headers for all responses
@@ -31,6 +589,10 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         'Access-Control-Allow-Methods': 'POST,OPTIONS'
     }
     
+    if warmup.is_warmup(event):
+        metrics.set_property('Route', 'warmup')
+        return handle_warmup(event)
+
     # Handle OPTIONS requests for CORS preflight
     if event.get('httpMethod') == 'OPTIONS':
         return {
@@ -48,16 +610,47 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'error': 'Request body is required'})
             }
         
-        body = json.loads(event['body'])
+        metrics.add('RequestBytes', len(event['body'] or ''), 'Bytes')
+        with metrics.phase('Parse'):
+            body = json.loads(event['body'])
         blob_key = body.get('blobKey')
+        blob_keys = body.get('blobKeys')
         
-        if not blob_key:
+        if blob_keys is not None:
+            if (not isinstance(blob_keys, list) or not blob_keys
+                    or not all(isinstance(key, str) and key for key in blob_keys)):
+                return {
+                    'statusCode': 400,
+                    'headers': cors_headers,
+                    'body': json.dumps({'error': 'blobKeys must be a non-empty list of blob keys'})
+                }
+            if len(blob_keys) > MAX_BATCH_KEYS:
+                return {
+                    'statusCode': 400,
+                    'headers': cors_headers,
+                    'body': json.dumps({'error': f'blobKeys may contain at most {MAX_BATCH_KEYS} keys'})
+                }
+        elif not blob_key:
             return {
                 'statusCode': 400,
                 'headers': cors_headers,
                 'body': json.dumps({'error': 'blobKey is required in request body'})
             }
         
+        frame_start = body.get('frameStart')
+        max_frames = body.get('maxFrames')
+        if frame_start is not None or max_frames is not None:
+            if frame_start is None:
+                frame_start = 0
+            if (blob_keys is not None
+                    or not _is_count(frame_start)
+                    or (max_frames is not None and not (_is_count(max_frames) and max_frames > 0))):
+                return {
+                    'statusCode': 400,
+                    'headers': cors_headers,
+                    'body': json.dumps({'error': 'frameStart and maxFrames must be non-negative integers with a single blobKey'})
+                }
+        
         # Get environment variables
         s3_bucket = os.environ.get('S3_BUCKET')
         kms_key_id = os.environ.get('KMS_KEY_ID')
@@ -69,81 +662,47 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'error': 'Missing required environment variables: S3_BUCKET or KMS_KEY_ID'})
             }
         
-        # Download encrypted blob from S3
-        try:
-            response = s3_client.get_object(Bucket=s3_bucket, Key=blob_key)
-            encrypted_blob = response['Body'].read()
-            print(f"Downloaded encrypted blob size: {len(encrypted_blob)} bytes")
-            
-            # Try to decode as base64 first (since AWS CLI outputs base64-encoded data)
+        if blob_keys is not None:
+            metrics.set_property('Route', 'batch')
+            metrics.add('BatchKeys', len(blob_keys))
+            results = decrypt_batch(blob_keys, s3_bucket, kms_key_id)
+            log_result_cache_stats()
+            with metrics.phase('Serialize'):
+                response_body = json.dumps({
+                    'results': results
+                })
+            return _ok(event, cors_headers, response_body)
+        
+        if frame_start is not None:
+            metrics.set_property('Route', 'frames')
             try:
-                # Decode base64 to get raw binary data for KMS
-                encrypted_blob = base64.b64decode(encrypted_blob)
-                print(f"Successfully decoded base64, binary size: {len(encrypted_blob)} bytes")
-            except Exception as e:
-                print(f"Failed to decode as base64, treating as raw binary: {str(e)}")
-                # If base64 decode fails, assume it's already raw binary
-                pass
-                
-        except ClientError as e:
-            error_code = e.response['Error']['Code']
-            if error_code == 'NoSuchKey':
-                return {
-                    'statusCode': 404,
-                    'headers': cors_headers,
-                    'body': json.dumps({'error': f'Blob not found: {blob_key}'})
-                }
-            elif error_code == 'NoSuchBucket':
-                return {
-                    'statusCode': 500,
-                    'headers': cors_headers,
-                    'body': json.dumps({'error': f'S3 bucket not found: {s3_bucket}'})
-                }
-            else:
-                raise
+                page = read_frames(s3_bucket, blob_key, kms_key_id, frame_start, max_frames)
+            except DecryptError as e:
+                return e.response(cors_headers)
+            with metrics.phase('Serialize'):
+                response_body = json.dumps(page)
+            return _ok(event, cors_headers, response_body)
         
-        # Decrypt the blob using KMS
+        # Download the encrypted blob from S3 and decrypt it using KMS
+        metrics.set_property('Route', 'decrypt')
+        binary = BINARY_CONTENT_TYPE in (get_header(event, 'Accept') or '')
         try:
-            print(f"Attempting to decrypt blob with KMS key: {kms_key_id}")
-            decrypt_response = kms_client.decrypt(
-                CiphertextBlob=encrypted_blob,
-                KeyId=kms_key_id
-            )
-            print(f"Decryption successful, plaintext length: {len(decrypt_response['Plaintext'])} bytes")
-            plaintext = decrypt_response['Plaintext'].decode('utf-8')
-            print(f"Decoded plaintext: {plaintext}")
-        except UnicodeDecodeError as e:
-            print(f"Unicode decode error: {str(e)}")
-            return {
-                'statusCode': 400,
-                'headers': cors_headers,
-                'body': json.dumps({'error': f'Failed to decode decrypted data: {str(e)}'})
-            }
-        except ClientError as e:
-            error_code = e.response['Error']['Code']
-            if error_code == 'InvalidCiphertextException':
-                return {
-                    'statusCode': 400,
-                    'headers': cors_headers,
-                    'body': json.dumps({'error': 'Invalid encrypted data'})
-                }
-            elif error_code == 'AccessDeniedException':
-                return {
-                    'statusCode': 403,
-                    'headers': cors_headers,
-                    'body': json.dumps({'error': 'Access denied to KMS key'})
-                }
-            else:
-                raise
+            plaintext = read_blob(s3_bucket, blob_key, kms_key_id)
+            log_result_cache_stats()
+            if binary:
+                # Raw bytes: no UTF-8 decoding, JSON escaping or size growth
+                metrics.set_property('ResponseMode', 'binary')
+                return _ok(event, cors_headers, plaintext, BINARY_CONTENT_TYPE)
+            plaintext = as_text(plaintext)
+        except DecryptError as e:
+            return e.response(cors_headers)
         
         # Return successful response
-        return {
-            'statusCode': 200,
-            'headers': cors_headers,
-            'body': json.dumps({
+        with metrics.phase('Serialize'):
+            response_body = json.dumps({
                 'plaintext': plaintext
             })
-        }
+        return _ok(event, cors_headers, response_body)
         
     except json.JSONDecodeError:
         return {
@@ -151,6 +710,8 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': cors_headers,
             'body': json.dumps({'error': 'Invalid JSON in request body'})
         }
+    except deadline.DeadlineExceeded as e:
+        return e.response(cors_headers)
     except NoCredentialsError:
         return {
             'statusCode': 500,
@@ -158,9 +719,12 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'AWS credentials not configured'})
         }
     except Exception as e:
-        print(f"Unexpected error: {str(e)}")
+        metrics.log('unexpected_error', error=type(e).__name__)
         return {
             'statusCode': 500,
             'headers': cors_headers,
             'body': json.dumps({'error': 'Internal server error'})
-        } 
\ No newline at end of file
+        }
+
+
+cold_start.mark_imported()
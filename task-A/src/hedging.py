@@ -0,0 +1,163 @@
+"""
+Hedged S3 reads.
+
+A single slow GetObject sets the handlers' p99. With hedging on, a blob
+read that has not finished by a deadline sends a second GET and uses
+whichever answers first:
+
+  - the deadline is a percentile of recent primary read latencies in this
+    container, clamped to a min/max; until enough reads have been seen a
+    fixed initial delay is used
+  - the hedge goes to the replica bucket when one is configured (e.g. a
+    Cross-Region Replication target), otherwise to the same object again
+  - the loser is cancelled: a GET that has not started is dropped, and one
+    whose response arrives late has its body closed unread
+  - an error from the primary is returned as is; an error from the hedge
+    (say, a replica that has not caught up yet) just leaves the primary
+    to finish
+
+    S3_HEDGE                   off (default) or on
+    S3_HEDGE_PERCENTILE        latency percentile used as the deadline (95)
+    S3_HEDGE_INITIAL_DELAY_MS  deadline before enough samples exist (100)
+    S3_HEDGE_MIN_DELAY_MS      lower bound of the deadline (10)
+    S3_HEDGE_MAX_DELAY_MS      upper bound of the deadline (1000)
+    S3_HEDGE_MIN_SAMPLES       reads needed before the percentile is used (20)
+    S3_HEDGE_MAX_WORKERS       threads running primary and hedge GETs (16)
+    S3_REPLICA_BUCKET          bucket hedges are sent to (default: the same bucket)
+    S3_REPLICA_REGION          region of the replica bucket, when it differs
+
+Each handler keeps its own reader; fired and won count hedges since the
+container started, and every invocation records S3HedgesFired and
+S3HedgesWon metrics.
+"""
+
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Optional, Tuple
+
+import deadline
+import metrics
+from aws_clients import LazyClient
+
+
+class LatencyTracker:
+    """Sliding window of recent read latencies in milliseconds."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, ms: float) -> None:
+        with self._lock:
+            self._samples.append(ms)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """Nearest-rank percentile, or None until min_samples reads were recorded."""
+        with self._lock:
+            if len(self._samples) < max(1, self.min_samples):
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))]
+
+
+class HedgedReader:
+    """GetObject plus body read, hedged with a second GET after a latency-based deadline."""
+
+    def __init__(self, enabled: bool = False, percentile: float = 95, initial_delay_ms: float = 100,
+                 min_delay_ms: float = 10, max_delay_ms: float = 1000, min_samples: int = 20,
+                 max_workers: int = 16, replica_bucket: Optional[str] = None, replica_client: Any = None):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.initial_delay_ms = initial_delay_ms
+        self.min_delay_ms = min_delay_ms
+        self.max_delay_ms = max_delay_ms
+        self.replica_bucket = replica_bucket
+        self.replica_client = replica_client
+        self.latencies = LatencyTracker(min_samples=min_samples)
+        self.fired = 0
+        self.won = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='s3-hedge')
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> 'HedgedReader':
+        region = os.environ.get('S3_REPLICA_REGION')
+        return cls(
+            enabled=os.environ.get('S3_HEDGE', 'off').lower() in ('on', '1', 'true'),
+            percentile=float(os.environ.get('S3_HEDGE_PERCENTILE', '95')),
+            initial_delay_ms=float(os.environ.get('S3_HEDGE_INITIAL_DELAY_MS', '100')),
+            min_delay_ms=float(os.environ.get('S3_HEDGE_MIN_DELAY_MS', '10')),
+            max_delay_ms=float(os.environ.get('S3_HEDGE_MAX_DELAY_MS', '1000')),
+            min_samples=int(os.environ.get('S3_HEDGE_MIN_SAMPLES', '20')),
+            max_workers=int(os.environ.get('S3_HEDGE_MAX_WORKERS', '16')),
+            replica_bucket=os.environ.get('S3_REPLICA_BUCKET') or None,
+            # Bounded like the handlers' own S3 clients, so hedges respect the invocation deadline
+            replica_client=deadline.BoundedClient(LazyClient('s3', region)) if region else None,
+        )
+
+    def delay_ms(self) -> float:
+        """How long the primary GET may take before a hedge is sent."""
+        observed = self.latencies.percentile(self.percentile)
+        if observed is None:
+            return self.initial_delay_ms
+        return min(self.max_delay_ms, max(self.min_delay_ms, observed))
+
+    def stats(self) -> Dict[str, Any]:
+        return {'fired': self.fired, 'won': self.won, 'delayMs': round(self.delay_ms(), 3)}
+
+    def get_object(self, client: Any, Bucket: str, Key: str, **kwargs: Any) -> Tuple[Dict[str, Any], bytes]:
+        """Return (response, body bytes) of GetObject; client errors propagate as from the client."""
+        if not self.enabled:
+            response = client.get_object(Bucket=Bucket, Key=Key, **kwargs)
+            return response, response['Body'].read()
+
+        cancelled = threading.Event()
+        started = time.perf_counter()
+        primary = metrics.submit(self._executor, _read, client, Bucket, Key, kwargs, cancelled)
+        done, _ = wait([primary], timeout=self.delay_ms() / 1000)
+        if done:
+            response, data = primary.result()
+            self.latencies.record((time.perf_counter() - started) * 1000)
+            return response, data
+
+        with self._lock:
+            self.fired += 1
+        metrics.add('S3HedgesFired', 1)
+        hedge = metrics.submit(self._executor, _read, self.replica_client or client,
+                               self.replica_bucket or Bucket, Key, kwargs, cancelled)
+        pending = {primary, hedge}
+        try:
+            while True:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                # A success beats an error, and the primary wins ties
+                for future in sorted(done, key=lambda f: (f.exception() is not None, f is not primary)):
+                    error = future.exception()
+                    if error is None:
+                        # The primary took at least this long, so the tail stays in the window
+                        self.latencies.record((time.perf_counter() - started) * 1000)
+                        if future is hedge:
+                            with self._lock:
+                                self.won += 1
+                            metrics.add('S3HedgesWon', 1)
+                        return future.result()
+                    if future is primary:
+                        raise error
+        finally:
+            cancelled.set()
+            for future in pending:
+                future.cancel()
+
+
+def _read(client: Any, bucket: str, key: str, kwargs: Dict[str, Any],
+          cancelled: threading.Event) -> Optional[Tuple[Dict[str, Any], bytes]]:
+    response = client.get_object(Bucket=bucket, Key=key, **kwargs)
+    if cancelled.is_set():
+        # Lost the race: release the connection without downloading the body
+        response['Body'].close()
+        return None
+    return response, response['Body'].read()
@@ -0,0 +1,17 @@
+"""
+Request header lookup for API Gateway proxy events, shared by the handlers.
+
+Header names are case-insensitive, and API Gateway passes "headers" as
+None for a request without any.
+"""
+
+from typing import Any, Dict, Optional
+
+
+def get_header(event: Dict[str, Any], name: str) -> Optional[str]:
+    """Case-insensitive request header lookup (API Gateway may pass headers as None)."""
+    wanted = name.lower()
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == wanted:
+            return value
+    return None
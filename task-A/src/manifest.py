@@ -0,0 +1,237 @@
+"""
+Hash-sharded blob keys and per-owner blob manifests.
+
+Blob keys get a short hash prefix (`3f/5b1c...`), so writes spread evenly
+across S3 key partitions instead of piling onto one prefix and hitting
+its request-rate limit.
+
+Each owner has a compact manifest object listing their blobs, so a
+listing is one GetObject instead of a ListObjectsV2 scan of the bucket:
+
+    manifests/<shard>/<sha256(owner)>.json
+    {"version": 1, "entries": [[blobKey, size, uploadedAt], ...]}
+
+Entries of blobs compacted into a segment (segments.py) carry the
+segment key as a fourth field, so compaction skips them.
+
+Uploads append to it, and deletes and the expiry sweep remove from it,
+with a read-modify-write guarded by S3 conditional writes (If-Match /
+If-None-Match), so concurrent updates for one owner never overwrite each
+other's entries. A writer that loses the race re-reads and retries after
+a full-jitter backoff, up to MANIFEST_MAX_ATTEMPTS times and never past
+the request's deadline; an update that still cannot land raises, so the
+caller can report the blob as unlisted rather than lose it silently.
+
+    MANIFEST_MAX_ATTEMPTS      conditional writes per update (50)
+    MANIFEST_BACKOFF_BASE_MS   backoff base, doubled per retry (10)
+    MANIFEST_BACKOFF_MAX_MS    backoff cap (200)
+
+load_key() and update() work on any such entry document; segments.py
+keeps its per-segment ledgers of live blobs the same way.
+
+Every write rewrites the whole manifest, so a session uploaded one blob
+at a time costs writes that grow with its size; /upload/batch records a
+whole batch in one write.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import random
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import deadline
+import metrics
+from aws_clients import error_code
+
+MANIFEST_PREFIX = 'manifests/'
+MANIFEST_VERSION = 1
+
+Entry = List[Any]
+
+MAX_ATTEMPTS = int(os.environ.get('MANIFEST_MAX_ATTEMPTS', '50'))
+BACKOFF_BASE = float(os.environ.get('MANIFEST_BACKOFF_BASE_MS', '10')) / 1000
+BACKOFF_MAX = float(os.environ.get('MANIFEST_BACKOFF_MAX_MS', '200')) / 1000
+
+
+class ManifestError(Exception):
+    """Raised when a manifest cannot be read or updated."""
+
+
+def _shard(value: str, chars: int) -> str:
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()[:chars]
+
+
+def new_blob_key(shard_chars: int = 2) -> str:
+    """A fresh UUID key behind a hash prefix of shard_chars hex digits (flat when 0)."""
+    blob_id = str(uuid.uuid4())
+    if shard_chars <= 0:
+        return blob_id
+    return f'{_shard(blob_id, shard_chars)}/{blob_id}'
+
+
+def content_blob_key(data: bytes, shard_chars: int = 2, owner: Optional[str] = None) -> str:
+    """
+    Content-addressed key: the SHA-256 of the stored bytes, behind its own leading hex digits.
+
+    With an owner the digest covers sha256(owner) followed by the bytes, so
+    only the same owner's uploads share a key: anyone able to read a blob
+    could otherwise re-upload it and list, then delete, the original.
+    """
+    hasher = hashlib.sha256()
+    if owner is not None:
+        hasher.update(hashlib.sha256(owner.encode('utf-8')).digest())
+    hasher.update(data)
+    digest = hasher.hexdigest()
+    if shard_chars <= 0:
+        return digest
+    return f'{digest[:shard_chars]}/{digest}'
+
+
+def manifest_key(owner: str) -> str:
+    """Object key of an owner's manifest; the owner id is hashed so any string is safe."""
+    owner_hash = hashlib.sha256(owner.encode('utf-8')).hexdigest()
+    return f'{MANIFEST_PREFIX}{owner_hash[:2]}/{owner_hash}.json'
+
+
+def load(s3_client: Any, bucket: str, owner: str) -> Tuple[List[Entry], Optional[str]]:
+    """Return (entries, etag); an owner without uploads has no manifest yet."""
+    return load_key(s3_client, bucket, manifest_key(owner))
+
+
+def load_key(s3_client: Any, bucket: str, key: str) -> Tuple[List[Entry], Optional[str]]:
+    """(entries, etag) of the entry document at key, ([], None) when there is none."""
+    try:
+        obj = s3_client.get_object(Bucket=bucket, Key=key)
+    except Exception as e:
+        if error_code(e) in ('NoSuchKey', '404'):
+            return [], None
+        raise
+    try:
+        document = json.loads(obj['Body'].read())
+        return document['entries'], obj.get('ETag')
+    except (ValueError, KeyError, TypeError) as e:
+        raise ManifestError(f'Invalid manifest: {e}')
+
+
+def update(s3_client: Any, bucket: str, key: str, change: Callable[[List[Entry]], Optional[List[Entry]]],
+           max_attempts: Optional[int] = None) -> None:
+    """
+    Read-modify-write the entry document at key, retrying on concurrent updates.
+
+    change returns the new entries, or None when there is nothing to write.
+    Raises ManifestError after max_attempts conflicts (MAX_ATTEMPTS when
+    None), or DeadlineExceeded when a backoff would outlast the deadline.
+    """
+    attempts = MAX_ATTEMPTS if max_attempts is None else max_attempts
+    for attempt in range(attempts):
+        if attempt:
+            metrics.add('ManifestConflicts', 1)
+            delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)))
+            deadline.ensure(delay * 1000, 'manifest_retry')
+            time.sleep(delay)
+        entries, etag = load_key(s3_client, bucket, key)
+        entries = change(entries)
+        if entries is None:
+            return
+        body = json.dumps({'version': MANIFEST_VERSION, 'entries': entries}, separators=(',', ':'))
+        condition = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+        try:
+            s3_client.put_object(Bucket=bucket, Key=key, Body=body,
+                                 ContentType='application/json', **condition)
+            return
+        except Exception as e:
+            # Another writer replaced the manifest since it was read
+            if error_code(e) not in ('PreconditionFailed', 'ConditionalRequestConflict', '412', '409'):
+                raise
+    raise ManifestError('Manifest update conflicted too many times')
+
+
+def record(s3_client: Any, bucket: str, owner: str, blob_key: str, size: int,
+           uploaded_at: int, max_attempts: Optional[int] = None) -> None:
+    """Append an entry to the owner's manifest, retrying on concurrent updates; a no-op if already listed."""
+    record_many(s3_client, bucket, owner, [[blob_key, size, uploaded_at]], max_attempts)
+
+
+def record_many(s3_client: Any, bucket: str, owner: str, new_entries: List[Entry],
+                max_attempts: Optional[int] = None) -> None:
+    """Append several [blobKey, size, uploadedAt] entries in one manifest write, skipping listed keys."""
+    def change(entries: List[Entry]) -> Optional[List[Entry]]:
+        listed = {entry[0] for entry in entries}
+        added = []
+        for entry in new_entries:
+            if entry[0] not in listed:
+                listed.add(entry[0])
+                added.append(list(entry))
+        return entries + added if added else None
+
+    update(s3_client, bucket, manifest_key(owner), change, max_attempts)
+
+
+def remove(s3_client: Any, bucket: str, owner: str, blob_keys: Iterable[str],
+           max_attempts: Optional[int] = None) -> None:
+    """Drop deleted blobs from the owner's manifest; a no-op if none of them is listed."""
+    removed = set(blob_keys)
+
+    def change(entries: List[Entry]) -> Optional[List[Entry]]:
+        kept = [entry for entry in entries if entry[0] not in removed]
+        return kept if len(kept) < len(entries) else None
+
+    update(s3_client, bucket, manifest_key(owner), change, max_attempts)
+
+
+def forget(s3_client: Any, bucket: str, key: str, blob_keys: Iterable[str],
+           max_attempts: Optional[int] = None) -> int:
+    """Drop deleted blobs from the manifest object at key, whoever owns it; returns how many were listed."""
+    removed = set(blob_keys)
+    forgotten = [0]
+
+    def change(entries: List[Entry]) -> Optional[List[Entry]]:
+        kept = [entry for entry in entries if entry[0] not in removed]
+        forgotten[0] = len(entries) - len(kept)
+        return kept if forgotten[0] else None
+
+    update(s3_client, bucket, key, change, max_attempts)
+    return forgotten[0]
+
+
+def mark_compacted(s3_client: Any, bucket: str, owner: str, segment_keys: Dict[str, str],
+                   max_attempts: Optional[int] = None) -> None:
+    """Record the segment each of the owner's compacted blobs ({blobKey: segmentKey}) now lives in."""
+    def change(entries: List[Entry]) -> Optional[List[Entry]]:
+        marked = [entry[:3] + [segment_keys[entry[0]]] if entry[0] in segment_keys else entry
+                  for entry in entries]
+        return marked if marked != entries else None
+
+    update(s3_client, bucket, manifest_key(owner), change, max_attempts)
+
+
+def encode_cursor(entry: Entry) -> str:
+    return base64.urlsafe_b64encode(json.dumps([entry[2], entry[0]]).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str) -> Tuple[int, str]:
+    try:
+        uploaded_at, blob_key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return int(uploaded_at), str(blob_key)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+
+def page(entries: List[Entry], limit: int, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    One page of entries, newest first, and the cursor for the next page (None at the end).
+
+    The cursor is the (uploadedAt, blobKey) position of the last entry
+    returned, so pages stay stable while new blobs are uploaded.
+    """
+    ordered = sorted(entries, key=lambda entry: (entry[2], entry[0]), reverse=True)
+    if cursor:
+        position = decode_cursor(cursor)
+        ordered = [entry for entry in ordered if (entry[2], entry[0]) < position]
+    items = [{'blobKey': entry[0], 'size': entry[1], 'uploadedAt': entry[2]} for entry in ordered[:limit]]
+    next_cursor = encode_cursor(ordered[limit - 1]) if len(ordered) > limit else None
+    return items, next_cursor
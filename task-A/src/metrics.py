@@ -0,0 +1,146 @@
+"""
+Structured per-invocation instrumentation for the Lambda handlers.
+
+Each invocation collects phase timings (body parse, S3 get/put, base64
+decode, KMS decrypt, response serialization, ...) and byte counts, and
+emits them as one CloudWatch Embedded Metric Format (EMF) record, which
+CloudWatch turns into metrics without any API calls from the function.
+
+Only names, sizes, durations and status codes are recorded: blob keys,
+ciphertexts and plaintexts are never logged.
+
+    METRICS_NAMESPACE    CloudWatch namespace (Solace)
+    METRICS_SAMPLE_RATE  fraction of warm invocations emitted, 0.0-1.0 (1.0);
+                         cold starts are always emitted
+"""
+
+import contextvars
+import functools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+_current: 'contextvars.ContextVar[Optional[Invocation]]' = contextvars.ContextVar('invocation', default=None)
+
+
+class Invocation:
+    """Metrics and properties collected during one handler invocation."""
+
+    def __init__(self, handler_name: str, cold: bool, sampled: bool):
+        self.handler_name = handler_name
+        self.cold = cold
+        self.sampled = sampled
+        self.values: Dict[str, float] = {}
+        self.units: Dict[str, str] = {}
+        self.properties: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, value: float, unit: str = 'Count') -> None:
+        """Add to a metric; repeated phases (e.g. in a batch) accumulate."""
+        with self._lock:
+            self.values[name] = self.values.get(name, 0) + value
+            self.units[name] = unit
+
+    def set_property(self, name: str, value: Any) -> None:
+        with self._lock:
+            self.properties[name] = value
+
+    def to_emf(self, namespace: str) -> Dict[str, Any]:
+        """Render as an EMF record with Handler as the dimension."""
+        with self._lock:
+            values = {name: round(value, 3) for name, value in self.values.items()}
+            record = {
+                '_aws': {
+                    'Timestamp': int(time.time() * 1000),
+                    'CloudWatchMetrics': [{
+                        'Namespace': namespace,
+                        'Dimensions': [['Handler']],
+                        'Metrics': [{'Name': name, 'Unit': self.units[name]} for name in values],
+                    }],
+                },
+                'Handler': self.handler_name,
+                'ColdStart': self.cold,
+            }
+            record.update(self.properties)
+            record.update(values)
+            return record
+
+
+def current() -> Optional[Invocation]:
+    """The invocation being handled in this context, if any."""
+    return _current.get()
+
+
+def add(name: str, value: float, unit: str = 'Count') -> None:
+    """Record a metric on the current invocation (no-op outside one)."""
+    invocation = _current.get()
+    if invocation is not None:
+        invocation.add(name, value, unit)
+
+
+def set_property(name: str, value: Any) -> None:
+    """Attach a non-metric property (route, status code, ...) to the current record."""
+    invocation = _current.get()
+    if invocation is not None:
+        invocation.set_property(name, value)
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Time a block as <name>Ms on the current invocation."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(f'{name}Ms', (time.perf_counter() - started) * 1000, 'Milliseconds')
+
+
+def log(event: str, **fields: Any) -> None:
+    """Write a structured log line; callers must not pass payload contents."""
+    invocation = _current.get()
+    record = {'event': event}
+    if invocation is not None:
+        record['handler'] = invocation.handler_name
+    record.update(fields)
+    print(json.dumps(record, default=str))
+
+
+def instrument(handler_name: str, cold_start: Any = None) -> Callable:
+    """
+    Decorator collecting an Invocation around a Lambda handler and emitting it as EMF.
+
+    cold_start is the handler's ColdStart; an invocation is cold while its
+    report has not been produced yet.
+    """
+
+    def decorator(handler: Callable) -> Callable:
+        @functools.wraps(handler)
+        def wrapper(event: Any, context: Any) -> Any:
+            cold = cold_start is not None and cold_start.report is None
+            sample_rate = float(os.environ.get('METRICS_SAMPLE_RATE', '1.0'))
+            invocation = Invocation(handler_name, cold, cold or random.random() < sample_rate)
+            token = _current.set(invocation)
+            started = time.perf_counter()
+            try:
+                response = handler(event, context)
+                invocation.set_property('StatusCode', response.get('statusCode'))
+                invocation.add('ResponseBytes', len(response.get('body') or ''), 'Bytes')
+                return response
+            finally:
+                invocation.add('TotalMs', (time.perf_counter() - started) * 1000, 'Milliseconds')
+                _current.reset(token)
+                if invocation.sampled:
+                    print(json.dumps(invocation.to_emf(os.environ.get('METRICS_NAMESPACE', 'Solace'))))
+
+        return wrapper
+
+    return decorator
+
+
+def submit(executor: Any, fn: Callable, *args: Any) -> Any:
+    """executor.submit that carries the current invocation into the worker thread."""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
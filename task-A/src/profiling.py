@@ -0,0 +1,122 @@
+"""
+Opt-in memory profiling for the Lambda handlers.
+
+Enabled with PROFILE_MEMORY:
+
+    off      never (default)
+    on       every invocation
+    header   only invocations sent with an `X-Profile-Memory: 1` header
+
+A profiled invocation runs under tracemalloc and logs one JSON line:
+
+    {"memoryProfile": {"handler": ..., "tracemallocPeakBytes": ...,
+                       "peakRssMb": ..., "rssDeltaMb": ..., "payloadBytes": ...,
+                       "peakToPayload": ..., "topAllocations": [...]}}
+
+peakRssMb is the process high-water mark (what Lambda's memory limit is
+checked against); peakToPayload is the tracemalloc peak divided by the
+larger of the request and response bodies, i.e. roughly how many full
+copies of the payload were alive at once. The values are also added to
+the invocation's metrics. tracemalloc slows the handler down noticeably,
+so leave profiling off in production except for short investigations.
+
+    PROFILE_MEMORY_TOP   allocation sites reported (10)
+"""
+
+import functools
+import json
+import os
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+import metrics
+from http_headers import get_header
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - not available on Windows
+    resource = None
+
+
+def enabled(event: Any) -> bool:
+    mode = os.environ.get('PROFILE_MEMORY', 'off').lower()
+    if mode in ('on', '1', 'true'):
+        return True
+    if mode == 'header' and isinstance(event, dict):
+        return str(get_header(event, 'X-Profile-Memory')).lower() in ('1', 'true', 'on')
+    return False
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Process peak resident set size in MiB (ru_maxrss is KiB on Linux)."""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def current_rss_mb() -> Optional[float]:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def top_allocations(snapshot: tracemalloc.Snapshot, limit: int) -> List[Dict[str, Any]]:
+    """Largest allocation sites still alive in the snapshot, by file and line."""
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ))
+    return [
+        {'site': f'{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}',
+         'bytes': stat.size, 'count': stat.count}
+        for stat in snapshot.statistics('lineno')[:limit]
+    ]
+
+
+def instrument(handler_name: str) -> Callable:
+    """Decorator profiling a Lambda handler when enabled() says so; a no-op otherwise."""
+
+    def decorator(handler: Callable) -> Callable:
+        @functools.wraps(handler)
+        def wrapper(event: Any, context: Any) -> Any:
+            if not enabled(event):
+                return handler(event, context)
+
+            started_tracing = not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+            rss_before = current_rss_mb()
+            response = None
+            try:
+                response = handler(event, context)
+                return response
+            finally:
+                _, peak = tracemalloc.get_traced_memory()
+                top = top_allocations(tracemalloc.take_snapshot(), int(os.environ.get('PROFILE_MEMORY_TOP', '10')))
+                if started_tracing:
+                    tracemalloc.stop()
+                rss_after = current_rss_mb()
+
+                request_bytes = len((event.get('body') if isinstance(event, dict) else None) or '')
+                response_bytes = len((response or {}).get('body') or '')
+                payload = max(request_bytes, response_bytes)
+                report = {
+                    'handler': handler_name,
+                    'tracemallocPeakBytes': peak - baseline,
+                    'peakRssMb': round(peak_rss_mb() or 0.0, 2),
+                    'rssDeltaMb': round(rss_after - rss_before, 2) if rss_before and rss_after else None,
+                    'payloadBytes': payload,
+                    'peakToPayload': round((peak - baseline) / payload, 2) if payload else None,
+                    'topAllocations': top,
+                }
+                metrics.add('TracemallocPeakBytes', report['tracemallocPeakBytes'], 'Bytes')
+                metrics.add('PeakRssMb', report['peakRssMb'], 'Megabytes')
+                print(json.dumps({'memoryProfile': report}))
+
+        return wrapper
+
+    return decorator
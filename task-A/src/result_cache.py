@@ -0,0 +1,166 @@
+"""
+In-memory LRU cache of decrypted blobs for warm Lambda containers.
+
+Entries are keyed on (bucket, key) and remember the S3 ETag of the object
+they were decrypted from. A fresh entry (younger than the TTL) is served
+without touching S3; a stale entry is revalidated with a conditional
+GetObject (If-None-Match) so an unchanged blob costs a 304 instead of a
+full download and KMS decrypt.
+"""
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+
+class CacheEntry:
+    """A decrypted blob together with the ETag it was decrypted from."""
+
+    __slots__ = ('etag', 'plaintext', 'size', 'fetched_at')
+
+    def __init__(self, etag: str, plaintext: bytes, size: int, fetched_at: float):
+        self.etag = etag
+        self.plaintext = plaintext
+        self.size = size
+        self.fetched_at = fetched_at
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache bounded by an approximate byte budget.
+
+    A max_bytes of 0 disables the cache entirely. Counters for hits,
+    misses, revalidations and evictions are available from stats().
+    """
+
+    def __init__(self, max_bytes: int = 0, ttl_seconds: float = 60,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._entries: 'OrderedDict[Tuple[str, str], CacheEntry]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def lookup(self, bucket: str, key: str) -> Tuple[Optional[CacheEntry], bool]:
+        """
+        Return (entry, fresh) for a key.
+
+        A fresh entry counts as a hit and can be served as-is. A stale entry
+        is returned so its ETag can be used for a conditional request; the
+        caller reports the outcome through revalidated() or put().
+        """
+        with self._lock:
+            entry = self._entries.get((bucket, key))
+            if entry is None:
+                self.misses += 1
+                return None, False
+            self._entries.move_to_end((bucket, key))
+            if self._clock() - entry.fetched_at < self.ttl_seconds:
+                self.hits += 1
+                return entry, True
+            return entry, False
+
+    def fresh(self, bucket: str, key: str) -> bool:
+        """Whether lookup() would serve the key without S3; does not count as a hit or miss."""
+        with self._lock:
+            entry = self._entries.get((bucket, key))
+            return entry is not None and self._clock() - entry.fetched_at < self.ttl_seconds
+
+    def revalidated(self, entry: CacheEntry) -> None:
+        """Record that S3 confirmed a stale entry's ETag is still current."""
+        with self._lock:
+            self.hits += 1
+            self.revalidations += 1
+            entry.fetched_at = self._clock()
+
+    def put(self, bucket: str, key: str, etag: Optional[str], plaintext: bytes) -> None:
+        """Store a freshly decrypted blob, evicting least recently used entries to fit."""
+        if not self.enabled or not etag:
+            return
+        size = sys.getsizeof(plaintext) + len(bucket) + len(key) + len(etag)
+        with self._lock:
+            if (bucket, key) in self._entries:
+                # A stale entry whose ETag no longer matches
+                self.misses += 1
+                self._remove((bucket, key))
+            if size > self.max_bytes:
+                return
+            while self._bytes + size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self.evictions += 1
+            self._entries[(bucket, key)] = CacheEntry(etag, plaintext, size, self._clock())
+            self._bytes += size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Counters and occupancy, for sizing max_bytes against the Lambda memory size."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidations': self.revalidations,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'maxBytes': self.max_bytes,
+            }
+
+    def _remove(self, cache_key: Tuple[str, str]) -> None:
+        entry = self._entries.pop(cache_key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+
+class EtagIndex:
+    """
+    Thread-safe LRU map of blob key to (ETag, is container).
+
+    Keys written by the SDK handler are never overwritten, so an indexed
+    ETag stays valid until the blob is deleted. This lets conditional
+    requests for known blobs be answered without any S3 call.
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, Tuple[str, bool]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[str, bool]]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, etag: Optional[str], is_container: bool) -> None:
+        if not etag or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (etag, is_container)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,485 @@
+"""
+Segment objects: many small blobs packed into one S3 object.
+
+Reading back a long session costs one GetObject per blob, each paying
+full request latency and cost. Compaction packs small blobs into a
+segment object with a footer index:
+
+    blobs        stored bytes, back to back
+    index        JSON {"version": 1, "blobs": {blobKey: [offset, length, contentType, etag], ...}}
+    trailer      index length (8 bytes, big-endian) and b'SSEG'
+
+Each original object is then replaced by an empty pointer object whose
+metadata holds the segment key, offset, length, the blob's original ETag
+and its upload time, so blob keys, ETags and expiry stay what they were.
+Pointers are written with If-Match on the original's ETag, so a blob
+deleted during compaction is not brought back.
+
+Next to each segment, a ledger (segments/<...>.live, an entry document
+like a manifest) lists the blobs still pointing into it. Deleting or
+expiring a compacted blob releases it from the ledger, and the segment
+is deleted with its ledger once no live blob is left.
+
+Readers resolve a key to a Location from its pointer, or with no request
+at all from a SegmentIndex of footers already read in this container,
+and fetch the bytes with a ranged GET of the segment. The first pointer
+read into a segment loads its footer, so the segment's other blobs need
+no pointer read. Blobs of one segment requested together are fetched
+with one ranged GET per run of neighbouring blobs, so a session
+compacted into a few segments is read in a few requests.
+
+Until then the bytes of a released blob stay in its segment, though no
+pointer or index leads to them any more; compaction packs blobs by
+upload time, so a segment's blobs usually expire together. Containers
+that cached the segment's index may still serve a deleted blob until the
+index entry's TTL runs out.
+"""
+
+import json
+import struct
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import manifest
+import metrics
+from aws_clients import epoch_seconds, error_code
+from deadline import DeadlineExceeded
+
+SEGMENT_PREFIX = 'segments/'
+SEGMENT_MAGIC = b'SSEG'
+SEGMENT_VERSION = 1
+CONTENT_TYPE = 'application/vnd.solace.segment'
+
+# Bytes read from the end of a segment to find the index; larger indexes need a second read
+FOOTER_PROBE_BYTES = 64 * 1024
+
+# Pointer metadata (boto3 returns user metadata keys lower-cased, without x-amz-meta-)
+META_SEGMENT = 'solace-segment'
+META_OFFSET = 'solace-segment-offset'
+META_LENGTH = 'solace-segment-length'
+META_ETAG = 'solace-etag'
+META_UPLOADED = 'solace-uploaded-at'
+
+LEDGER_SUFFIX = '.live'
+
+_TRAILER = struct.Struct('>Q4s')
+
+
+class SegmentFormatError(ValueError):
+    """Raised when a segment footer is not valid."""
+
+
+class IndexTruncated(SegmentFormatError):
+    """The bytes read end before the index starts; needed is the footer's full size."""
+
+    def __init__(self, needed: int):
+        super().__init__(f'Segment footer needs {needed} bytes')
+        self.needed = needed
+
+
+class InvalidRange(Exception):
+    """Raised when a byte range starts past the end of a compacted blob."""
+
+
+class Location(NamedTuple):
+    """Where a compacted blob's bytes live, and the ETag and content type it was stored with."""
+
+    segment: str
+    offset: int
+    length: int
+    content_type: str
+    etag: str
+
+    def resolve_range(self, byte_range: str) -> Tuple[int, int]:
+        """(first, last) within the blob for a bytes=first-last, first- or -suffix range."""
+        first, _, last = byte_range[len('bytes='):].partition('-')
+        if not first:
+            first, last = max(0, self.length - int(last)), self.length - 1
+        else:
+            first, last = int(first), min(int(last) if last else self.length - 1, self.length - 1)
+        if first >= self.length:
+            raise InvalidRange(byte_range)
+        return first, last
+
+
+def pack(blobs: List[Tuple[str, bytes, str, str]]) -> Tuple[bytes, Dict[str, List[Any]]]:
+    """Build a segment from (blobKey, data, contentType, etag) items; returns (segment, index)."""
+    parts: List[bytes] = []
+    index: Dict[str, List[Any]] = {}
+    offset = 0
+    for blob_key, data, content_type, etag in blobs:
+        parts.append(data)
+        index[blob_key] = [offset, len(data), content_type, etag]
+        offset += len(data)
+    footer = json.dumps({'version': SEGMENT_VERSION, 'blobs': index}, separators=(',', ':')).encode('utf-8')
+    parts.append(footer)
+    parts.append(_TRAILER.pack(len(footer), SEGMENT_MAGIC))
+    return b''.join(parts), index
+
+
+def parse_footer(tail: bytes, segment_key: str) -> Dict[str, Location]:
+    """
+    Locations of a segment's blobs from the last bytes of the segment.
+
+    Raises IndexTruncated when tail does not reach back to the start of
+    the index, and SegmentFormatError when it is not a segment footer.
+    """
+    if len(tail) < _TRAILER.size:
+        raise SegmentFormatError('Segment is too short')
+    index_length, magic = _TRAILER.unpack(tail[-_TRAILER.size:])
+    if magic != SEGMENT_MAGIC:
+        raise SegmentFormatError('Not a segment')
+    needed = index_length + _TRAILER.size
+    if needed > len(tail):
+        raise IndexTruncated(needed)
+    try:
+        document = json.loads(tail[-needed:-_TRAILER.size])
+        return {blob_key: Location(segment_key, offset, length, content_type, etag)
+                for blob_key, (offset, length, content_type, etag) in document['blobs'].items()}
+    except (ValueError, KeyError, TypeError) as e:
+        raise SegmentFormatError(f'Invalid segment index: {e}')
+
+
+def read_footer(s3_client: Any, bucket: str, segment_key: str) -> Dict[str, Location]:
+    """Read a segment's index with a suffix-ranged GET (two for very large indexes)."""
+    probe = FOOTER_PROBE_BYTES
+    while True:
+        tail = s3_client.get_object(Bucket=bucket, Key=segment_key, Range=f'bytes=-{probe}')['Body'].read()
+        try:
+            return parse_footer(tail, segment_key)
+        except IndexTruncated as e:
+            if len(tail) < probe:
+                raise SegmentFormatError('Segment index is longer than the segment')
+            probe = e.needed
+
+
+def pointer_metadata(location: Location, uploaded_at: float) -> Dict[str, str]:
+    return {
+        META_SEGMENT: location.segment,
+        META_OFFSET: str(location.offset),
+        META_LENGTH: str(location.length),
+        META_ETAG: location.etag,
+        META_UPLOADED: str(int(uploaded_at)),
+    }
+
+
+def pointer_location(response: Dict[str, Any]) -> Optional[Location]:
+    """The Location a GetObject or HeadObject response of a pointer refers to; None for any other object."""
+    metadata = response.get('Metadata') or {}
+    if META_SEGMENT not in metadata:
+        return None
+    return Location(metadata[META_SEGMENT], int(metadata[META_OFFSET]), int(metadata[META_LENGTH]),
+                    response.get('ContentType') or 'binary/octet-stream', metadata[META_ETAG])
+
+
+def object_etag(response: Dict[str, Any]) -> Optional[str]:
+    """The blob's ETag from a GetObject or HeadObject response, looking through pointers."""
+    location = pointer_location(response)
+    return location.etag if location else response.get('ETag')
+
+
+def uploaded_at(response: Dict[str, Any]) -> float:
+    """When the blob was uploaded (epoch seconds): the time a pointer recorded, else LastModified."""
+    recorded = (response.get('Metadata') or {}).get(META_UPLOADED)
+    return float(recorded) if recorded else epoch_seconds(response['LastModified'])
+
+
+def new_segment_key(shard_chars: int = 2) -> str:
+    return SEGMENT_PREFIX + manifest.new_blob_key(shard_chars)
+
+
+def ledger_key(segment_key: str) -> str:
+    return segment_key + LEDGER_SUFFIX
+
+
+def live_keys(s3_client: Any, bucket: str, segment_key: str) -> Optional[Set[str]]:
+    """Blob keys still pointing into a segment, or None for a segment without a ledger."""
+    entries, etag = manifest.load_key(s3_client, bucket, ledger_key(segment_key))
+    return set(entries) if etag else None
+
+
+def release(s3_client: Any, bucket: str, released: Dict[str, Iterable[str]]) -> List[str]:
+    """
+    Drop deleted or expired blobs ({segmentKey: blobKeys}) from their segments' ledgers.
+
+    A segment whose last live blob is released is deleted with its
+    ledger; returns the keys of the segments deleted.
+    """
+    deleted: List[str] = []
+    for segment_key, blob_keys in released.items():
+        gone = set(blob_keys)
+        emptied = [False]
+
+        def change(entries: List[Any]) -> Optional[List[Any]]:
+            kept = [blob_key for blob_key in entries if blob_key not in gone]
+            # Only the writer that empties the ledger deletes the segment; a ledger
+            # already empty, or missing, is left without a write
+            emptied[0] = len(kept) < len(entries) and not kept
+            return kept if len(kept) < len(entries) else None
+
+        manifest.update(s3_client, bucket, ledger_key(segment_key), change)
+        if emptied[0]:
+            response = s3_client.delete_objects(Bucket=bucket, Delete={
+                'Objects': [{'Key': segment_key}, {'Key': ledger_key(segment_key)}], 'Quiet': True
+            })
+            if response.get('Errors'):
+                metrics.log('segment_delete_error', error=response['Errors'][0].get('Code'))
+                continue
+            deleted.append(segment_key)
+    metrics.add('SegmentsDeleted', len(deleted))
+    return deleted
+
+
+class SegmentIndex:
+    """
+    Thread-safe LRU of segment indexes read in this container, by blob key.
+
+    Segments are immutable, but the blobs in them can be deleted, so an
+    index is only trusted for ttl_seconds after it was read.
+    """
+
+    def __init__(self, max_segments: int = 256, ttl_seconds: float = 300,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_segments = max_segments
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._segments: 'OrderedDict[str, Tuple[float, Dict[str, Location]]]' = OrderedDict()
+        self._blobs: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    def locate(self, blob_key: str) -> Optional[Location]:
+        with self._lock:
+            segment_key = self._blobs.get(blob_key)
+            if segment_key is None:
+                return None
+            loaded_at, locations = self._segments[segment_key]
+            if self._clock() - loaded_at >= self.ttl_seconds:
+                self._drop(segment_key)
+                return None
+            self._segments.move_to_end(segment_key)
+            return locations.get(blob_key)
+
+    def add(self, segment_key: str, locations: Dict[str, Location]) -> None:
+        if self.max_segments <= 0:
+            return
+        with self._lock:
+            self._drop(segment_key)
+            self._segments[segment_key] = (self._clock(), dict(locations))
+            for blob_key in locations:
+                self._blobs[blob_key] = segment_key
+            while len(self._segments) > self.max_segments:
+                self._drop(next(iter(self._segments)))
+
+    def load(self, s3_client: Any, bucket: str, segment_key: str) -> Dict[str, Location]:
+        """Read a segment's footer into the index, leaving out blobs its ledger no longer lists."""
+        locations = read_footer(s3_client, bucket, segment_key)
+        live = live_keys(s3_client, bucket, segment_key)
+        if live is not None:
+            locations = {blob_key: location for blob_key, location in locations.items() if blob_key in live}
+        with self._lock:
+            self.loads += 1
+        metrics.add('SegmentIndexLoads', 1)
+        self.add(segment_key, locations)
+        return locations
+
+    def follow(self, s3_client: Any, bucket: str, location: Location) -> None:
+        """
+        Load the index of a segment a pointer led to, so the blob's neighbours resolve without pointer reads.
+
+        The pointer already located its blob, so a failed load is only logged.
+        """
+        if self.max_segments <= 0:
+            return
+        try:
+            self.load(s3_client, bucket, location.segment)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            metrics.log('segment_index_error', error=type(e).__name__)
+
+    def discard(self, blob_keys: List[str]) -> None:
+        """Forget deleted blobs."""
+        with self._lock:
+            for blob_key in blob_keys:
+                segment_key = self._blobs.pop(blob_key, None)
+                if segment_key in self._segments:
+                    self._segments[segment_key][1].pop(blob_key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._segments.clear()
+            self._blobs.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'segments': len(self._segments), 'blobs': len(self._blobs), 'loads': self.loads}
+
+    def _drop(self, segment_key: str) -> None:
+        entry = self._segments.pop(segment_key, None)
+        if entry is not None:
+            for blob_key in entry[1]:
+                if self._blobs.get(blob_key) == segment_key:
+                    del self._blobs[blob_key]
+
+
+def get(s3_client: Any, bucket: str, location: Location, byte_range: Optional[str] = None,
+        if_range: Optional[str] = None) -> Tuple[Dict[str, Any], bytes]:
+    """
+    (response, bytes) of a compacted blob, shaped like GetObject's: ETag,
+    ContentType and, for a byte range, ContentRange relative to the blob.
+
+    A stale if_range gets the whole blob, as with If-Range; a range
+    starting past the end raises InvalidRange.
+    """
+    first, last = 0, location.length - 1
+    if byte_range and (not if_range or if_range == location.etag):
+        first, last = location.resolve_range(byte_range)
+    else:
+        byte_range = None
+    start = location.offset + first
+    data = s3_client.get_object(Bucket=bucket, Key=location.segment,
+                                Range=f'bytes={start}-{location.offset + last}')['Body'].read()
+    metrics.add('SegmentReads', 1)
+    response = {'ETag': location.etag, 'ContentType': location.content_type, 'ContentLength': len(data)}
+    if byte_range:
+        response['ContentRange'] = f'bytes {first}-{last}/{location.length}'
+    return response, data
+
+
+def read_many(s3_client: Any, bucket: str, locations: Dict[str, Location], max_gap: int = 64 * 1024,
+              max_read: int = 8 * 1024 * 1024, max_workers: int = 4) -> Dict[str, bytes]:
+    """
+    Bytes of many compacted blobs, with one ranged GET per run of neighbouring blobs.
+
+    Blobs of one segment less than max_gap bytes apart are read together,
+    up to max_read bytes per GET; the runs are read in parallel.
+    """
+    by_segment: Dict[str, List[Tuple[str, Location]]] = {}
+    for blob_key, location in locations.items():
+        by_segment.setdefault(location.segment, []).append((blob_key, location))
+
+    runs: List[List[Tuple[str, Location]]] = []
+    for members in by_segment.values():
+        members.sort(key=lambda member: member[1].offset)
+        run = [members[0]]
+        for member in members[1:]:
+            start, end = run[0][1].offset, run[-1][1].offset + run[-1][1].length
+            location = member[1]
+            if location.offset - end <= max_gap and location.offset + location.length - start <= max_read:
+                run.append(member)
+            else:
+                runs.append(run)
+                run = [member]
+        runs.append(run)
+
+    def read_run(run: List[Tuple[str, Location]]) -> Dict[str, bytes]:
+        start = run[0][1].offset
+        end = max(location.offset + location.length for _, location in run) - 1
+        data = s3_client.get_object(Bucket=bucket, Key=run[0][1].segment,
+                                    Range=f'bytes={start}-{end}')['Body'].read()
+        return {blob_key: data[location.offset - start:location.offset - start + location.length]
+                for blob_key, location in run}
+
+    blobs: Dict[str, bytes] = {}
+    if runs:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(runs)))) as executor:
+            for result in [metrics.submit(executor, read_run, run) for run in runs]:
+                blobs.update(result.result())
+    metrics.add('SegmentReads', len(runs))
+    metrics.add('SegmentBlobs', len(blobs))
+    return blobs
+
+
+def compact(s3_client: Any, bucket: str, blob_keys: List[str], max_segment_bytes: int = 8 * 1024 * 1024,
+            max_workers: int = 8, shard_chars: int = 2) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Location]]]:
+    """
+    Pack blobs into segments, in the given order, and replace them with pointers.
+
+    Blobs that are missing, empty or already compacted are skipped.
+    Returns (report, {segmentKey: locations of the blobs now pointing into it}).
+    """
+
+    uploaded: Dict[str, float] = {}
+
+    def fetch(blob_key: str) -> Optional[Tuple[str, bytes, str, str]]:
+        try:
+            response = s3_client.get_object(Bucket=bucket, Key=blob_key)
+        except Exception as e:
+            if error_code(e) in ('NoSuchKey', '404'):
+                return None
+            raise
+        data = response['Body'].read()
+        if pointer_location(response) is not None or not data:
+            return None
+        uploaded[blob_key] = uploaded_at(response)
+        return blob_key, data, response.get('ContentType') or 'binary/octet-stream', response['ETag']
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(blob_keys) or 1))) as executor:
+        with metrics.phase('CompactRead'):
+            fetched = [future.result() for future in [metrics.submit(executor, fetch, key) for key in blob_keys]]
+        blobs = [blob for blob in fetched if blob is not None]
+
+        batches: List[List[Tuple[str, bytes, str, str]]] = []
+        size = 0
+        for blob in blobs:
+            if not batches or size + len(blob[1]) > max_segment_bytes:
+                batches.append([])
+                size = 0
+            batches[-1].append(blob)
+            size += len(blob[1])
+
+        written: Dict[str, Dict[str, Location]] = {}
+        segment_bytes = 0
+        for batch in batches:
+            if len(batch) < 2:
+                # A segment of one blob saves nothing
+                continue
+            segment_key = new_segment_key(shard_chars)
+            data, index = pack(batch)
+            with metrics.phase('CompactWrite'):
+                s3_client.put_object(Bucket=bucket, Key=segment_key, Body=data, ContentType=CONTENT_TYPE,
+                                     IfNoneMatch='*')
+            segment_bytes += len(data)
+            locations = {blob_key: Location(segment_key, *entry) for blob_key, entry in index.items()}
+            # The ledger lists every blob before any pointer exists, so a pointer
+            # deleted straight away is still released from it
+            with metrics.phase('CompactWrite'):
+                manifest.update(s3_client, bucket, ledger_key(segment_key), lambda entries: list(locations))
+
+            def point(blob_key: str) -> bool:
+                location = locations[blob_key]
+                try:
+                    s3_client.put_object(Bucket=bucket, Key=blob_key, Body=b'', ContentType=location.content_type,
+                                         Metadata=pointer_metadata(location, uploaded[blob_key]),
+                                         IfMatch=location.etag)
+                    return True
+                except Exception as e:
+                    # Deleted or replaced since it was read: leave it alone
+                    if error_code(e) not in ('PreconditionFailed', '412', 'NoSuchKey', '404'):
+                        raise
+                    return False
+
+            with metrics.phase('CompactPoint'):
+                pointed = [future.result() for future in [metrics.submit(executor, point, key) for key in locations]]
+            written[segment_key] = {key: locations[key] for key, ok in zip(locations, pointed) if ok}
+            missed = [key for key, ok in zip(locations, pointed) if not ok]
+            if missed:
+                release(s3_client, bucket, {segment_key: missed})
+            if not written[segment_key]:
+                # Every blob changed under compaction; release() deleted the segment
+                del written[segment_key]
+                segment_bytes -= len(data)
+
+    compacted = sum(len(locations) for locations in written.values())
+    metrics.add('CompactedBlobs', compacted)
+    report = {
+        'compacted': compacted,
+        'skipped': len(blob_keys) - compacted,
+        'segments': [{'segmentKey': key, 'blobs': len(locations)} for key, locations in written.items()],
+        'segmentBytes': segment_bytes,
+    }
+    return report, written
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Standalone asyncio HTTP server hosting both Lambda handlers.
+
+Runs handler.lambda_handler and solacesdk_handler.lambda_handler in one
+long-lived process, for container deployments and as a local load-test
+target. Requests are translated into the API Gateway (REST, v1) event
+shape the handlers already understand:
+
+    POST /decrypt               -> handler.lambda_handler
+    POST /upload, /upload-url   -> solacesdk_handler.lambda_handler
+    POST /upload/batch          -> solacesdk_handler.lambda_handler
+    POST /blobs/delete          -> solacesdk_handler.lambda_handler
+    POST /blobs/compact         -> solacesdk_handler.lambda_handler
+    GET  /blob/{key}            -> solacesdk_handler.lambda_handler
+    GET  /blob-url/{key}        -> solacesdk_handler.lambda_handler
+    GET  /blobs                 -> solacesdk_handler.lambda_handler
+    GET  /_stats                -> server counters
+
+The handlers are blocking, so they run on a bounded thread pool. At most
+max_concurrency requests execute at once, at most max_queue wait for a
+slot, and anything beyond that is shed with a 503. Concurrent identical
+reads (same route, path, body and Accept, Accept-Encoding, Range,
+If-Range and If-None-Match headers) are collapsed into one handler call
+whose response is shared. Each request's deadline (--request-timeout-ms)
+starts when it arrives, so a request that waited too long in the queue is
+shed by the handler with a 503 instead of running.
+
+    python3 src/server.py --port 8080 --max-concurrency 16 --max-queue 64
+"""
+
+import argparse
+import asyncio
+import base64
+import contextvars
+import functools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+import handler
+import solacesdk_handler
+
+MAX_HEADER_BYTES = 64 * 1024
+
+
+class ServerContext:
+    """Minimal Lambda context for requests served outside Lambda."""
+
+    function_name = 'solace-server'
+
+    def __init__(self, timeout_ms: int):
+        self._deadline = time.monotonic() + timeout_ms / 1000
+
+    def get_remaining_time_in_millis(self) -> int:
+        return max(0, int((self._deadline - time.monotonic()) * 1000))
+
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one in-flight task."""
+
+    def __init__(self):
+        self._inflight: Dict[Any, asyncio.Task] = {}
+        self.collapsed = 0
+
+    async def do(self, key: Any, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.collapsed += 1
+        # Shield so one caller disconnecting does not cancel the shared call
+        return await asyncio.shield(task)
+
+
+class HandlerServer:
+    """Routes HTTP requests to the Lambda handlers with bounded concurrency."""
+
+    def __init__(self, max_concurrency: int = 16, max_queue: int = 64,
+                 max_body_bytes: int = 10 * 1024 * 1024, request_timeout_ms: int = 15000):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_body_bytes = max_body_bytes
+        self.request_timeout_ms = request_timeout_ms
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='handler')
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._reads = SingleFlight()
+        self.in_flight = 0
+        self.queued = 0
+        self.served = 0
+        self.rejected = 0
+
+    def route(self, method: str, path: str) -> Optional[Callable]:
+        """Return the Lambda handler serving a request, or None."""
+        if path == '/decrypt' and method in ('POST', 'OPTIONS'):
+            return handler.lambda_handler
+        if (method in ('POST', 'OPTIONS') and
+                path in ('/upload', '/upload/batch', '/upload-url', '/blobs/delete', '/blobs/compact')) or \
+                ((path == '/blobs' or path.startswith(('/blob/', '/blob-url/'))) and method in ('GET', 'OPTIONS')):
+            return solacesdk_handler.lambda_handler
+        return None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'inFlight': self.in_flight,
+            'queued': self.queued,
+            'served': self.served,
+            'rejected': self.rejected,
+            'collapsed': self._reads.collapsed,
+            'maxConcurrency': self.max_concurrency,
+            'maxQueue': self.max_queue,
+        }
+
+    async def handle_event(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        """Serve one translated event, collapsing identical concurrent reads."""
+        method, path = event['httpMethod'], event['path']
+        if method == 'GET' and path == '/_stats':
+            return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'},
+                    'body': json.dumps(self.stats())}
+
+        target = self.route(method, path)
+        if target is None:
+            return {'statusCode': 404, 'headers': {}, 'body': json.dumps({'error': 'Not found'})}
+
+        # Decrypts and blob downloads are reads; uploads are never collapsed
+        if path == '/decrypt' or (method == 'GET' and path.startswith('/blob/')):
+            headers = {name.lower(): value for name, value in event['headers'].items()}
+            key = (method, path, event['body'], headers.get('accept'), headers.get('accept-encoding'),
+                   headers.get('range'), headers.get('if-range'), headers.get('if-none-match'))
+            return await self._reads.do(key, lambda: self._run(target, event))
+        return await self._run(target, event)
+
+    async def _run(self, target: Callable, event: Dict[str, Any]) -> Dict[str, Any]:
+        """Run a handler on the executor once a concurrency slot is free."""
+        if self._slots.locked() and self.queued >= self.max_queue:
+            self.rejected += 1
+            return {'statusCode': 503, 'headers': {'Retry-After': '1'},
+                    'body': json.dumps({'error': 'Server is overloaded'})}
+
+        # The deadline starts on arrival, so time spent queued counts against it
+        context = ServerContext(self.request_timeout_ms)
+        self.queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+        self.in_flight += 1
+        try:
+            # Like metrics.submit: each call runs in its own copy of the caller's context
+            call = functools.partial(contextvars.copy_context().run, target, event, context)
+            return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+        finally:
+            self.in_flight -= 1
+            self.served += 1
+            self._slots.release()
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Serve HTTP/1.1 requests on one connection until it closes."""
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                event, keep_alive = request
+                if 'error' in event:
+                    response = event['error']
+                    keep_alive = False
+                else:
+                    response = await self.handle_event(event)
+                await self._write_response(writer, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[Dict[str, Any], bool]]:
+        """Parse one request into a Lambda proxy event; None at end of stream."""
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.IncompleteReadError:
+            return None
+        except asyncio.LimitOverrunError:
+            return {'error': _error_response(431, 'Request headers too large')}, False
+
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ', 2)
+        except ValueError:
+            return {'error': _error_response(400, 'Malformed request line')}, False
+
+        headers: Dict[str, str] = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip()] = value.strip()
+        lower = {name.lower(): value for name, value in headers.items()}
+
+        if 'chunked' in lower.get('transfer-encoding', '').lower():
+            return {'error': _error_response(411, 'Chunked request bodies are not supported')}, False
+        length = int(lower.get('content-length', '0') or 0)
+        if length > self.max_body_bytes:
+            return {'error': _error_response(413, 'Request body too large')}, False
+        body = (await reader.readexactly(length)).decode('utf-8', 'replace') if length else None
+
+        connection = lower.get('connection', '').lower()
+        keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+
+        url = urlsplit(target)
+        # API Gateway passes a missing body as null
+        event = {
+            'httpMethod': method.upper(),
+            'path': url.path,
+            'headers': headers,
+            'queryStringParameters': dict(parse_qsl(url.query)) or None,
+            'body': body,
+            'isBase64Encoded': False,
+        }
+        return event, keep_alive
+
+    async def _write_response(self, writer: asyncio.StreamWriter, response: Dict[str, Any],
+                              keep_alive: bool) -> None:
+        body = response.get('body') or ''
+        payload = base64.b64decode(body) if response.get('isBase64Encoded') else body.encode('utf-8')
+        status = response.get('statusCode', 200)
+        try:
+            reason = HTTPStatus(status).phrase
+        except ValueError:
+            reason = ''
+
+        headers = dict(response.get('headers') or {})
+        headers.pop('Content-Length', None)
+        headers.setdefault('Content-Type', 'application/json')
+        headers['Content-Length'] = str(len(payload))
+        headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+        head = f'HTTP/1.1 {status} {reason}\r\n' + ''.join(f'{k}: {v}\r\n' for k, v in headers.items())
+        writer.write(head.encode('latin-1') + b'\r\n' + payload)
+        await writer.drain()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+def _error_response(status: int, message: str) -> Dict[str, Any]:
+    return {'statusCode': status, 'headers': {}, 'body': json.dumps({'error': message})}
+
+
+async def serve(host: str, port: int, **options: Any) -> None:
+    app = HandlerServer(**options)
+    server = await asyncio.start_server(app.handle_connection, host, port, limit=MAX_HEADER_BYTES)
+    print(json.dumps({'event': 'server_started', 'host': host, 'port': port, **app.stats()}))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        app.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Serve the Solace Lambda handlers over HTTP.')
+    parser.add_argument('--host', default=os.environ.get('SERVER_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('SERVER_PORT', '8080')))
+    parser.add_argument('--max-concurrency', type=int,
+                        default=int(os.environ.get('SERVER_MAX_CONCURRENCY', '16')),
+                        help='handler calls executing at once (executor size)')
+    parser.add_argument('--max-queue', type=int, default=int(os.environ.get('SERVER_MAX_QUEUE', '64')),
+                        help='requests allowed to wait for a slot before shedding with 503')
+    parser.add_argument('--max-body-bytes', type=int,
+                        default=int(os.environ.get('SERVER_MAX_BODY_BYTES', str(10 * 1024 * 1024))))
+    parser.add_argument('--request-timeout-ms', type=int,
+                        default=int(os.environ.get('SERVER_REQUEST_TIMEOUT_MS', '15000')),
+                        help='remaining time reported to handlers through the context')
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, max_concurrency=args.max_concurrency,
+                          max_queue=args.max_queue, max_body_bytes=args.max_body_bytes,
+                          request_timeout_ms=args.request_timeout_ms))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
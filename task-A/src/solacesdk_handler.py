@@ -1,24 +1,340 @@
+import time
+_import_started = time.perf_counter()
+
 import json
 import os
 import base64
-import boto3
-from urllib.parse import unquote
+import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, unquote
+
+import blob_format
+import bulk_delete
+import deadline
+import hedging
+import manifest
+import metrics
+import profiling
+import segments
+import warmup
+from aws_clients import LazyClient, error_code
+from coldstart import ColdStart
+from http_headers import get_header
+from result_cache import EtagIndex
 
-s3 = boto3.client('s3')
+# S3 calls are bounded by the invocation's deadline
+s3 = deadline.BoundedClient(LazyClient('s3'))
+# Resumes an unfinished expiry sweep in a fresh invocation
+lambda_client = deadline.BoundedClient(LazyClient('lambda'))
+cold_start = ColdStart('solacesdk_handler', _import_started)
 BUCKET = os.environ.get('SOLACE_BLOB_BUCKET', 'solace-blob-bucket')
 
-# Helper to generate a unique blob key
-import uuid
+# Presigned URL settings: lifetime, upload size cap and accepted content types
+PRESIGNED_URL_EXPIRES_SECONDS = int(os.environ.get('PRESIGNED_URL_EXPIRES_SECONDS', '300'))
+PRESIGNED_MAX_UPLOAD_BYTES = int(os.environ.get('PRESIGNED_MAX_UPLOAD_BYTES', str(10 * 1024 * 1024)))
+PRESIGNED_CONTENT_TYPES = os.environ.get(
+    'PRESIGNED_CONTENT_TYPES', f'{blob_format.CONTENT_TYPE},application/json'
+).split(',')
+
+# Hex digits of hash prefix on new blob keys (0 keeps flat UUID keys)
+BLOB_KEY_SHARD_CHARS = int(os.environ.get('BLOB_KEY_SHARD_CHARS', '2'))
+# Opt-in: key uploads by the SHA-256 of their bytes so retries reuse one object
+CONTENT_ADDRESSED_UPLOADS = os.environ.get('CONTENT_ADDRESSED_UPLOADS', 'false').lower() in ('1', 'true', 'yes')
+# Upload validation: required IV length and ciphertext size cap (decoded bytes)
+UPLOAD_IV_BYTES = int(os.environ.get('UPLOAD_IV_BYTES', '12'))
+UPLOAD_MAX_CIPHERTEXT_BYTES = int(os.environ.get('UPLOAD_MAX_CIPHERTEXT_BYTES', str(4 * 1024 * 1024)))
+# Batch uploads: items and body size per request, and concurrent PUTs
+UPLOAD_BATCH_MAX_ITEMS = int(os.environ.get('UPLOAD_BATCH_MAX_ITEMS', '100'))
+UPLOAD_BATCH_MAX_BYTES = int(os.environ.get('UPLOAD_BATCH_MAX_BYTES', str(6 * 1024 * 1024)))
+UPLOAD_BATCH_MAX_WORKERS = int(os.environ.get('UPLOAD_BATCH_MAX_WORKERS', '8'))
+# Development only: take the owner from X-Owner-Id when no authorizer identified the caller
+OWNER_HEADER_AUTH = os.environ.get('OWNER_HEADER_AUTH', 'false').lower() in ('1', 'true', 'yes')
+# Page size bounds for GET /blobs
+LIST_DEFAULT_LIMIT = int(os.environ.get('LIST_DEFAULT_LIMIT', '50'))
+LIST_MAX_LIMIT = int(os.environ.get('LIST_MAX_LIMIT', '1000'))
+
+# Bulk delete: keys per request (prefix deletes stop there) and parallel DeleteObjects calls
+DELETE_MAX_KEYS = int(os.environ.get('DELETE_MAX_KEYS', '10000'))
+DELETE_MAX_WORKERS = int(os.environ.get('DELETE_MAX_WORKERS', '4'))
+# Expiry sweep: blob lifetime (0 disables it), blobs deleted per run, and the time
+# a run keeps for its deletes and manifest updates once it stops listing
+BLOB_TTL_SECONDS = int(os.environ.get('BLOB_TTL_SECONDS', '0'))
+EXPIRE_MAX_KEYS = int(os.environ.get('EXPIRE_MAX_KEYS', '10000'))
+EXPIRE_RESERVE_MS = float(os.environ.get('EXPIRE_RESERVE_MS', '10000'))
+
+# GET /blob responses may carry Authorization, so only the caller's own cache keeps them,
+# and not past the blob's expiry; a day bounds how long a deleted blob is still served
+BLOB_CACHE_MAX_AGE = min(86400, BLOB_TTL_SECONDS) if BLOB_TTL_SECONDS > 0 else 86400
+BLOB_CACHE_CONTROL = os.environ.get('BLOB_CACHE_CONTROL', f'private, max-age={BLOB_CACHE_MAX_AGE}')
+# Blob key -> ETag index answering If-None-Match without S3 calls
+etag_index = EtagIndex(int(os.environ.get('ETAG_INDEX_MAX_ENTRIES', '10000')))
+# GET /blob reads, hedged against slow GETs when S3_HEDGE is on
+s3_reads = hedging.HedgedReader.from_env()
+
+# Compaction: blobs up to SEGMENT_MAX_BLOB_BYTES are packed into segments of up to SEGMENT_MAX_BYTES
+SEGMENT_MAX_BLOB_BYTES = int(os.environ.get('SEGMENT_MAX_BLOB_BYTES', str(64 * 1024)))
+SEGMENT_MAX_BYTES = int(os.environ.get('SEGMENT_MAX_BYTES', str(8 * 1024 * 1024)))
+COMPACT_MAX_BLOBS = int(os.environ.get('COMPACT_MAX_BLOBS', '1000'))
+COMPACT_MAX_WORKERS = int(os.environ.get('COMPACT_MAX_WORKERS', '8'))
+# Indexes of segments read by this container, so compacted blobs need no pointer lookup
+segment_index = segments.SegmentIndex(
+    max_segments=int(os.environ.get('SEGMENT_INDEX_MAX_SEGMENTS', '256')),
+    ttl_seconds=float(os.environ.get('SEGMENT_INDEX_TTL_SECONDS', '300')),
+)
+
+# Helper to generate a unique, hash-sharded blob key
 def generate_blob_key():
-    return str(uuid.uuid4())
+    return manifest.new_blob_key(BLOB_KEY_SHARD_CHARS)
+
+def put_blob(stored, owner=None):
+    """
+    Store a packed container; returns (blob_key, deduplicated).
+
+    In content-addressed mode an object that already exists under the
+    digest key is not written again: a retried or duplicate upload costs
+    one HEAD. The digest is scoped to the owner, so only their own
+    uploads deduplicate. The PUT is conditional, so two concurrent first uploads of
+    the same bytes also end up with a single write.
+    """
+    if not CONTENT_ADDRESSED_UPLOADS:
+        blob_key = generate_blob_key()
+    else:
+        blob_key = manifest.content_blob_key(stored, BLOB_KEY_SHARD_CHARS, owner)
+        try:
+            with metrics.phase('S3Head'):
+                s3.head_object(Bucket=BUCKET, Key=blob_key)
+            metrics.add('DedupHits', 1)
+            return blob_key, True
+        except Exception as e:
+            if error_code(e) not in ('404', 'NoSuchKey', 'NotFound'):
+                raise
+    condition = {'IfNoneMatch': '*'} if CONTENT_ADDRESSED_UPLOADS else {}
+    try:
+        with metrics.phase('S3Put'):
+            s3.put_object(
+                Bucket=BUCKET,
+                Key=blob_key,
+                Body=stored,
+                ContentType=blob_format.CONTENT_TYPE,
+                **condition
+            )
+    except Exception as e:
+        # A concurrent upload of the same bytes won the race
+        if not CONTENT_ADDRESSED_UPLOADS or error_code(e) not in ('PreconditionFailed', '412'):
+            raise
+        metrics.add('DedupHits', 1)
+        return blob_key, True
+    metrics.add('S3PutBytes', len(stored), 'Bytes')
+    return blob_key, False
+
+def put_batch(items, owner=None):
+    """
+    Store validated batch items concurrently; one result per item, in request order.
+
+    items holds packed containers, or the BlobFormatError rejecting an
+    item, which becomes that item's 400 result without touching S3.
+    """
+    def put_one(stored):
+        if isinstance(stored, blob_format.BlobFormatError):
+            status = 413 if isinstance(stored, blob_format.UploadTooLarge) else 400
+            return {'statusCode': status, 'error': str(stored)}
+        try:
+            blob_key, deduplicated = put_blob(stored, owner)
+        except deadline.DeadlineExceeded as e:
+            return {'statusCode': e.status_code, 'error': str(e)}
+        except Exception as e:
+            metrics.log('upload_error', phase='batch_item', error=type(e).__name__)
+            return {'statusCode': 500, 'error': error_code(e) or 'Internal server error'}
+        return {'statusCode': 200, 'blobKey': blob_key, 'deduplicated': deduplicated, 'size': len(stored)}
+
+    workers = max(1, min(UPLOAD_BATCH_MAX_WORKERS, len(items)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [metrics.submit(executor, put_one, stored) for stored in items]
+        return [future.result() for future in futures]
+
+def get_blob(blob_key, byte_range=None, if_range=None):
+    """
+    (obj, data) of a blob like GetObject's, following compacted blobs into their segment.
+
+    Raises as GetObject does, or segments.InvalidRange for a range past
+    the end of a compacted blob.
+    """
+    location = segment_index.locate(blob_key)
+    if location is None:
+        get_kwargs = {}
+        if byte_range:
+            get_kwargs['Range'] = byte_range
+            if if_range:
+                get_kwargs['IfMatch'] = if_range
+        try:
+            obj, data = s3_reads.get_object(s3, Bucket=BUCKET, Key=blob_key, **get_kwargs)
+        except Exception as e:
+            # A pointer is empty and has an ETag of its own, so ranges on it fail
+            if not byte_range or error_code(e) not in ('InvalidRange', 'PreconditionFailed', '412'):
+                raise
+            location = segments.pointer_location(s3.head_object(Bucket=BUCKET, Key=blob_key))
+            if location is None:
+                raise e
+        else:
+            location = segments.pointer_location(obj)
+            if location is None:
+                return obj, data
+        # Later keys of the same segment then need no pointer read
+        segment_index.follow(s3, BUCKET, location)
+    return segments.get(s3, BUCKET, location, byte_range, if_range)
+
+def record_upload(event, entries):
+    """Add [blobKey, size, uploadedAt] entries to the caller's manifest; whether they are listed."""
+    owner = get_owner(event)
+    if not owner:
+        return False
+    try:
+        with metrics.phase('ManifestUpdate'):
+            manifest.record_many(s3, BUCKET, owner, entries)
+    except Exception as e:
+        metrics.add('ManifestUpdateErrors', 1)
+        metrics.log('manifest_error', error=type(e).__name__)
+        return False
+    return True
+
+def internal_key(key):
+    """Whether key is a manifest, segment or ledger rather than a blob; never served or deleted."""
+    return key.startswith((manifest.MANIFEST_PREFIX, segments.SEGMENT_PREFIX))
+
+def get_owner(event):
+    """
+    Owner of the request: the authorizer's principal, or None for an anonymous caller.
+
+    The X-Owner-Id header is anyone's to send, so it is only trusted with
+    OWNER_HEADER_AUTH set, for local development without an authorizer.
+    """
+    authorizer = (event.get('requestContext') or {}).get('authorizer') or {}
+    claims = authorizer.get('claims') or (authorizer.get('jwt') or {}).get('claims') or {}
+    owner = claims.get('sub') or authorizer.get('principalId')
+    if not owner and OWNER_HEADER_AUTH:
+        owner = get_header(event, 'X-Owner-Id')
+    return owner
+
+def unauthenticated(headers):
+    # Owner-scoped routes act on the authenticated principal's blobs only
+    return {
+        'statusCode': 401,
+        'headers': headers,
+        'body': json.dumps({'error': 'Authentication required'})
+    }
+
+def representation_etag(etag, is_container, binary):
+    """ETag of the response body: a container rendered as legacy JSON is a different representation."""
+    if is_container and not binary:
+        return etag[:-1] + '-json"' if etag.endswith('"') else etag + '-json'
+    return etag
 
+# One byte range in any form S3 accepts: first-last, first- or -suffix
+RANGE_PATTERN = re.compile(r'^bytes=(\d+-\d*|-\d+)$')
+
+def requested_range(event):
+    """The request's single byte range, or None; multi-range requests are served in full, as RFC 9110 allows."""
+    value = (get_header(event, 'Range') or '').replace(' ', '')
+    match = RANGE_PATTERN.match(value)
+    if not match:
+        return None
+    first, _, last = match.group(1).partition('-')
+    if first and last and int(last) < int(first):
+        return None
+    return value
+
+def etag_matches(if_none_match, etag):
+    """Weak If-None-Match comparison, as RFC 9110 requires for GET."""
+    if if_none_match.strip() == '*':
+        return True
+    return etag.removeprefix('W/') in (tag.strip().removeprefix('W/') for tag in if_none_match.split(','))
+
+def handle_warmup(event):
+    """Open S3 connections and prefetch the ETags of hot blobs into the index."""
+    def prefetch(blob_keys):
+        loaded = 0
+        for blob_key in blob_keys:
+            try:
+                obj = s3.head_object(Bucket=BUCKET, Key=blob_key)
+            except Exception as e:
+                metrics.log('warmup_prefetch_error', error=type(e).__name__)
+                continue
+            etag_index.put(blob_key, segments.object_etag(obj), obj.get('ContentType') == blob_format.CONTENT_TYPE)
+            loaded += 1
+        return loaded
+
+    report = warmup.warm(
+        'solacesdk_handler',
+        {'s3': lambda: s3.head_object(Bucket=BUCKET, Key='warmup-probe')},
+        {'SOLACE_BLOB_BUCKET': BUCKET},
+        prefetch, warmup.prefetch_keys(event), cold_start.report is None
+    )
+    return {
+        'statusCode': 200,
+        'body': json.dumps(report)
+    }
+
+def is_expiry(event):
+    # Scheduled EventBridge rule with the constant input {"action": "expire"}, or a
+    # run resuming one that stopped early, with its cutoff and startAfter
+    return isinstance(event, dict) and 'httpMethod' not in event and event.get('action') == 'expire'
+
+def handle_expiry(event, context):
+    """
+    Delete blobs older than BLOB_TTL_SECONDS and drop them from the manifests.
+
+    A run that stops before the end of the bucket invokes the function
+    again, asynchronously, to resume after the last key it listed.
+    """
+    if BLOB_TTL_SECONDS <= 0:
+        report = {'expired': 0, 'skipped': 'BLOB_TTL_SECONDS is not set'}
+    else:
+        cutoff, start_after = event.get('cutoff'), event.get('startAfter')
+        report = bulk_delete.sweep(
+            s3, BUCKET, BLOB_TTL_SECONDS, EXPIRE_MAX_KEYS, DELETE_MAX_WORKERS,
+            cutoff=cutoff if isinstance(cutoff, (int, float)) else None,
+            start_after=start_after if isinstance(start_after, str) else None,
+            reserve_ms=EXPIRE_RESERVE_MS
+        )
+        if report['expired']:
+            # The sweep does not return keys, so forget every cached ETag and location
+            etag_index.clear()
+            segment_index.clear()
+        if report['startAfter'] is not None and context is not None:
+            # The next scheduled run starts over if this fails, so it is only logged
+            try:
+                lambda_client.invoke(FunctionName=context.invoked_function_arn, InvocationType='Event',
+                                     Payload=json.dumps({'action': 'expire', 'cutoff': report['cutoff'],
+                                                         'startAfter': report['startAfter']}))
+                report['resumed'] = True
+            except Exception as e:
+                report['resumed'] = False
+                metrics.log('expiry_error', phase='resume', error=type(e).__name__)
+    metrics.log('expiry_sweep', **report)
+    return {
+        'statusCode': 200,
+        'body': json.dumps(report)
+    }
+
+@cold_start.instrument
+@metrics.instrument('solacesdk_handler', cold_start)
+@profiling.instrument('solacesdk_handler')
+@deadline.instrument
 def lambda_handler(event, context):
+    if warmup.is_warmup(event):
+        metrics.set_property('Route', 'warmup')
+        return handle_warmup(event)
+    if is_expiry(event):
+        metrics.set_property('Route', 'expire')
+        return handle_expiry(event, context)
+
     method = event.get('httpMethod')
     path = event.get('path', '')
     headers = {
         'Access-Control-Allow-Origin': '*',
         'Access-Control-Allow-Methods': 'OPTIONS,POST,GET',
-        'Access-Control-Allow-Headers': 'Content-Type,Authorization',
+        'Access-Control-Allow-Headers': 'Content-Type,Authorization,X-Owner-Id,If-None-Match,Range,If-Range',
+        'Access-Control-Expose-Headers': 'ETag,Content-Range,Accept-Ranges',
     }
 
     # CORS preflight
@@ -30,47 +346,443 @@ def lambda_handler(event, context):
         }
 
     if method == 'POST' and path.endswith('/upload'):
+        metrics.set_property('Route', 'upload')
         try:
-            body = json.loads(event['body'])
-            iv = body['iv']
-            ciphertext = body['ciphertext']
-            blob_key = generate_blob_key()
-            print(f"Uploading blob with key: {blob_key}")
-            print(f"Data to store: iv={iv}, ciphertext={ciphertext}")
-            s3.put_object(
-                Bucket=BUCKET,
-                Key=blob_key,
-                Body=json.dumps({'iv': iv, 'ciphertext': ciphertext}),
-                ContentType='application/json'
-            )
-            print(f"Successfully stored blob: {blob_key}")
+            body = event.get('body') or ''
+            metrics.add('RequestBytes', len(body), 'Bytes')
+            # One validating pass from the request text to the stored container
+            with metrics.phase('Parse'):
+                try:
+                    stored = blob_format.parse_upload(body, UPLOAD_IV_BYTES, UPLOAD_MAX_CIPHERTEXT_BYTES)
+                except blob_format.BlobFormatError as e:
+                    metrics.log('upload_rejected', error=type(e).__name__)
+                    return {
+                        'statusCode': 413 if isinstance(e, blob_format.UploadTooLarge) else 400,
+                        'headers': headers,
+                        'body': json.dumps({'error': str(e)})
+                    }
+            blob_key, deduplicated = put_blob(stored, get_owner(event))
+            # The blob is already stored, so a failed manifest update does not
+            # fail the upload; the response says it is unlisted instead.
+            # Recording is idempotent, so a deduplicated retry is listed once
+            listed = record_upload(event, [[blob_key, len(stored), int(time.time())]])
             return {
                 'statusCode': 200,
                 'headers': headers,
-                'body': json.dumps({'blobKey': blob_key})
+                'body': json.dumps({'blobKey': blob_key, 'deduplicated': deduplicated, 'listed': listed})
             }
+        except deadline.DeadlineExceeded as e:
+            return e.response(headers)
         except Exception as e:
-            print(f"Upload error: {str(e)}")
+            metrics.log('upload_error', error=type(e).__name__)
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': str(e)})
+            }
+
+    if method == 'POST' and path.rstrip('/').endswith('/upload/batch'):
+        # Many {iv, ciphertext} items in one request, written concurrently
+        metrics.set_property('Route', 'upload_batch')
+        body = event.get('body') or ''
+        metrics.add('RequestBytes', len(body), 'Bytes')
+        try:
+            with metrics.phase('Parse'):
+                items = blob_format.parse_upload_batch(body, UPLOAD_BATCH_MAX_ITEMS, UPLOAD_BATCH_MAX_BYTES,
+                                                       UPLOAD_IV_BYTES, UPLOAD_MAX_CIPHERTEXT_BYTES)
+        except blob_format.BlobFormatError as e:
+            metrics.log('upload_rejected', error=type(e).__name__)
+            return {
+                'statusCode': 413 if isinstance(e, blob_format.UploadTooLarge) else 400,
+                'headers': headers,
+                'body': json.dumps({'error': str(e)})
+            }
+        metrics.add('BatchItems', len(items))
+        results = put_batch(items, get_owner(event))
+        stored = [result for result in results if result['statusCode'] == 200]
+        # One manifest write for the whole batch; as for single uploads,
+        # a failure is reported rather than failing blobs already stored
+        uploaded_at = int(time.time())
+        listed = bool(stored) and record_upload(
+            event, [[result['blobKey'], result['size'], uploaded_at] for result in stored])
+        for result in stored:
+            del result['size']
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': json.dumps({
+                'results': results,
+                'uploaded': len(stored),
+                'failed': len(results) - len(stored),
+                'listed': listed
+            })
+        }
+
+    if method == 'POST' and path.endswith('/upload-url'):
+        # Issue a key and a presigned PUT so the blob bytes go straight to S3.
+        # Content-Type and Content-Length are signed, so S3 rejects any upload
+        # that does not match what was authorized here.
+        metrics.set_property('Route', 'upload_url')
+        try:
+            body = json.loads(event.get('body') or '{}')
+            content_type = body.get('contentType', blob_format.CONTENT_TYPE)
+            content_length = body.get('contentLength')
+            if content_type not in PRESIGNED_CONTENT_TYPES:
+                raise ValueError(f'Unsupported contentType: {content_type}')
+            if (not isinstance(content_length, int) or isinstance(content_length, bool)
+                    or not 0 < content_length <= PRESIGNED_MAX_UPLOAD_BYTES):
+                raise ValueError(f'contentLength must be between 1 and {PRESIGNED_MAX_UPLOAD_BYTES} bytes')
+        except (ValueError, AttributeError) as e:
             return {
                 'statusCode': 400,
                 'headers': headers,
                 'body': json.dumps({'error': str(e)})
             }
+        blob_key = generate_blob_key()
+        upload_url = s3.generate_presigned_url(
+            'put_object',
+            Params={
+                'Bucket': BUCKET,
+                'Key': blob_key,
+                'ContentType': content_type,
+                'ContentLength': content_length
+            },
+            ExpiresIn=PRESIGNED_URL_EXPIRES_SECONDS
+        )
+        # The bytes never pass through here, so the key is listed when issued;
+        # the signed Content-Length is its exact size
+        listed = record_upload(event, [[blob_key, content_length, int(time.time())]])
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': json.dumps({
+                'blobKey': blob_key,
+                'uploadUrl': upload_url,
+                'method': 'PUT',
+                'headers': {'Content-Type': content_type, 'Content-Length': str(content_length)},
+                'expiresIn': PRESIGNED_URL_EXPIRES_SECONDS,
+                'listed': listed
+            })
+        }
+
+    if method == 'GET' and path.rstrip('/').endswith('/blobs'):
+        # Page through the owner's manifest, newest first
+        metrics.set_property('Route', 'list')
+        owner = get_owner(event)
+        params = event.get('queryStringParameters') or {}
+        if not owner:
+            return unauthenticated(headers)
+        try:
+            limit = int(params.get('limit', LIST_DEFAULT_LIMIT))
+            if not 0 < limit <= LIST_MAX_LIMIT:
+                raise ValueError(f'limit must be between 1 and {LIST_MAX_LIMIT}')
+            with metrics.phase('S3Get'):
+                entries, _ = manifest.load(s3, BUCKET, owner)
+            items, next_cursor = manifest.page(entries, limit, params.get('cursor'))
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': str(e)})
+            }
+        except deadline.DeadlineExceeded as e:
+            return e.response(headers)
+        except manifest.ManifestError as e:
+            metrics.log('list_error', error=type(e).__name__)
+            return {
+                'statusCode': 500,
+                'headers': headers,
+                'body': json.dumps({'error': str(e)})
+            }
+        metrics.add('ListedBlobs', len(items))
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': json.dumps({'blobs': items, 'nextCursor': next_cursor})
+        }
+
+    if method == 'POST' and path.rstrip('/').endswith('/blobs/delete'):
+        # Delete a list of the owner's keys, or every one of them under a prefix, in DeleteObjects batches
+        metrics.set_property('Route', 'delete')
+        owner = get_owner(event)
+        if not owner:
+            return unauthenticated(headers)
+        try:
+            body = json.loads(event.get('body') or '{}')
+            if not isinstance(body, dict):
+                raise ValueError('Request body must be a JSON object')
+            blob_keys, prefix = body.get('blobKeys'), body.get('prefix')
+            if (blob_keys is None) == (prefix is None):
+                raise ValueError('Provide either blobKeys or prefix')
+            if blob_keys is not None:
+                if not isinstance(blob_keys, list) or not blob_keys or \
+                        not all(isinstance(key, str) and key for key in blob_keys):
+                    raise ValueError('blobKeys must be a non-empty list of strings')
+                if len(blob_keys) > DELETE_MAX_KEYS:
+                    raise ValueError(f'At most {DELETE_MAX_KEYS} blobKeys per request')
+                if any(internal_key(key) for key in blob_keys):
+                    raise ValueError('Manifests and segments cannot be deleted')
+            elif not isinstance(prefix, str) or not prefix or \
+                    internal_key(prefix):
+                raise ValueError('prefix must be a non-empty blob key prefix')
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': str(e)})
+            }
+        # Only blobs in the owner's manifest may be deleted, whatever the selector
+        try:
+            with metrics.phase('S3Get'):
+                entries, _ = manifest.load(s3, BUCKET, owner)
+        except deadline.DeadlineExceeded as e:
+            return e.response(headers)
+        except manifest.ManifestError as e:
+            metrics.log('delete_error', error=type(e).__name__)
+            return {
+                'statusCode': 500,
+                'headers': headers,
+                'body': json.dumps({'error': str(e)})
+            }
+        owned = {entry[0] for entry in entries}
+        truncated = False
+        if prefix is not None:
+            blob_keys = sorted(key for key in owned if key.startswith(prefix))
+            truncated = len(blob_keys) > DELETE_MAX_KEYS
+            blob_keys = blob_keys[:DELETE_MAX_KEYS]
+        with metrics.phase('S3Delete'):
+            results = bulk_delete.delete_keys(s3, BUCKET, [key for key in blob_keys if key in owned],
+                                              DELETE_MAX_WORKERS)
+        # Keys the owner never uploaded are refused without touching S3
+        by_key = {result['blobKey']: result for result in results}
+        results = [by_key.get(key) or {'blobKey': key, 'statusCode': 403, 'error': 'AccessDenied'}
+                   for key in blob_keys]
+        deleted = [result['blobKey'] for result in results if result['statusCode'] == 200]
+        for blob_key in deleted:
+            etag_index.discard(blob_key)
+        segment_index.discard(deleted)
+        # A segment goes once none of the blobs compacted into it is left
+        bulk_delete.release_segments(s3, BUCKET, deleted, {entry[0]: entry[3] for entry in entries if len(entry) > 3})
+        if deleted:
+            # The blobs are gone either way; a stale listing is logged, not failed
+            try:
+                with metrics.phase('ManifestUpdate'):
+                    manifest.remove(s3, BUCKET, owner, deleted)
+            except Exception as e:
+                metrics.add('ManifestUpdateErrors', 1)
+                metrics.log('manifest_error', error=type(e).__name__)
+        metrics.add('DeletedBlobs', len(deleted))
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': json.dumps({
+                'results': results,
+                'deleted': len(deleted),
+                'failed': len(results) - len(deleted),
+                'truncated': truncated
+            })
+        }
+
+    if method == 'POST' and path.rstrip('/').endswith('/blobs/compact'):
+        # Pack the owner's small blobs, oldest first, into indexed segment objects
+        metrics.set_property('Route', 'compact')
+        owner = get_owner(event)
+        if not owner:
+            return unauthenticated(headers)
+        try:
+            with metrics.phase('S3Get'):
+                entries, _ = manifest.load(s3, BUCKET, owner)
+            candidates = sorted((entry for entry in entries if len(entry) < 4 and entry[1] <= SEGMENT_MAX_BLOB_BYTES),
+                                key=lambda entry: (entry[2], entry[0]))
+            report, written = segments.compact(s3, BUCKET, [entry[0] for entry in candidates[:COMPACT_MAX_BLOBS]],
+                                               SEGMENT_MAX_BYTES, COMPACT_MAX_WORKERS, BLOB_KEY_SHARD_CHARS)
+        except deadline.DeadlineExceeded as e:
+            return e.response(headers)
+        except Exception as e:
+            metrics.log('compact_error', error=type(e).__name__)
+            return {
+                'statusCode': 500,
+                'headers': headers,
+                'body': json.dumps({'error': error_code(e) or 'Internal server error'})
+            }
+        compacted = {}
+        for segment_key, locations in written.items():
+            segment_index.add(segment_key, locations)
+            compacted.update(dict.fromkeys(locations, segment_key))
+        if compacted:
+            # The pointers are in place either way; an unmarked entry is only retried
+            try:
+                with metrics.phase('ManifestUpdate'):
+                    manifest.mark_compacted(s3, BUCKET, owner, compacted)
+            except Exception as e:
+                metrics.add('ManifestUpdateErrors', 1)
+                metrics.log('manifest_error', error=type(e).__name__)
+        report['truncated'] = len(candidates) > COMPACT_MAX_BLOBS
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': json.dumps(report)
+        }
+
+    if method == 'GET' and path.startswith('/blob-url/'):
+        metrics.set_property('Route', 'blob_url')
+        blob_key = unquote(path.split('/blob-url/', 1)[1])
+        if not blob_key:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': 'blobKey is required'})
+            }
+        if internal_key(blob_key):
+            return {
+                'statusCode': 404,
+                'headers': headers,
+                'body': json.dumps({'error': 'Blob not found'})
+            }
+        # A compacted blob's key holds only an empty pointer, which S3 would serve as is
+        location = segment_index.locate(blob_key)
+        if location is None:
+            try:
+                with metrics.phase('S3Head'):
+                    location = segments.pointer_location(s3.head_object(Bucket=BUCKET, Key=blob_key))
+            except deadline.DeadlineExceeded as e:
+                return e.response(headers)
+            except Exception as e:
+                if error_code(e) not in ('404', 'NoSuchKey', 'NotFound'):
+                    raise
+                return {
+                    'statusCode': 404,
+                    'headers': headers,
+                    'body': json.dumps({'error': 'Blob not found'})
+                }
+        if location is not None:
+            return {
+                'statusCode': 409,
+                'headers': headers,
+                'body': json.dumps({
+                    'error': 'Blob is compacted into a segment; download it from blobPath',
+                    'blobKey': blob_key,
+                    'blobPath': '/blob/' + quote(blob_key, safe='')
+                })
+            }
+        download_url = s3.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': BUCKET, 'Key': blob_key},
+            ExpiresIn=PRESIGNED_URL_EXPIRES_SECONDS
+        )
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': json.dumps({
+                'blobKey': blob_key,
+                'downloadUrl': download_url,
+                'expiresIn': PRESIGNED_URL_EXPIRES_SECONDS
+            })
+        }
 
     if method == 'GET' and path.startswith('/blob/'):
+        metrics.set_property('Route', 'blob')
         try:
             blob_key = unquote(path.split('/blob/', 1)[1])
-            print(f"Downloading blob with key: {blob_key}")
-            obj = s3.get_object(Bucket=BUCKET, Key=blob_key)
-            data = obj['Body'].read().decode('utf-8')
-            print(f"Retrieved data: {data}")
+            # Manifests list an owner's blobs and segments hold deleted ones
+            if internal_key(blob_key):
+                return {
+                    'statusCode': 404,
+                    'headers': headers,
+                    'body': json.dumps({'error': 'Blob not found'})
+                }
+            binary = blob_format.CONTENT_TYPE in (get_header(event, 'Accept') or '')
+            # The body depends on Accept, so shared caches must key on it
+            cache_headers = {**headers, 'Cache-Control': BLOB_CACHE_CONTROL, 'Vary': 'Accept'}
+            if_none_match = get_header(event, 'If-None-Match')
+            known = None
+            if if_none_match:
+                known = etag_index.get(blob_key)
+                if known is None:
+                    with metrics.phase('S3Head'):
+                        obj = s3.head_object(Bucket=BUCKET, Key=blob_key)
+                    known = (segments.object_etag(obj), obj.get('ContentType') == blob_format.CONTENT_TYPE)
+                    etag_index.put(blob_key, *known)
+                else:
+                    metrics.add('EtagIndexHits', 1)
+                if known[0]:
+                    etag = representation_etag(known[0], known[1], binary)
+                    if etag_matches(if_none_match, etag):
+                        metrics.add('NotModified', 1)
+                        return {
+                            'statusCode': 304,
+                            'headers': {**cache_headers, 'ETag': etag},
+                            'body': ''
+                        }
+            # Ranges apply to the stored bytes, so they are served for the binary
+            # rendering and for legacy objects, but not for a container's JSON rendering
+            byte_range = requested_range(event)
+            if byte_range and not binary and (known or etag_index.get(blob_key) or (None, False))[1]:
+                byte_range = None
+            obj = data = None
+            if byte_range:
+                # Resume only if the blob is unchanged; S3 answers 412 otherwise
+                if_range = get_header(event, 'If-Range')
+                try:
+                    with metrics.phase('S3Get'):
+                        obj, data = get_blob(blob_key, byte_range, if_range)
+                except Exception as e:
+                    code = error_code(e)
+                    if code == 'InvalidRange' or isinstance(e, segments.InvalidRange):
+                        return {
+                            'statusCode': 416,
+                            'headers': {**headers, 'Accept-Ranges': 'bytes'},
+                            'body': json.dumps({'error': 'Range not satisfiable'})
+                        }
+                    if code not in ('PreconditionFailed', '412'):
+                        raise
+                    byte_range = None
+                if byte_range and obj.get('ContentType') == blob_format.CONTENT_TYPE and not binary:
+                    # Not in the ETag index: only now is it known to be a container
+                    obj = data = None
+            if data is None:
+                with metrics.phase('S3Get'):
+                    obj, data = get_blob(blob_key)
+            metrics.add('S3GetBytes', len(data), 'Bytes')
+            etag = obj.get('ETag')
+            if obj.get('ContentRange'):
+                metrics.add('RangeRequests', 1)
+                if etag:
+                    cache_headers['ETag'] = etag
+                return {
+                    'statusCode': 206,
+                    'headers': {**cache_headers, 'Accept-Ranges': 'bytes', 'Content-Range': obj['ContentRange'],
+                                'Content-Type': obj.get('ContentType') or 'application/octet-stream'},
+                    'body': base64.b64encode(data).decode('ascii'),
+                    'isBase64Encoded': True
+                }
+            is_container = blob_format.is_blob(data)
+            if etag:
+                etag_index.put(blob_key, etag, is_container)
+                cache_headers['ETag'] = representation_etag(etag, is_container, binary)
+            if not is_container or binary:
+                # Legacy objects are stored as the JSON document itself; either
+                # way the stored bytes go out unchanged, base64 at the gateway
+                with metrics.phase('Serialize'):
+                    response_body = base64.b64encode(data).decode('ascii')
+                content_type = blob_format.CONTENT_TYPE if is_container else obj.get('ContentType') or 'application/json'
+                return {
+                    'statusCode': 200,
+                    'headers': {**cache_headers, 'Accept-Ranges': 'bytes', 'Content-Type': content_type},
+                    'body': response_body,
+                    'isBase64Encoded': True
+                }
+            with metrics.phase('Serialize'):
+                response_body = blob_format.parse_blob(data).to_legacy_json()
             return {
                 'statusCode': 200,
-                'headers': headers,
-                'body': data
+                'headers': cache_headers,
+                'body': response_body
             }
+        except deadline.DeadlineExceeded as e:
+            return e.response(headers)
         except Exception as e:
-            print(f"Download error: {str(e)}")
+            metrics.log('download_error', error=type(e).__name__)
             return {
                 'statusCode': 404,
                 'headers': headers,
@@ -81,4 +793,7 @@ def lambda_handler(event, context):
         'statusCode': 404,
         'headers': headers,
         'body': json.dumps({'error': 'Not found'})
-    } 
\ No newline at end of file
+    }
+
+
+cold_start.mark_imported()
@@ -0,0 +1,240 @@
+"""
+Client-side protection against KMS throttling.
+
+Under bursts, KMS answers Decrypt with ThrottlingException. Retrying
+blindly only adds load and burns the request's latency budget, so KMS
+calls go through a KmsGuard, which combines three mechanisms:
+
+  - an optional adaptive token bucket that keeps this container under
+    its share of the account's KMS quota; it halves its rate on every
+    throttle and recovers gradually on success (AIMD, like botocore's
+    adaptive mode)
+  - retries with full-jitter exponential backoff, for throttles and
+    transient KMS errors, that never sleep past the request's deadline
+  - a circuit breaker that opens after consecutive throttles, failing
+    calls fast with Throttled (429 with Retry-After) until a probe
+    succeeds after the cool-down
+
+    KMS_RATE_LIMIT            sustained KMS calls per second per container (unset)
+    KMS_ACCOUNT_QUOTA         account Decrypt quota per second, shared by...
+    KMS_CONTAINERS            ...this many concurrent containers (1)
+    KMS_BURST                 token bucket capacity (20)
+    KMS_MAX_WAIT_MS           longest wait for a token before failing with 429 (250)
+    KMS_MAX_ATTEMPTS          attempts per call, including the first (4)
+    KMS_BACKOFF_BASE_MS       backoff base, doubled per retry (25)
+    KMS_BACKOFF_MAX_MS        backoff cap (1000)
+    KMS_BREAKER_THRESHOLD     consecutive throttles that open the breaker (5)
+    KMS_BREAKER_RESET_SECONDS how long the breaker stays open (5)
+
+The quota is per account and region, shared by every container, so a
+fixed per-container default would either throttle healthy batches or
+not protect the quota at all. The bucket is therefore off unless
+KMS_RATE_LIMIT is set, or derived as KMS_ACCOUNT_QUOTA / KMS_CONTAINERS;
+without it, throttles are still met by the retries and the breaker.
+"""
+
+import math
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Optional
+
+import deadline
+import metrics
+from aws_clients import error_code
+
+THROTTLE_CODES = ('ThrottlingException', 'Throttling', 'TooManyRequestsException', 'RequestLimitExceeded')
+TRANSIENT_CODES = ('KMSInternalException', 'DependencyTimeoutException', 'InternalFailure',
+                   'ServiceUnavailable', 'ServiceUnavailableException')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class Throttled(Exception):
+    """Raised when KMS is saturated; retry_after is a whole number of seconds."""
+
+    def __init__(self, retry_after: float):
+        super().__init__('KMS is throttling requests')
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class TokenBucket:
+    """Thread-safe token bucket whose rate adapts to throttling."""
+
+    def __init__(self, rate: float, burst: float, min_rate: float = 1.0,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min(min_rate, rate)
+        self._tokens = burst
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, max_wait: float) -> bool:
+        """Take a token, waiting up to max_wait seconds; False if none became available."""
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            if wait > max_wait:
+                # Give the token back rather than queueing past the deadline
+                self._tokens += 1
+                return False
+        if wait > 0:
+            self._sleep(wait)
+        return True
+
+    def throttled(self) -> None:
+        """Multiplicative decrease after KMS pushed back."""
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def succeeded(self) -> None:
+        """Additive increase back toward the configured rate."""
+        with self._lock:
+            if self.rate < self.max_rate:
+                self._refill()
+                self.rate = min(self.max_rate, self.rate + max(1.0, self.max_rate / 20))
+
+
+class CircuitBreaker:
+    """
+    Opens after consecutive throttles and lets one probe through every reset_seconds.
+
+    The probe's outcome closes the breaker or opens it again; a probe that
+    never reports back is superseded by a new one after reset_seconds.
+    """
+
+    def __init__(self, threshold: int, reset_seconds: float, clock: Callable[[], float] = time.monotonic):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            now = self._clock()
+            if now - self._opened_at >= self.reset_seconds:
+                self.state = HALF_OPEN
+                self._opened_at = now
+                return True
+            return False
+
+    def retry_after(self) -> float:
+        with self._lock:
+            if self.state == CLOSED:
+                return 0.0
+            return max(0.0, self.reset_seconds - (self._clock() - self._opened_at))
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self.state = CLOSED
+
+    def record_throttle(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.state == HALF_OPEN or self._failures >= self.threshold:
+                self.state = OPEN
+                self._opened_at = self._clock()
+
+
+def rate_limit_from_env() -> Optional[float]:
+    """This container's KMS calls per second, or None to leave them unlimited."""
+    if os.environ.get('KMS_RATE_LIMIT'):
+        return float(os.environ['KMS_RATE_LIMIT'])
+    if os.environ.get('KMS_ACCOUNT_QUOTA'):
+        return float(os.environ['KMS_ACCOUNT_QUOTA']) / max(1, int(os.environ.get('KMS_CONTAINERS', '1')))
+    return None
+
+
+class KmsGuard:
+    """Runs KMS calls through the token bucket, retry policy and circuit breaker."""
+
+    def __init__(self, bucket: Optional[TokenBucket], breaker: CircuitBreaker, max_attempts: int = 4,
+                 backoff_base: float = 0.025, backoff_max: float = 1.0, max_wait: float = 0.25,
+                 sleep: Callable[[float], None] = time.sleep, rng: Optional[random.Random] = None):
+        self.bucket = bucket
+        self.breaker = breaker
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_wait = max_wait
+        self._sleep = sleep
+        self._random = rng or random.Random()
+
+    @classmethod
+    def from_env(cls) -> 'KmsGuard':
+        rate = rate_limit_from_env()
+        return cls(
+            TokenBucket(rate, float(os.environ.get('KMS_BURST', '20'))) if rate else None,
+            CircuitBreaker(int(os.environ.get('KMS_BREAKER_THRESHOLD', '5')),
+                           float(os.environ.get('KMS_BREAKER_RESET_SECONDS', '5'))),
+            max_attempts=int(os.environ.get('KMS_MAX_ATTEMPTS', '4')),
+            backoff_base=float(os.environ.get('KMS_BACKOFF_BASE_MS', '25')) / 1000,
+            backoff_max=float(os.environ.get('KMS_BACKOFF_MAX_MS', '1000')) / 1000,
+            max_wait=float(os.environ.get('KMS_MAX_WAIT_MS', '250')) / 1000,
+        )
+
+    def call(self, fn: Callable[..., Any], **kwargs: Any) -> Any:
+        """Call fn(**kwargs); raises Throttled instead of waiting out a saturated KMS."""
+        try:
+            for attempt in range(self.max_attempts):
+                if not self.breaker.allow():
+                    metrics.add('KmsBreakerRejections', 1)
+                    raise Throttled(self.breaker.retry_after())
+                if self.bucket is not None and not self.bucket.acquire(self.max_wait):
+                    metrics.add('KmsRateLimited', 1)
+                    raise Throttled(1 / self.bucket.rate)
+                try:
+                    result = fn(**kwargs)
+                except Exception as e:
+                    code = error_code(e)
+                    if code in THROTTLE_CODES:
+                        metrics.add('KmsThrottles', 1)
+                        if self.bucket is not None:
+                            self.bucket.throttled()
+                        self.breaker.record_throttle()
+                    elif code not in TRANSIENT_CODES:
+                        if code:
+                            # KMS answered (e.g. InvalidCiphertextException), so it is not saturated
+                            self.breaker.record_success()
+                        raise
+                    if attempt + 1 == self.max_attempts:
+                        if code in THROTTLE_CODES:
+                            raise Throttled(max(self.breaker.retry_after(), self._token_interval()))
+                        raise
+                    delay = self._random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                    # Do not back off past the request's deadline
+                    deadline.ensure(delay * 1000, 'kms_retry')
+                    metrics.add('KmsRetries', 1)
+                    self._sleep(delay)
+                    continue
+                if self.bucket is not None:
+                    self.bucket.succeeded()
+                self.breaker.record_success()
+                return result
+        finally:
+            metrics.set_property('KmsBreakerState', self.breaker.state)
+            if self.bucket is not None:
+                metrics.set_property('KmsRateLimit', round(self.bucket.rate, 2))
+
+    def _token_interval(self) -> float:
+        return 1 / self.bucket.rate if self.bucket is not None else 0.0
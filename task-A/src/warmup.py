@@ -0,0 +1,110 @@
+"""
+Warm-up events for the Lambda handlers.
+
+Provisioned-concurrency pre-warming and scheduled pings send a warm-up
+event instead of a real request. Instead of running (or failing) the
+request path, the handler then does the work the first real request
+would otherwise pay for, and reports what it did:
+
+  - builds its AWS clients and opens pooled keep-alive connections with
+    one cheap probe call per connection (TLS handshake included); an
+    AWS error answer such as 404 or AccessDenied still leaves a warm
+    connection behind, so probes need no extra permissions
+  - checks the configuration it reads from the environment
+  - optionally prefetches hot blobs into the in-container caches
+
+An event is a warm-up when it is {"warmup": true} (optionally with
+"prefetchKeys"), or comes from EventBridge schedules or
+serverless-plugin-warmup.
+
+    WARMUP_CONNECTIONS     connections opened per client (1); raise it to
+                           pre-fill the pool used by batch workers
+    WARMUP_PREFETCH_KEYS   comma-separated blob keys to prefetch
+    WARMUP_MAX_PREFETCH    cap on prefetched keys per warm-up (20)
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import metrics
+from aws_clients import error_code
+
+WARMUP_SOURCES = ('aws.events', 'serverless-plugin-warmup')
+
+
+def is_warmup(event: Any) -> bool:
+    """Return True for a warm-up event rather than an API request."""
+    return isinstance(event, dict) and 'httpMethod' not in event and (
+        event.get('warmup') is True or event.get('source') in WARMUP_SOURCES
+    )
+
+
+def prefetch_keys(event: Dict[str, Any]) -> List[str]:
+    """Blob keys to prefetch: the event's prefetchKeys, else WARMUP_PREFETCH_KEYS, capped."""
+    keys = event.get('prefetchKeys')
+    if not isinstance(keys, list):
+        keys = os.environ.get('WARMUP_PREFETCH_KEYS', '').split(',')
+    keys = [key for key in keys if isinstance(key, str) and key]
+    return keys[:int(os.environ.get('WARMUP_MAX_PREFETCH', '20'))]
+
+
+def open_connections(probe: Callable[[], Any], count: int) -> Dict[str, Any]:
+    """Run count probes concurrently so that many pooled connections are open afterwards."""
+    started = time.perf_counter()
+    errors: List[str] = []
+
+    def run(_: int) -> None:
+        try:
+            probe()
+        except Exception as e:
+            # An AWS error response still came over an established connection
+            if not error_code(e):
+                errors.append(type(e).__name__)
+
+    if count <= 1:
+        run(0)
+    else:
+        with ThreadPoolExecutor(max_workers=count) as executor:
+            list(executor.map(run, range(count)))
+    return {
+        'connections': count,
+        'ok': not errors,
+        'error': errors[0] if errors else None,
+        'ms': round((time.perf_counter() - started) * 1000, 3),
+    }
+
+
+def warm(handler_name: str, probes: Dict[str, Callable[[], Any]], config: Dict[str, Optional[str]],
+         prefetch: Optional[Callable[[List[str]], int]], keys: List[str], cold: bool) -> Dict[str, Any]:
+    """
+    Open connections, check config and prefetch; returns the warm-up report.
+
+    prefetch takes the keys and returns how many were loaded.
+    """
+    started = time.perf_counter()
+    count = max(1, int(os.environ.get('WARMUP_CONNECTIONS', '1')))
+    connections = {}
+    for service, probe in probes.items():
+        with metrics.phase(f'Warmup{service.upper()}'):
+            connections[service] = open_connections(probe, count)
+
+    prefetched = 0
+    if prefetch is not None and keys:
+        with metrics.phase('WarmupPrefetch'):
+            prefetched = prefetch(keys)
+    metrics.add('WarmupPrefetched', prefetched)
+
+    report = {
+        'warmup': True,
+        'handler': handler_name,
+        'coldStart': cold,
+        'connections': connections,
+        'missingConfig': sorted(name for name, value in config.items() if not value),
+        'prefetched': prefetched,
+        'prefetchRequested': len(keys),
+        'totalMs': round((time.perf_counter() - started) * 1000, 3),
+    }
+    metrics.log('warmup', **report)
+    return report
@@ -4,17 +4,36 @@ Test suite for the Solace Lambda Decryption Service.
 This includes unit tests and integration test scenarios.
 """
 
+import base64
+import http.server
+import io
 import json
 import os
+import subprocess
+import threading
+import time
+import tracemalloc
 import unittest
 from unittest.mock import Mock, patch, MagicMock
 import sys
 import tempfile
+from contextlib import redirect_stdout
 
 # Add the src directory to the path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 
+import aws_clients
+import blob_format
+import content_coding
+import deadline
+import envelope
+import framed
+import handler
+import hedging
 from handler import lambda_handler
+from result_cache import ResultCache
+import segments
+import throttle
 
 class TestLambdaHandler(unittest.TestCase):
     """Test cases for the lambda_handler function."""
@@ -209,6 +228,1314 @@ class TestLambdaHandler(unittest.TestCase):
         os.environ['S3_BUCKET'] = 'test-bucket'
         os.environ['KMS_KEY_ID'] = 'test-key-id'
 
+class TestBatchDecrypt(unittest.TestCase):
+    """Test cases for the blobKeys batch request form."""
+    
+    def setUp(self):
+        """Set up test environment."""
+        os.environ['S3_BUCKET'] = 'test-bucket'
+        os.environ['KMS_KEY_ID'] = 'test-key-id'
+    
+    @patch('handler.s3_client')
+    @patch('handler.kms_client')
+    def test_batch_returns_per_key_results_in_order(self, mock_kms, mock_s3):
+        """Test that a missing blob does not fail the rest of the batch."""
+        from botocore.exceptions import ClientError
+        
+        def get_object(Bucket, Key):
+            if Key == 'missing':
+                raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+            return {'Body': Mock(read=lambda: base64.b64encode(Key.encode('utf-8')))}
+        
+        mock_s3.get_object.side_effect = get_object
+        mock_kms.decrypt.side_effect = lambda CiphertextBlob, KeyId: {
+            'Plaintext': b'plain-' + CiphertextBlob
+        }
+        
+        event = {
+            'httpMethod': 'POST',
+            'body': json.dumps({'blobKeys': ['a', 'missing', 'b']})
+        }
+        
+        result = lambda_handler(event, None)
+        
+        self.assertEqual(result['statusCode'], 200)
+        results = json.loads(result['body'])['results']
+        self.assertEqual([r['blobKey'] for r in results], ['a', 'missing', 'b'])
+        self.assertEqual(results[0], {'blobKey': 'a', 'statusCode': 200, 'plaintext': 'plain-a'})
+        self.assertEqual(results[1]['statusCode'], 404)
+        self.assertIn('Blob not found', results[1]['error'])
+        self.assertEqual(results[2]['plaintext'], 'plain-b')
+    
+    @patch('handler.s3_client')
+    @patch('handler.kms_client')
+    def test_batch_isolates_kms_errors(self, mock_kms, mock_s3):
+        """Test that KMS failures are reported per key."""
+        from botocore.exceptions import ClientError
+        
+        mock_s3.get_object.side_effect = lambda Bucket, Key: {
+            'Body': Mock(read=lambda: base64.b64encode(Key.encode('utf-8')))
+        }
+        
+        def decrypt(CiphertextBlob, KeyId):
+            if CiphertextBlob == b'bad':
+                raise ClientError({'Error': {'Code': 'InvalidCiphertextException'}}, 'Decrypt')
+            if CiphertextBlob == b'boom':
+                raise ClientError({'Error': {'Code': 'KMSInternalException'}}, 'Decrypt')
+            return {'Plaintext': b'ok'}
+        
+        mock_kms.decrypt.side_effect = decrypt
+        
+        event = {
+            'httpMethod': 'POST',
+            'body': json.dumps({'blobKeys': ['good', 'bad', 'boom']})
+        }
+        
+        results = json.loads(lambda_handler(event, None)['body'])['results']
+        
+        self.assertEqual([r['statusCode'] for r in results], [200, 400, 500])
+        self.assertEqual(results[1]['error'], 'Invalid encrypted data')
+        self.assertEqual(results[2]['error'], 'Internal server error')
+    
+    @patch('handler.s3_client')
+    @patch('handler.kms_client')
+    def test_batch_fetches_duplicate_keys_once(self, mock_kms, mock_s3):
+        """Test that duplicate keys share one fetch and decrypt."""
+        mock_s3.get_object.return_value = {'Body': Mock(read=lambda: b'encrypted-data')}
+        mock_kms.decrypt.return_value = {'Plaintext': b'Hello'}
+        
+        event = {
+            'httpMethod': 'POST',
+            'body': json.dumps({'blobKeys': ['same', 'same']})
+        }
+        
+        results = json.loads(lambda_handler(event, None)['body'])['results']
+        
+        self.assertEqual(len(results), 2)
+        mock_s3.get_object.assert_called_once_with(Bucket='test-bucket', Key='same')
+        mock_kms.decrypt.assert_called_once()
+    
+    def test_batch_rejects_invalid_key_list(self):
+        """Test validation of the blobKeys field."""
+        for blob_keys in ([], 'not-a-list', ['ok', ''], ['ok', 3]):
+            event = {
+                'httpMethod': 'POST',
+                'body': json.dumps({'blobKeys': blob_keys})
+            }
+            
+            result = lambda_handler(event, None)
+            
+            self.assertEqual(result['statusCode'], 400)
+            self.assertIn('blobKeys must be a non-empty list', result['body'])
+    
+    @patch('handler.MAX_BATCH_KEYS', 2)
+    def test_batch_rejects_oversized_batch(self):
+        """Test that batches above MAX_BATCH_KEYS are rejected."""
+        event = {
+            'httpMethod': 'POST',
+            'body': json.dumps({'blobKeys': ['a', 'b', 'c']})
+        }
+        
+        result = lambda_handler(event, None)
+        
+        self.assertEqual(result['statusCode'], 400)
+        self.assertIn('at most 2 keys', result['body'])
+
+class TestEnvelopeDecrypt(unittest.TestCase):
+    """Test cases for envelope-encrypted blobs and the data key cache."""
+    
+    def setUp(self):
+        """Set up test environment."""
+        os.environ['S3_BUCKET'] = 'test-bucket'
+        os.environ['KMS_KEY_ID'] = 'test-key-id'
+        handler.data_key_cache.clear()
+        
+        self.data_key = b'k' * 32
+        self.wrapped_key = b'wrapped-data-key'
+        writer_kms = Mock()
+        writer_kms.generate_data_key.return_value = {
+            'Plaintext': self.data_key,
+            'CiphertextBlob': self.wrapped_key
+        }
+        self.writer_kms = writer_kms
+    
+    def _event(self, blob_key):
+        return {'httpMethod': 'POST', 'body': json.dumps({'blobKey': blob_key})}
+    
+    @patch('handler.s3_client')
+    @patch('handler.kms_client')
+    def test_envelope_unwraps_data_key_once(self, mock_kms, mock_s3):
+        """Test that warm invocations reuse the unwrapped data key."""
+        blobs = {
+            'first': envelope.encrypt_envelope(b'first message', self.writer_kms, 'test-key-id'),
+            'second': envelope.encrypt_envelope(b'second message', self.writer_kms, 'test-key-id')
+        }
+        mock_s3.get_object.side_effect = lambda Bucket, Key: {
+            'Body': Mock(read=lambda: blobs[Key])
+        }
+        mock_kms.decrypt.return_value = {'Plaintext': self.data_key}
+        
+        first = lambda_handler(self._event('first'), None)
+        second = lambda_handler(self._event('second'), None)
+        
+        self.assertEqual(json.loads(first['body'])['plaintext'], 'first message')
+        self.assertEqual(json.loads(second['body'])['plaintext'], 'second message')
+        mock_kms.decrypt.assert_called_once_with(
+            CiphertextBlob=self.wrapped_key,
+            KeyId='test-key-id'
+        )
+    
+    @patch('handler.s3_client')
+    @patch('handler.kms_client')
+    def test_tampered_envelope_is_rejected(self, mock_kms, mock_s3):
+        """Test that a modified envelope fails authentication."""
+        blob = bytearray(envelope.encrypt_envelope(b'message', self.writer_kms, 'test-key-id'))
+        blob[-1] ^= 0x01
+        mock_s3.get_object.return_value = {'Body': Mock(read=lambda: bytes(blob))}
+        mock_kms.decrypt.return_value = {'Plaintext': self.data_key}
+        
+        result = lambda_handler(self._event('tampered'), None)
+        
+        self.assertEqual(result['statusCode'], 400)
+        self.assertIn('Invalid encrypted data', result['body'])
+    
+    def test_data_key_cache_expires_by_ttl_and_uses(self):
+        """Test the TTL and max-uses bounds of the data key cache."""
+        now = [0.0]
+        cache = envelope.DataKeyCache(ttl_seconds=10, max_uses=2, clock=lambda: now[0])
+        
+        cache.put(b'wrapped', b'key')
+        self.assertEqual(cache.get(b'wrapped'), b'key')
+        self.assertIsNone(cache.get(b'wrapped'))
+        
+        cache.put(b'wrapped', b'key')
+        now[0] = 11.0
+        self.assertIsNone(cache.get(b'wrapped'))
+
+class TestResultCache(unittest.TestCase):
+    """Test cases for the ETag-keyed decrypted result cache."""
+    
+    def setUp(self):
+        """Set up test environment with a fresh, enabled cache."""
+        os.environ['S3_BUCKET'] = 'test-bucket'
+        os.environ['KMS_KEY_ID'] = 'test-key-id'
+        self.now = [0.0]
+        patcher = patch('handler.result_cache', ResultCache(
+            max_bytes=10_000, ttl_seconds=30, clock=lambda: self.now[0]
+        ))
+        self.cache = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.event = {'httpMethod': 'POST', 'body': json.dumps({'blobKey': 'test-blob'})}
+    
+    @patch('handler.s3_client')
+    @patch('handler.kms_client')
+    def test_fresh_entry_skips_s3_and_kms(self, mock_kms, mock_s3):
+        """Test that a fresh entry is served without any AWS calls."""
+        mock_s3.get_object.return_value = {
+            'Body': Mock(read=lambda: b'encrypted-data'), 'ETag': '"v1"'
+        }
+        mock_kms.decrypt.return_value = {'Plaintext': b'Hello, World!'}
+        
+        lambda_handler(self.event, None)
+        result = lambda_handler(self.event, None)
+        
+        self.assertEqual(json.loads(result['body'])['plaintext'], 'Hello, World!')
+        mock_s3.get_object.assert_called_once()
+        mock_kms.decrypt.assert_called_once()
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+    
+    @patch('handler.s3_client')
+    @patch('handler.kms_client')
+    def test_stale_entry_revalidates_with_conditional_get(self, mock_kms, mock_s3):
+        """Test that a stale entry costs a 304, not a download and decrypt."""
+        from botocore.exceptions import ClientError
+        
+        mock_s3.get_object.return_value = {
+            'Body': Mock(read=lambda: b'encrypted-data'), 'ETag': '"v1"'
+        }
+        mock_kms.decrypt.return_value = {'Plaintext': b'Hello, World!'}
+        lambda_handler(self.event, None)
+        
+        self.now[0] = 31.0
+        mock_s3.get_object.side_effect = ClientError(
+            {'Error': {'Code': '304'}, 'ResponseMetadata': {'HTTPStatusCode': 304}}, 'GetObject'
+        )
+        result = lambda_handler(self.event, None)
+        
+        self.assertEqual(json.loads(result['body'])['plaintext'], 'Hello, World!')
+        mock_s3.get_object.assert_called_with(Bucket='test-bucket', Key='test-blob', IfNoneMatch='"v1"')
+        mock_kms.decrypt.assert_called_once()
+        self.assertEqual(self.cache.stats()['revalidations'], 1)
+    
+    @patch('handler.s3_client')
+    @patch('handler.kms_client')
+    def test_changed_etag_refetches(self, mock_kms, mock_s3):
+        """Test that a new ETag replaces the cached plaintext."""
+        mock_s3.get_object.return_value = {
+            'Body': Mock(read=lambda: b'encrypted-data'), 'ETag': '"v1"'
+        }
+        mock_kms.decrypt.return_value = {'Plaintext': b'old'}
+        lambda_handler(self.event, None)
+        
+        self.now[0] = 31.0
+        mock_s3.get_object.return_value = {
+            'Body': Mock(read=lambda: b'encrypted-data'), 'ETag': '"v2"'
+        }
+        mock_kms.decrypt.return_value = {'Plaintext': b'new'}
+        result = lambda_handler(self.event, None)
+        
+        self.assertEqual(json.loads(result['body'])['plaintext'], 'new')
+        self.assertEqual(mock_kms.decrypt.call_count, 2)
+    
+    def test_byte_budget_evicts_least_recently_used(self):
+        """Test LRU eviction once the byte budget is exceeded."""
+        cache = ResultCache(max_bytes=400, ttl_seconds=30)
+        
+        cache.put('bucket', 'a', '"1"', 'x' * 100)
+        cache.put('bucket', 'b', '"1"', 'y' * 100)
+        cache.lookup('bucket', 'a')
+        cache.put('bucket', 'c', '"1"', 'z' * 100)
+        
+        self.assertIsNotNone(cache.lookup('bucket', 'a')[0])
+        self.assertIsNone(cache.lookup('bucket', 'b')[0])
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertLessEqual(cache.stats()['bytes'], 400)
+
+class FakeRangedS3:
+    """In-memory S3 stand-in that honours Range requests and records reads."""
+    
+    def __init__(self, objects):
+        self.objects = objects
+        self.ranges = []
+        self.read_sizes = []
+    
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        data = self.objects[Key]
+        if Range is None:
+            return {'Body': self._body(data), 'ETag': '"etag"'}
+        self.ranges.append(Range)
+        start, end = (int(part) for part in Range[len('bytes='):].split('-'))
+        end = min(end, len(data) - 1)
+        return {
+            'Body': self._body(data[start:end + 1]),
+            'ContentRange': f'bytes {start}-{end}/{len(data)}'
+        }
+    
+    def _body(self, data):
+        stream = io.BytesIO(data)
+        
+        def read(size=-1):
+            self.read_sizes.append(size)
+            return stream.read(size)
+        
+        return Mock(read=read)
+
+class TestFramedDecrypt(unittest.TestCase):
+    """Test cases for framed blobs and paged, ranged decryption."""
+    
+    def setUp(self):
+        """Set up test environment with a framed blob of 5 frames."""
+        os.environ['S3_BUCKET'] = 'test-bucket'
+        os.environ['KMS_KEY_ID'] = 'test-key-id'
+        handler.data_key_cache.clear()
+        
+        self.data_key = b'k' * 32
+        writer_kms = Mock()
+        writer_kms.generate_data_key.return_value = {
+            'Plaintext': self.data_key,
+            'CiphertextBlob': b'wrapped-data-key'
+        }
+        self.plaintext = bytes(range(256)) * 18
+        self.blob = framed.encrypt_framed(self.plaintext, writer_kms, 'test-key-id', frame_size=1000)
+        self.fake_s3 = FakeRangedS3({'transcript': self.blob})
+    
+    def _invoke(self, mock_kms, **body):
+        mock_kms.decrypt.return_value = {'Plaintext': self.data_key}
+        with patch('handler.s3_client', self.fake_s3):
+            return lambda_handler({'httpMethod': 'POST', 'body': json.dumps(body)}, None)
+    
+    @patch('handler.kms_client')
+    def test_page_reads_only_requested_frames(self, mock_kms):
+        """Test that a page is decrypted from a ranged read of its frames."""
+        result = self._invoke(mock_kms, blobKey='transcript', frameStart=1, maxFrames=2)
+        
+        self.assertEqual(result['statusCode'], 200)
+        page = json.loads(result['body'])
+        self.assertEqual(base64.b64decode(page['plaintextBase64']), self.plaintext[1000:3000])
+        self.assertEqual(page['totalFrames'], 5)
+        self.assertEqual(page['nextFrame'], 3)
+        
+        header = framed.FramedHeader.parse(self.blob)
+        start, end = header.frame_range(1, 2, len(self.blob))
+        self.assertEqual(self.fake_s3.ranges[-1], f'bytes={start}-{end}')
+        self.assertTrue(all(size <= header.sealed_frame_size for size in self.fake_s3.read_sizes[1:]))
+    
+    @patch('handler.kms_client')
+    def test_last_page_has_no_next_frame(self, mock_kms):
+        """Test paging through to the final, short frame."""
+        result = self._invoke(mock_kms, blobKey='transcript', frameStart=4)
+        
+        page = json.loads(result['body'])
+        self.assertEqual(base64.b64decode(page['plaintextBase64']), self.plaintext[4000:])
+        self.assertIsNone(page['nextFrame'])
+    
+    @patch('handler.kms_client')
+    def test_frame_start_past_end(self, mock_kms):
+        """Test that paging past the last frame is rejected."""
+        result = self._invoke(mock_kms, blobKey='transcript', frameStart=5)
+        
+        self.assertEqual(result['statusCode'], 400)
+        self.assertIn('past the end', result['body'])
+    
+    @patch('handler.kms_client')
+    def test_truncated_blob_fails_authentication(self, mock_kms):
+        """Test that dropping the final frame is detected."""
+        header = framed.FramedHeader.parse(self.blob)
+        self.fake_s3.objects['transcript'] = self.blob[:header.frame_offset(4)]
+        
+        result = self._invoke(mock_kms, blobKey='transcript', frameStart=3)
+        
+        self.assertEqual(result['statusCode'], 400)
+        self.assertIn('Invalid encrypted data', result['body'])
+    
+    @patch('handler.kms_client')
+    def test_whole_framed_blob_without_paging(self, mock_kms):
+        """Test that a plain blobKey request decrypts every frame."""
+        text = 'transcript line\n' * 200
+        self.fake_s3.objects['text'] = framed.encrypt_framed(
+            text.encode('utf-8'), Mock(generate_data_key=Mock(return_value={
+                'Plaintext': self.data_key, 'CiphertextBlob': b'wrapped-data-key'
+            })), 'test-key-id', frame_size=1000
+        )
+        
+        result = self._invoke(mock_kms, blobKey='text')
+        
+        self.assertEqual(result['statusCode'], 200)
+        self.assertEqual(json.loads(result['body'])['plaintext'], text)
+    
+    def test_invalid_paging_parameters(self):
+        """Test validation of frameStart and maxFrames."""
+        for body in ({'blobKey': 'k', 'frameStart': -1},
+                     {'blobKey': 'k', 'frameStart': 'a'},
+                     {'blobKey': 'k', 'maxFrames': 0},
+                     {'blobKeys': ['k'], 'frameStart': 0}):
+            result = lambda_handler({'httpMethod': 'POST', 'body': json.dumps(body)}, None)
+            
+            self.assertEqual(result['statusCode'], 400)
+
+class TestColdStart(unittest.TestCase):
+    """Cold-start regression tests, run in fresh interpreters."""
+    
+    SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+    IMPORT_BUDGET_MS = float(os.environ.get('COLD_START_IMPORT_BUDGET_MS', '500'))
+    
+    def _cold_start(self, module_name, event):
+        """Import a handler in a new process, invoke it once and return its report."""
+        script = (
+            'import json, sys\n'
+            f'import {module_name} as module\n'
+            'imported_boto3 = "boto3" in sys.modules\n'
+            f'module.lambda_handler({event!r}, None)\n'
+            'print(json.dumps({"report": module.cold_start.report, "importedBoto3": imported_boto3}))\n'
+        )
+        env = dict(os.environ, S3_BUCKET='test-bucket', KMS_KEY_ID='test-key-id')
+        env.pop('COLD_START_REPORT', None)
+        output = subprocess.run(
+            [sys.executable, '-c', script], cwd=self.SRC_DIR, env=env,
+            capture_output=True, text=True, check=True
+        ).stdout
+        return json.loads(output.strip().splitlines()[-1])
+    
+    def test_decrypt_handler_defers_aws_clients(self):
+        """Test that import and preflight/validation paths never build AWS clients."""
+        for event in ({'httpMethod': 'OPTIONS'}, {'httpMethod': 'POST', 'body': '{}'}):
+            result = self._cold_start('handler', event)
+            
+            self.assertFalse(result['importedBoto3'])
+            self.assertEqual(result['report']['clientsBuilt'], [])
+            self.assertLess(result['report']['importMs'], self.IMPORT_BUDGET_MS)
+            self.assertGreaterEqual(result['report']['timeToFirstResponseMs'], result['report']['importMs'])
+    
+    def test_sdk_handler_defers_aws_clients(self):
+        """Test that the SDK handler imports without boto3 and builds no client for preflights."""
+        result = self._cold_start('solacesdk_handler', {'httpMethod': 'OPTIONS'})
+        
+        self.assertFalse(result['importedBoto3'])
+        self.assertEqual(result['report']['clientsBuilt'], [])
+        self.assertLess(result['report']['importMs'], self.IMPORT_BUDGET_MS)
+    
+    def test_clients_share_one_session(self):
+        """Test that clients are built once and from a single session."""
+        aws_clients.reset()
+        self.addCleanup(aws_clients.reset)
+        session = Mock()
+        session.client.side_effect = lambda name, config: Mock(name=name)
+        
+        with patch('boto3.session.Session', return_value=session) as session_factory:
+            s3 = aws_clients.get_client('s3')
+            kms = aws_clients.LazyClient('kms')
+            kms.decrypt
+            
+            self.assertIs(aws_clients.get_client('s3'), s3)
+            session_factory.assert_called_once_with()
+            self.assertEqual(aws_clients.built_clients(), ['kms', 's3'])
+
+class CountingAwsServer(http.server.ThreadingHTTPServer):
+    """Local keep-alive HTTP endpoint answering S3 GetObject and KMS Decrypt, counting connections."""
+    
+    daemon_threads = True
+    
+    def __init__(self):
+        self.connections = 0
+        self.requests = 0
+        super().__init__(('127.0.0.1', 0), CountingAwsRequestHandler)
+
+class CountingAwsRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def _reply(self, body, content_type):
+        self.server.requests += 1
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def do_GET(self):
+        self._reply(b'encrypted-data', 'application/octet-stream')
+    
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        body = json.dumps({
+            'KeyId': 'test-key-id',
+            'Plaintext': base64.b64encode(b'Hello, World!').decode('ascii')
+        }).encode('utf-8')
+        self._reply(body, 'application/x-amz-json-1.1')
+
+class TestClientConfig(unittest.TestCase):
+    """Test cases for the shared botocore client configuration."""
+    
+    def setUp(self):
+        """Point fresh clients at a local endpoint with dummy credentials."""
+        self.server = CountingAwsServer()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        
+        env = patch.dict(os.environ, {
+            'S3_BUCKET': 'test-bucket',
+            'KMS_KEY_ID': 'test-key-id',
+            'AWS_ENDPOINT_URL': f'http://127.0.0.1:{self.server.server_address[1]}',
+            'AWS_ACCESS_KEY_ID': 'testing',
+            'AWS_SECRET_ACCESS_KEY': 'testing',
+            'AWS_DEFAULT_REGION': 'us-east-1'
+        })
+        env.start()
+        self.addCleanup(env.stop)
+        aws_clients.reset()
+        self.addCleanup(aws_clients.reset)
+    
+    def test_config_from_environment(self):
+        """Test that pool, keep-alive, timeout and retry settings come from the environment."""
+        with patch.dict(os.environ, {
+            'AWS_CLIENT_MAX_POOL_CONNECTIONS': '32',
+            'AWS_CLIENT_TCP_KEEPALIVE': 'false',
+            'AWS_CLIENT_CONNECT_TIMEOUT': '0.5',
+            'AWS_CLIENT_READ_TIMEOUT': '2',
+            'AWS_CLIENT_RETRY_MODE': 'adaptive',
+            'AWS_CLIENT_MAX_ATTEMPTS': '5'
+        }):
+            config = aws_clients.get_client('s3').meta.config
+        
+        self.assertEqual(config.max_pool_connections, 32)
+        self.assertFalse(config.tcp_keepalive)
+        self.assertEqual(config.connect_timeout, 0.5)
+        self.assertEqual(config.read_timeout, 2)
+        self.assertEqual(config.retries['mode'], 'adaptive')
+        self.assertEqual(config.retries['total_max_attempts'], 5)
+    
+    def test_warm_invocations_reuse_connections(self):
+        """Test that repeated invocations open one connection per client, not one per call."""
+        event = {'httpMethod': 'POST', 'body': json.dumps({'blobKey': 'test-blob'})}
+        
+        for _ in range(3):
+            result = lambda_handler(event, None)
+            self.assertEqual(json.loads(result['body'])['plaintext'], 'Hello, World!')
+        
+        self.assertEqual(self.server.requests, 6)
+        self.assertEqual(self.server.connections, 2)
+
+class TestBlobContainer(unittest.TestCase):
+    """Test cases for reading binary blob containers."""
+    
+    def setUp(self):
+        """Set up test environment."""
+        os.environ['S3_BUCKET'] = 'test-bucket'
+        os.environ['KMS_KEY_ID'] = 'test-key-id'
+        self.event = {'httpMethod': 'POST', 'body': json.dumps({'blobKey': 'test-blob'})}
+    
+    @patch('handler.s3_client')
+    @patch('handler.kms_client')
+    def test_kms_container_skips_base64_guessing(self, mock_kms, mock_s3):
+        """Test that a KMS container's ciphertext is passed to KMS as-is."""
+        stored = blob_format.pack_blob(blob_format.ALG_AWS_KMS, b'', b'QUJD')
+        mock_s3.get_object.return_value = {'Body': Mock(read=lambda: stored)}
+        mock_kms.decrypt.return_value = {'Plaintext': b'Hello, World!'}
+        
+        result = lambda_handler(self.event, None)
+        
+        self.assertEqual(json.loads(result['body'])['plaintext'], 'Hello, World!')
+        mock_kms.decrypt.assert_called_once_with(CiphertextBlob=b'QUJD', KeyId='test-key-id')
+    
+    @patch('handler.s3_client')
+    @patch('handler.kms_client')
+    def test_client_side_container_is_rejected(self, mock_kms, mock_s3):
+        """Test that SDK blobs encrypted with a client key are not sent to KMS."""
+        stored = blob_format.pack_blob(blob_format.ALG_AES_256_GCM, b'i' * 12, b'ciphertext')
+        mock_s3.get_object.return_value = {'Body': Mock(read=lambda: stored)}
+        
+        result = lambda_handler(self.event, None)
+        
+        self.assertEqual(result['statusCode'], 400)
+        self.assertIn('not encrypted with KMS', result['body'])
+        mock_kms.decrypt.assert_not_called()
+
+class TestMetrics(unittest.TestCase):
+    """Test cases for structured per-phase metrics."""
+    
+    def setUp(self):
+        """Set up test environment."""
+        os.environ['S3_BUCKET'] = 'test-bucket'
+        os.environ['KMS_KEY_ID'] = 'test-key-id'
+        self.event = {'httpMethod': 'POST', 'body': json.dumps({'blobKey': 'secret-key-name'})}
+    
+    def _invoke(self, event):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            result = lambda_handler(event, None)
+        return result, [json.loads(line) for line in output.getvalue().splitlines()]
+    
+    @patch('handler.s3_client')
+    @patch('handler.kms_client')
+    def test_emits_emf_record_with_phases(self, mock_kms, mock_s3):
+        """Test that one EMF record carries phase timings and byte counts."""
+        mock_s3.get_object.return_value = {'Body': Mock(read=lambda: b'encrypted-data')}
+        mock_kms.decrypt.return_value = {'Plaintext': b'Top secret plaintext'}
+        
+        result, records = self._invoke(self.event)
+        
+        self.assertEqual(result['statusCode'], 200)
+        emf = [record for record in records if '_aws' in record]
+        self.assertEqual(len(emf), 1)
+        record = emf[0]
+        declared = {m['Name'] for m in record['_aws']['CloudWatchMetrics'][0]['Metrics']}
+        for name in ('ParseMs', 'S3GetMs', 'KmsDecryptMs', 'SerializeMs', 'TotalMs',
+                     'S3GetBytes', 'PlaintextBytes', 'ResponseBytes'):
+            self.assertIn(name, declared)
+            self.assertIn(name, record)
+        self.assertEqual(record['Handler'], 'handler')
+        self.assertEqual(record['Route'], 'decrypt')
+        self.assertEqual(record['StatusCode'], 200)
+        self.assertIn('ColdStart', record)
+    
+    @patch('handler.s3_client')
+    @patch('handler.kms_client')
+    def test_never_logs_payloads(self, mock_kms, mock_s3):
+        """Test that plaintext, ciphertext and keys stay out of the logs."""
+        from botocore.exceptions import ClientError
+        
+        mock_s3.get_object.return_value = {'Body': Mock(read=lambda: b'encrypted-data')}
+        mock_kms.decrypt.side_effect = ClientError({'Error': {'Code': 'KMSInternalException'}}, 'Decrypt')
+        
+        output = io.StringIO()
+        with redirect_stdout(output):
+            lambda_handler(self.event, None)
+            mock_kms.decrypt.side_effect = None
+            mock_kms.decrypt.return_value = {'Plaintext': b'Top secret plaintext'}
+            lambda_handler(self.event, None)
+        
+        self.assertNotIn('Top secret', output.getvalue())
+        self.assertNotIn('encrypted-data', output.getvalue())
+        self.assertNotIn('secret-key-name', output.getvalue())
+    
+    def test_sampling_skips_warm_invocations(self):
+        """Test that METRICS_SAMPLE_RATE=0 suppresses warm records."""
+        with patch.dict(os.environ, {'METRICS_SAMPLE_RATE': '0'}):
+            lambda_handler({'httpMethod': 'OPTIONS'}, None)
+            _, records = self._invoke({'httpMethod': 'OPTIONS'})
+        
+        self.assertEqual(records, [])
+
+class TestWarmup(unittest.TestCase):
+    """Test cases for warm-up events."""
+    
+    def setUp(self):
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'bench'))
+        from fakes import FakeKMS, FakeS3
+        self.s3, self.kms = FakeS3(), FakeKMS()
+        self.s3.put('test-bucket', 'hot-blob', blob_format.pack_blob(
+            blob_format.ALG_AWS_KMS, b'', FakeKMS.encrypt(b'Hot transcript')
+        ))
+        cache = ResultCache(max_bytes=1024 * 1024, ttl_seconds=60)
+        for p in (patch.dict(os.environ, {'S3_BUCKET': 'test-bucket', 'KMS_KEY_ID': 'test-key-id'}),
+                  patch('handler.s3_client', self.s3),
+                  patch('handler.kms_client', self.kms),
+                  patch('handler.result_cache', cache),
+                  redirect_stdout(io.StringIO())):
+            p.__enter__()
+            self.addCleanup(p.__exit__, None, None, None)
+    
+    def test_warmup_opens_connections_and_reports(self):
+        """Test that a warm-up probes S3 and KMS instead of running the request path."""
+        with patch.dict(os.environ, {'WARMUP_CONNECTIONS': '3'}):
+            result = lambda_handler({'warmup': True}, None)
+        
+        self.assertEqual(result['statusCode'], 200)
+        report = json.loads(result['body'])
+        self.assertTrue(report['warmup'])
+        self.assertEqual(report['missingConfig'], [])
+        self.assertEqual(set(report['connections']), {'s3', 'kms'})
+        self.assertTrue(all(c['ok'] and c['connections'] == 3 for c in report['connections'].values()))
+        # The S3 probe key does not exist; the 404 still proves a live connection
+        self.assertEqual(self.s3.calls, {'HeadObject': 3})
+        self.assertEqual(self.kms.calls, {'DescribeKey': 3})
+    
+    def test_warmup_prefetches_hot_blobs(self):
+        """Test that prefetched blobs are then served without any AWS call."""
+        result = lambda_handler({'warmup': True, 'prefetchKeys': ['hot-blob', 'missing']}, None)
+        calls = (dict(self.s3.calls), dict(self.kms.calls))
+        served = lambda_handler({'httpMethod': 'POST', 'body': json.dumps({'blobKey': 'hot-blob'})}, None)
+        
+        report = json.loads(result['body'])
+        self.assertEqual((report['prefetched'], report['prefetchRequested']), (1, 2))
+        self.assertEqual(json.loads(served['body'])['plaintext'], 'Hot transcript')
+        self.assertEqual((self.s3.calls, self.kms.calls), calls)
+    
+    def test_warmup_without_result_cache_only_unwraps_data_keys(self):
+        """Test that with nothing to hold plaintext, prefetch spends KMS only on envelope data keys."""
+        self.s3.put('test-bucket', 'envelope-blob', envelope.encrypt_envelope(b'Hot audio', self.kms, 'test-key-id'))
+        self.kms.calls.clear()
+        keys = ['hot-blob', 'envelope-blob']
+        with patch('handler.result_cache', ResultCache(max_bytes=0, ttl_seconds=60)), \
+                patch('handler.data_key_cache', envelope.DataKeyCache()):
+            report = json.loads(lambda_handler({'warmup': True, 'prefetchKeys': keys}, None)['body'])
+            # The KMS ciphertext blob was not decrypted only to be thrown away
+            self.assertEqual((report['prefetched'], self.kms.calls['Decrypt']), (1, 1))
+            
+            self.kms.calls.clear()
+            served = lambda_handler({'httpMethod': 'POST', 'body': json.dumps({'blobKey': 'envelope-blob'})}, None)
+        
+        self.assertEqual(json.loads(served['body'])['plaintext'], 'Hot audio')
+        self.assertNotIn('Decrypt', self.kms.calls)
+    
+    def test_scheduled_events_are_warmups(self):
+        """Test EventBridge pings are recognized while API requests never are."""
+        scheduled = lambda_handler({'source': 'aws.events', 'detail-type': 'Scheduled Event'}, None)
+        request = lambda_handler({'httpMethod': 'POST', 'warmup': True}, None)
+        
+        self.assertTrue(json.loads(scheduled['body'])['warmup'])
+        self.assertEqual(request['statusCode'], 400)
+    
+    def test_missing_config_is_reported(self):
+        """Test that a warm-up surfaces missing environment configuration."""
+        with patch.dict(os.environ, {'KMS_KEY_ID': ''}):
+            report = json.loads(lambda_handler({'warmup': True}, None)['body'])
+        
+        self.assertEqual(report['missingConfig'], ['KMS_KEY_ID'])
+
+class TestKmsThrottling(unittest.TestCase):
+    """Test cases for the KMS rate limiter, adaptive retry and circuit breaker."""
+    
+    def setUp(self):
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'bench'))
+        from fakes import FakeKMS, FakeS3
+        self.now = [0.0]
+        clock = lambda: self.now[0]
+        self.kms = FakeKMS(error_rate=1.0, error_code='ThrottlingException')
+        self.s3 = FakeS3()
+        self.s3.put('test-bucket', 'blob', blob_format.pack_blob(
+            blob_format.ALG_AWS_KMS, b'', FakeKMS.encrypt(b'Secret')
+        ))
+        self.guard = throttle.KmsGuard(
+            throttle.TokenBucket(100, 10, clock=clock), throttle.CircuitBreaker(3, 5, clock=clock),
+            max_attempts=3, sleep=lambda _: None
+        )
+        for p in (patch.dict(os.environ, {'S3_BUCKET': 'test-bucket', 'KMS_KEY_ID': 'test-key-id'}),
+                  patch('handler.s3_client', self.s3),
+                  patch('handler.kms_client', self.kms),
+                  patch('handler.kms_guard', self.guard)):
+            p.__enter__()
+            self.addCleanup(p.__exit__, None, None, None)
+    
+    def _invoke(self):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            result = lambda_handler({'httpMethod': 'POST', 'body': json.dumps({'blobKey': 'blob'})}, None)
+        emf = [json.loads(line) for line in output.getvalue().splitlines() if '_aws' in line]
+        return result, emf[-1]
+    
+    def test_sustained_throttling_returns_429_and_opens_breaker(self):
+        """Test retries stop at the attempt limit with a 429, Retry-After and throttle metrics."""
+        result, emf = self._invoke()
+        
+        self.assertEqual(result['statusCode'], 429)
+        self.assertEqual(result['headers']['Retry-After'], '5')
+        self.assertEqual(self.kms.calls['Decrypt'], 3)
+        self.assertEqual(emf['KmsThrottles'], 3)
+        self.assertEqual(emf['KmsRetries'], 2)
+        self.assertEqual(emf['KmsBreakerState'], 'open')
+        # Each throttle halved the rate
+        self.assertEqual(emf['KmsRateLimit'], 12.5)
+    
+    def test_open_breaker_fails_fast_until_probe_succeeds(self):
+        """Test that an open breaker makes no KMS calls, then closes after a successful probe."""
+        self._invoke()
+        calls = self.kms.calls['Decrypt']
+        
+        rejected, emf = self._invoke()
+        self.now[0] += 5
+        self.kms.error_rate = 0.0
+        recovered, after = self._invoke()
+        
+        self.assertEqual(rejected['statusCode'], 429)
+        self.assertEqual(emf['KmsBreakerRejections'], 1)
+        self.assertEqual(self.kms.calls['Decrypt'], calls + 1)
+        self.assertEqual(json.loads(recovered['body'])['plaintext'], 'Secret')
+        self.assertEqual(after['KmsBreakerState'], 'closed')
+    
+    def test_transient_throttle_is_retried(self):
+        """Test that a single throttle is absorbed by a jittered retry."""
+        from botocore.exceptions import ClientError
+        throttled = ClientError({'Error': {'Code': 'ThrottlingException'}}, 'Decrypt')
+        
+        with patch.object(self.kms, 'decrypt', side_effect=[throttled, {'Plaintext': b'Secret'}]):
+            result, emf = self._invoke()
+        
+        self.assertEqual(result['statusCode'], 200)
+        self.assertEqual((emf['KmsThrottles'], emf['KmsRetries']), (1, 1))
+        self.assertEqual(emf['KmsBreakerState'], 'closed')
+    
+    def test_token_bucket_sheds_bursts_beyond_quota(self):
+        """Test that calls beyond the local rate fail fast rather than queueing."""
+        bucket = throttle.TokenBucket(rate=2, burst=2, clock=lambda: self.now[0], sleep=lambda _: None)
+        
+        self.assertEqual([bucket.acquire(max_wait=0.5) for _ in range(4)], [True, True, True, False])
+        self.now[0] += 1
+        self.assertTrue(bucket.acquire(max_wait=0))
+    
+    def test_rate_limit_is_off_unless_configured(self):
+        """Test the token bucket only exists with an explicit or quota-derived rate."""
+        for env, rate in (({}, None), ({'KMS_RATE_LIMIT': '40'}, 40),
+                          ({'KMS_ACCOUNT_QUOTA': '1000', 'KMS_CONTAINERS': '8'}, 125)):
+            with patch.dict(os.environ, env):
+                for name in ('KMS_RATE_LIMIT', 'KMS_ACCOUNT_QUOTA'):
+                    if name not in env:
+                        os.environ.pop(name, None)
+                guard = throttle.KmsGuard.from_env()
+            
+            self.assertEqual(guard.bucket and guard.bucket.rate, rate)
+        
+        # Without the bucket, throttles are still retried and reported
+        self.guard.bucket = None
+        result, emf = self._invoke()
+        self.assertEqual((result['statusCode'], emf['KmsRetries']), (429, 2))
+        self.assertNotIn('KmsRateLimit', emf)
+
+class TestResponseEncoding(unittest.TestCase):
+    """Test cases for binary plaintext responses and compression negotiation."""
+
+    def setUp(self):
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'bench'))
+        from fakes import FakeKMS, FakeS3
+        self.audio = bytes(range(256)) * 8
+        self.transcript = 'speaker: "hello"\n' * 1000
+        s3 = FakeS3()
+        for key, plaintext in (('audio', self.audio), ('transcript', self.transcript.encode('utf-8')),
+                               ('short', b'hi')):
+            s3.put('test-bucket', key, blob_format.pack_blob(blob_format.ALG_AWS_KMS, b'', FakeKMS.encrypt(plaintext)))
+        for p in (patch.dict(os.environ, {'S3_BUCKET': 'test-bucket', 'KMS_KEY_ID': 'test-key-id'}),
+                  patch('handler.s3_client', s3),
+                  patch('handler.kms_client', FakeKMS())):
+            p.__enter__()
+            self.addCleanup(p.__exit__, None, None, None)
+
+    def _invoke(self, body, **headers):
+        with redirect_stdout(io.StringIO()):
+            return lambda_handler({'httpMethod': 'POST', 'headers': headers, 'body': json.dumps(body)}, None)
+
+    def test_response_bytes_are_counted_once(self):
+        """Test the ResponseBytes metric is the size of the body sent, recorded once per invocation."""
+        out = io.StringIO()
+        with redirect_stdout(out):
+            result = lambda_handler({'httpMethod': 'POST', 'headers': {'Accept-Encoding': 'gzip'},
+                                     'body': json.dumps({'blobKey': 'transcript'})}, None)
+        emf = [json.loads(line) for line in out.getvalue().splitlines() if '"_aws"' in line]
+
+        self.assertEqual(result['headers']['Content-Encoding'], 'gzip')
+        self.assertEqual(emf[0]['ResponseBytes'], len(result['body']))
+
+    def test_binary_plaintext_is_returned_as_bytes(self):
+        """Test Accept: application/octet-stream returns raw bytes that are not valid UTF-8."""
+        result = self._invoke({'blobKey': 'audio'}, Accept='application/octet-stream')
+
+        self.assertEqual(result['statusCode'], 200)
+        self.assertTrue(result['isBase64Encoded'])
+        self.assertEqual(result['headers']['Content-Type'], 'application/octet-stream')
+        self.assertEqual(base64.b64decode(result['body']), self.audio)
+
+    def test_binary_plaintext_as_json_suggests_binary_mode(self):
+        """Test JSON mode still rejects non-text plaintext, pointing at the binary mode."""
+        result = self._invoke({'blobKey': 'audio'})
+
+        self.assertEqual(result['statusCode'], 400)
+        self.assertIn('application/octet-stream', json.loads(result['body'])['error'])
+
+    def test_gzip_when_accepted(self):
+        """Test large JSON responses are gzipped for clients that accept it."""
+        import gzip
+        result = self._invoke({'blobKey': 'transcript'}, **{'Accept-Encoding': 'gzip, deflate, br'})
+
+        self.assertEqual(result['headers']['Content-Encoding'], 'gzip')
+        self.assertTrue(result['isBase64Encoded'])
+        compressed = base64.b64decode(result['body'])
+        self.assertLess(len(compressed), len(self.transcript) // 10)
+        self.assertEqual(json.loads(gzip.decompress(compressed))['plaintext'], self.transcript)
+
+    def test_compressed_binary_and_batch_responses(self):
+        """Test compression also applies to binary bodies and batch results."""
+        import gzip
+        binary = self._invoke({'blobKey': 'transcript'}, Accept='application/octet-stream',
+                              **{'accept-encoding': 'gzip'})
+        batch = self._invoke({'blobKeys': ['transcript', 'short']}, **{'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(gzip.decompress(base64.b64decode(binary['body'])), self.transcript.encode('utf-8'))
+        results = json.loads(gzip.decompress(base64.b64decode(batch['body'])))['results']
+        self.assertEqual([r['statusCode'] for r in results], [200, 200])
+
+    def test_small_or_unaccepted_bodies_are_not_compressed(self):
+        """Test identity responses for small bodies, no Accept-Encoding, q=0 or unknown codings."""
+        self.assertNotIn('Content-Encoding', self._invoke({'blobKey': 'short'}, **{'Accept-Encoding': 'gzip'})['headers'])
+        plain = self._invoke({'blobKey': 'transcript'})
+        self.assertNotIn('isBase64Encoded', plain)
+        self.assertEqual(json.loads(plain['body'])['plaintext'], self.transcript)
+        for value in ('gzip;q=0', 'br', 'identity'):
+            self.assertNotIn('Content-Encoding', self._invoke({'blobKey': 'transcript'}, **{'Accept-Encoding': value})['headers'])
+        with patch.dict(os.environ, {'RESPONSE_COMPRESSION': 'off'}):
+            self.assertNotIn('Content-Encoding', self._invoke({'blobKey': 'transcript'}, **{'Accept-Encoding': 'gzip'})['headers'])
+
+    def test_negotiation_prefers_zstd_and_honours_weights(self):
+        """Test zstd wins ties when available and q-values decide otherwise."""
+        with patch('content_coding.available', return_value=['zstd', 'gzip']):
+            self.assertEqual(content_coding.negotiate('gzip, zstd'), 'zstd')
+            self.assertEqual(content_coding.negotiate('zstd;q=0.5, gzip'), 'gzip')
+            self.assertEqual(content_coding.negotiate('*'), 'zstd')
+            self.assertIsNone(content_coding.negotiate('*;q=0'))
+        with patch('content_coding.available', return_value=['gzip']):
+            self.assertIsNone(content_coding.negotiate('zstd'))
+
+class LambdaContext:
+    """Context stand-in reporting a fixed remaining time from its creation."""
+
+    def __init__(self, remaining_ms):
+        self._expires = time.monotonic() + remaining_ms / 1000
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._expires - time.monotonic()) * 1000))
+
+
+class TestDeadlines(unittest.TestCase):
+    """Test cases for deadline-bounded S3 and KMS calls."""
+
+    def setUp(self):
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'bench'))
+        from fakes import FakeKMS, FakeS3
+        self.s3 = FakeS3()
+        for key in ('blob', 'other'):
+            self.s3.put('test-bucket', key, blob_format.pack_blob(blob_format.ALG_AWS_KMS, b'', FakeKMS.encrypt(b'Secret')))
+        self.kms = FakeKMS()
+        for p in (patch.dict(os.environ, {'S3_BUCKET': 'test-bucket', 'KMS_KEY_ID': 'test-key-id',
+                                          'DEADLINE_SAFETY_MARGIN_MS': '500'}),
+                  patch('handler.s3_client', deadline.BoundedClient(self.s3)),
+                  patch('handler.kms_client', deadline.BoundedClient(self.kms))):
+            p.__enter__()
+            self.addCleanup(p.__exit__, None, None, None)
+
+    def _invoke(self, body, remaining_ms):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            result = lambda_handler({'httpMethod': 'POST', 'body': json.dumps(body)}, LambdaContext(remaining_ms))
+        emf = [json.loads(line) for line in output.getvalue().splitlines() if '_aws' in line]
+        return result, emf[-1]
+
+    def test_calls_within_the_deadline_succeed(self):
+        """Test bounded calls return normally when there is time left."""
+        result, emf = self._invoke({'blobKey': 'blob'}, 5000)
+
+        self.assertEqual(result['statusCode'], 200)
+        self.assertEqual(json.loads(result['body'])['plaintext'], 'Secret')
+        self.assertGreater(emf['DeadlineBudgetMs'], 4000)
+        self.assertNotIn('DeadlineTimeouts', emf)
+
+    def test_slow_call_times_out_with_504(self):
+        """Test a call still running at the deadline is abandoned and answered with a 504."""
+        self.s3.latency_ms = 1000
+        started = time.perf_counter()
+        result, emf = self._invoke({'blobKey': 'blob'}, 600)
+
+        self.assertLess(time.perf_counter() - started, 0.5)
+        self.assertEqual(result['statusCode'], 504)
+        self.assertIn('Access-Control-Allow-Origin', result['headers'])
+        self.assertEqual(emf['DeadlineTimeouts'], 1)
+        self.assertNotIn('Decrypt', self.kms.calls)
+
+    def test_request_without_time_left_is_shed(self):
+        """Test a request arriving inside the safety margin gets a 503 without any AWS call."""
+        result, emf = self._invoke({'blobKey': 'blob'}, 300)
+
+        self.assertEqual(result['statusCode'], 503)
+        self.assertEqual(emf['DeadlineShed'], 1)
+        self.assertEqual(self.s3.calls, {})
+
+    def test_batch_items_report_the_deadline(self):
+        """Test batch items that run out of time get their own 504/503 results."""
+        self.s3.latency_ms = 1000
+        result, _ = self._invoke({'blobKeys': ['blob', 'other']}, 600)
+
+        self.assertEqual(result['statusCode'], 200)
+        for item in json.loads(result['body'])['results']:
+            self.assertIn(item['statusCode'], (503, 504))
+
+    def test_kms_backoff_stops_at_the_deadline(self):
+        """Test KmsGuard does not sleep a retry backoff past the deadline."""
+        sleeps = []
+        guard = throttle.KmsGuard(throttle.TokenBucket(100, 10), throttle.CircuitBreaker(100, 5),
+                                  max_attempts=4, backoff_base=10, backoff_max=10, sleep=sleeps.append,
+                                  rng=Mock(uniform=lambda low, high: high))
+        self.kms.error_rate, self.kms.error_code = 1.0, 'ThrottlingException'
+        with patch('handler.kms_guard', guard):
+            result, emf = self._invoke({'blobKey': 'blob'}, 1500)
+
+        self.assertEqual(result['statusCode'], 503)
+        self.assertEqual(self.kms.calls['Decrypt'], 1)
+        self.assertEqual(sleeps, [])
+        self.assertEqual(emf['DeadlineShed'], 1)
+
+    def test_no_context_runs_calls_directly(self):
+        """Test calls outside an invocation deadline are made on the caller's thread."""
+        self.assertIsNone(deadline.remaining_ms())
+        thread = deadline.call(lambda: threading.current_thread())
+        self.assertIs(thread, threading.current_thread())
+
+class TestSegmentReads(unittest.TestCase):
+    """Test cases for decrypting blobs compacted into segment objects."""
+
+    def setUp(self):
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'bench'))
+        from fakes import FakeKMS, FakeS3
+        self.s3 = FakeS3()
+        self.keys = [f'ab/turn-{i}' for i in range(6)]
+        for i, key in enumerate(self.keys):
+            self.s3.put('test-bucket', key, blob_format.pack_blob(blob_format.ALG_AWS_KMS, b'', FakeKMS.encrypt(f'turn {i}'.encode())))
+        self.s3.put('test-bucket', 'ab/loose', blob_format.pack_blob(blob_format.ALG_AWS_KMS, b'', FakeKMS.encrypt(b'loose')))
+        with redirect_stdout(io.StringIO()):
+            self.report, _ = segments.compact(self.s3, 'test-bucket', self.keys, max_segment_bytes=100)
+        self.index = segments.SegmentIndex()
+        for p in (patch.dict(os.environ, {'S3_BUCKET': 'test-bucket', 'KMS_KEY_ID': 'test-key-id'}),
+                  patch('handler.s3_client', self.s3),
+                  patch('handler.kms_client', FakeKMS()),
+                  patch('handler.segment_index', self.index)):
+            p.__enter__()
+            self.addCleanup(p.__exit__, None, None, None)
+        self.s3.calls.clear()
+
+    def _invoke(self, body):
+        with redirect_stdout(io.StringIO()):
+            result = lambda_handler({'httpMethod': 'POST', 'body': json.dumps(body)}, None)
+        return json.loads(result['body'])
+
+    def test_pack_and_footer_round_trip(self):
+        """Test a segment's footer locates every blob's bytes."""
+        data, _ = segments.pack([('a', b'first', 'binary/octet-stream', '"1"'), ('b', b'second', 'x/y', '"2"')])
+        locations = segments.parse_footer(data, 'segments/s')
+
+        self.assertEqual(data[locations['b'].offset:locations['b'].offset + locations['b'].length], b'second')
+        self.assertEqual((locations['b'].content_type, locations['b'].etag), ('x/y', '"2"'))
+        with self.assertRaises(segments.SegmentFormatError):
+            segments.parse_footer(b'not a segment at all', 'segments/s')
+
+    def test_session_batch_reads_segments_in_a_few_requests(self):
+        """Test a cold batch over a compacted session probes once per segment and reads each with one GET."""
+        segment_count = len(self.report['segments'])
+        self.assertGreater(segment_count, 1)
+
+        with patch('handler.SEGMENT_BATCH_PROBE', 'true'):
+            body = self._invoke({'blobKeys': self.keys + ['ab/loose']})
+
+        self.assertEqual([r['plaintext'] for r in body['results']], [f'turn {i}' for i in range(6)] + ['loose'])
+        self.assertEqual(self.s3.calls['HeadObject'], segment_count + 1)
+        # One footer, one ledger and one ranged read per segment, plus the loose blob
+        self.assertEqual(self.s3.calls['GetObject'], 3 * segment_count + 1)
+
+        self.s3.calls.clear()
+        self._invoke({'blobKeys': self.keys})
+        self.assertEqual(self.s3.calls, {'GetObject': segment_count})
+
+    def test_single_blob_through_pointer_and_index(self):
+        """Test a cold decrypt follows the pointer and loads the segment's index for its neighbours."""
+        self.assertEqual(self._invoke({'blobKey': self.keys[4]})['plaintext'], 'turn 4')
+        # Pointer, footer, ledger and the ranged read
+        self.assertEqual(self.s3.calls, {'GetObject': 4})
+
+        neighbours = [i for i, key in enumerate(self.keys) if self.index.locate(key) is not None]
+        self.assertGreater(len(neighbours), 1)
+        self.s3.calls.clear()
+        for i in neighbours:
+            self.assertEqual(self._invoke({'blobKey': self.keys[i]})['plaintext'], f'turn {i}')
+        self.assertEqual(self.s3.calls, {'GetObject': len(neighbours)})
+
+    def test_uncompacted_batch_stops_probing(self):
+        """Test a batch of ordinary blobs costs a single probe."""
+        self.s3.put('test-bucket', 'ab/other', blob_format.pack_blob(blob_format.ALG_AWS_KMS, b'', b'FAKEKMS1other'))
+
+        with patch('handler.SEGMENT_BATCH_PROBE', 'true'):
+            body = self._invoke({'blobKeys': ['ab/loose', 'ab/other', 'ab/missing']})
+
+        self.assertEqual([r['statusCode'] for r in body['results']], [200, 200, 404])
+        self.assertEqual(self.s3.calls['HeadObject'], 1)
+
+    def test_batches_probe_only_once_a_segment_was_read(self):
+        """Test a container that never met a segment reads batches without HeadObject probes."""
+        body = self._invoke({'blobKeys': ['ab/loose'] + self.keys[:2]})
+
+        self.assertEqual([r['plaintext'] for r in body['results']], ['loose', 'turn 0', 'turn 1'])
+        self.assertNotIn('HeadObject', self.s3.calls)
+        # Following those pointers loaded their segments, so later batches probe
+        self.assertGreater(self.index.loads, 0)
+        self.s3.calls.clear()
+        self._invoke({'blobKeys': self.keys})
+        self.assertIn('HeadObject', self.s3.calls)
+
+    def test_neighbouring_blobs_are_coalesced(self):
+        """Test read_many joins close blobs of one segment and splits runs across large gaps."""
+        data, index = segments.pack([(key, bytes(100), 'binary/octet-stream', '"e"') for key in 'abcd'])
+        self.s3.put('test-bucket', 'segments/x', data)
+        locations = {key: segments.Location('segments/x', *index[key]) for key in 'abd'}
+
+        blobs = segments.read_many(self.s3, 'test-bucket', locations, max_gap=100)
+        self.assertEqual(sorted(blobs), ['a', 'b', 'd'])
+        self.assertEqual(self.s3.calls['GetObject'], 1)
+        segments.read_many(self.s3, 'test-bucket', locations, max_gap=50)
+        self.assertEqual(self.s3.calls['GetObject'], 3)
+
+class TrackingS3:
+    """Wraps a fake S3 and keeps every GetObject body it hands out."""
+
+    def __init__(self, s3):
+        self.s3 = s3
+        self.bodies = []
+
+    def get_object(self, **kwargs):
+        response = self.s3.get_object(**kwargs)
+        self.bodies.append(response['Body'])
+        return response
+
+class TestHedgedReads(unittest.TestCase):
+    """Test cases for hedged, replica-aware S3 blob reads."""
+
+    def setUp(self):
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'bench'))
+        from fakes import FakeKMS, FakeS3
+        blob = blob_format.pack_blob(blob_format.ALG_AWS_KMS, b'', FakeKMS.encrypt(b'Secret'))
+        self.slow = TrackingS3(FakeS3(tail_rate=1.0, tail_ms=300))
+        self.slow.s3.put('test-bucket', 'blob', blob)
+        self.replica = FakeS3()
+        self.replica.put('replica-bucket', 'blob', blob)
+        self.reader = hedging.HedgedReader(enabled=True, initial_delay_ms=20, replica_bucket='replica-bucket',
+                                           replica_client=self.replica)
+        self.addCleanup(self.reader._executor.shutdown)
+        for p in (patch.dict(os.environ, {'S3_BUCKET': 'test-bucket', 'KMS_KEY_ID': 'test-key-id'}),
+                  patch('handler.s3_client', self.slow),
+                  patch('handler.kms_client', FakeKMS()),
+                  patch('handler.s3_reads', self.reader)):
+            p.__enter__()
+            self.addCleanup(p.__exit__, None, None, None)
+
+    def _invoke(self):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            result = lambda_handler({'httpMethod': 'POST', 'body': json.dumps({'blobKey': 'blob'})}, None)
+        emf = [json.loads(line) for line in output.getvalue().splitlines() if '_aws' in line]
+        return result, emf[-1]
+
+    def test_replica_client_is_bounded_by_the_deadline(self):
+        """Test the replica client from the environment runs its calls under the invocation deadline."""
+        with patch.dict(os.environ, {'S3_REPLICA_REGION': 'us-west-2', 'S3_REPLICA_BUCKET': 'replica-bucket'}):
+            reader = hedging.HedgedReader.from_env()
+        self.addCleanup(reader._executor.shutdown)
+
+        self.assertIsInstance(reader.replica_client, deadline.BoundedClient)
+
+    def test_slow_primary_is_hedged_to_replica(self):
+        """Test a GET past the deadline is raced against the replica, whose answer is used."""
+        started = time.perf_counter()
+        result, emf = self._invoke()
+
+        self.assertEqual(result['statusCode'], 200)
+        self.assertEqual(json.loads(result['body'])['plaintext'], 'Secret')
+        self.assertLess(time.perf_counter() - started, 0.25)
+        self.assertEqual(self.replica.calls['GetObject'], 1)
+        self.assertEqual((emf['S3HedgesFired'], emf['S3HedgesWon']), (1, 1))
+        self.assertEqual((self.reader.fired, self.reader.won), (1, 1))
+
+        # The losing primary has its body closed without being read
+        self.reader._executor.shutdown(wait=True)
+        self.assertTrue(self.slow.bodies[0]._stream.closed)
+
+    def test_fast_primary_is_not_hedged(self):
+        """Test reads within the deadline send one GET and feed the latency window."""
+        self.slow.s3.tail_rate = 0.0
+        result, emf = self._invoke()
+
+        self.assertEqual(result['statusCode'], 200)
+        self.assertNotIn('S3HedgesFired', emf)
+        self.assertNotIn('GetObject', self.replica.calls)
+        self.assertEqual(len(self.reader.latencies._samples), 1)
+
+    def test_hedge_error_leaves_primary_to_finish(self):
+        """Test a replica that has not caught up does not fail the read."""
+        self.replica.objects.clear()
+        result, emf = self._invoke()
+
+        self.assertEqual(result['statusCode'], 200)
+        self.assertEqual((emf['S3HedgesFired'], emf.get('S3HedgesWon', 0)), (1, 0))
+
+    def test_primary_error_is_returned(self):
+        """Test an error answered by the primary within the deadline maps to 404 without a hedge."""
+        self.slow.s3.tail_rate = 0.0
+        self.slow.s3.objects.clear()
+        result, emf = self._invoke()
+
+        self.assertEqual(result['statusCode'], 404)
+        self.assertNotIn('S3HedgesFired', emf)
+        self.assertNotIn('GetObject', self.replica.calls)
+
+    def test_deadline_follows_latency_percentile(self):
+        """Test the deadline uses the initial delay, then the clamped percentile of recent reads."""
+        reader = hedging.HedgedReader(percentile=90, initial_delay_ms=100, min_delay_ms=10,
+                                      max_delay_ms=50, min_samples=10)
+        self.assertEqual(reader.delay_ms(), 100)
+        for ms in range(1, 11):
+            reader.latencies.record(ms)
+        self.assertEqual(reader.delay_ms(), 10)
+        for ms in range(100, 110):
+            reader.latencies.record(ms)
+        self.assertEqual(reader.delay_ms(), 50)
+        reader._executor.shutdown()
+
+class TestMemoryProfiling(unittest.TestCase):
+    """Test cases for the opt-in per-invocation memory profile."""
+
+    def setUp(self):
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'bench'))
+        from fakes import FakeKMS, FakeS3
+        self.s3 = FakeS3()
+        self.s3.put('test-bucket', 'blob', blob_format.pack_blob(
+            blob_format.ALG_AWS_KMS, b'', FakeKMS.encrypt(b'x' * 65536)
+        ))
+        for p in (patch.dict(os.environ, {'S3_BUCKET': 'test-bucket', 'KMS_KEY_ID': 'test-key-id'}),
+                  patch('handler.s3_client', self.s3),
+                  patch('handler.kms_client', FakeKMS())):
+            p.__enter__()
+            self.addCleanup(p.__exit__, None, None, None)
+
+    def _invoke(self, mode, headers=None):
+        output = io.StringIO()
+        with patch.dict(os.environ, {'PROFILE_MEMORY': mode}), redirect_stdout(output):
+            result = lambda_handler({'httpMethod': 'POST', 'headers': headers or {},
+                                     'body': json.dumps({'blobKey': 'blob'})}, None)
+        lines = [json.loads(line) for line in output.getvalue().splitlines() if line.startswith('{')]
+        profiles = [line['memoryProfile'] for line in lines if 'memoryProfile' in line]
+        emf = [line for line in lines if '_aws' in line]
+        return result, profiles, emf[-1] if emf else None
+
+    def test_profile_reports_peaks_and_allocation_sites(self):
+        """Test an enabled profile reports RSS, tracemalloc peak, top sites and metrics."""
+        result, profiles, emf = self._invoke('on')
+
+        self.assertEqual(result['statusCode'], 200)
+        self.assertEqual(len(profiles), 1)
+        profile = profiles[0]
+        self.assertEqual(profile['handler'], 'handler')
+        self.assertGreater(profile['tracemallocPeakBytes'], 65536)
+        self.assertGreater(profile['peakRssMb'], 0)
+        self.assertEqual(profile['payloadBytes'], len(result['body']))
+        self.assertGreater(profile['peakToPayload'], 0)
+        self.assertTrue(profile['topAllocations'])
+        self.assertNotIn('profiling.py', ' '.join(site['site'] for site in profile['topAllocations']))
+        self.assertEqual(emf['TracemallocPeakBytes'], profile['tracemallocPeakBytes'])
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_header_mode_profiles_only_flagged_requests(self):
+        """Test PROFILE_MEMORY=header profiles just the requests sending X-Profile-Memory."""
+        self.assertEqual(self._invoke('header')[1], [])
+        self.assertEqual(len(self._invoke('header', {'x-profile-memory': '1'})[1]), 1)
+        self.assertEqual(self._invoke('off', {'X-Profile-Memory': '1'})[1], [])
+
+    def test_memory_sweep_recommends_a_lambda_size(self):
+        """Test the sweep fits peak RSS over sizes and rounds the recommendation to Lambda steps."""
+        import memory_sweep
+
+        self.assertEqual(memory_sweep.fit([(0, 40.0), (1024, 41.0), (2048, 42.0)]), (40.0, 1 / 1024))
+        self.assertEqual(memory_sweep.recommend(50, 1.5), 128)
+        self.assertEqual(memory_sweep.recommend(300, 1.5), 512)
+        self.assertEqual(memory_sweep.recommend(9000, 1.5), 10240)
+        self.assertEqual(memory_sweep.probe_sizes([1, 2, 3, 4, 100], 3), [1, 3, 100])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'sweep.json')
+            with redirect_stdout(io.StringIO()):
+                exit_code = memory_sweep.main(['--sizes', '1024,65536', '--requests', '1', '--output', output])
+            with open(output) as f:
+                report = json.load(f)
+
+        self.assertEqual(exit_code, 0)
+        self.assertEqual([m['payloadBytes'] for m in report['measurements']], [1024, 65536])
+        self.assertEqual(report['targetPayloadBytes'], 65536)
+        self.assertEqual(report['recommendedMemoryMb'] % 64, 0)
+
+class TestBenchmarkSuite(unittest.TestCase):
+    """Smoke test for the offline benchmark suite."""
+    
+    def test_benchmark_runs_offline_and_writes_results(self):
+        """Test a tiny sweep of every scenario against the fake backends."""
+        sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'bench'))
+        import run_bench
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'results.json')
+            with redirect_stdout(io.StringIO()):
+                exit_code = run_bench.main([
+                    '--sizes', '256', '--concurrency', '2', '--requests', '5',
+                    '--latency-ms', '0', '--jitter-ms', '0', '--output', output
+                ])
+            with open(output) as f:
+                report = json.load(f)
+        
+        self.assertEqual(exit_code, 0)
+        self.assertEqual({r['scenario'] for r in report['results']}, set(run_bench.SCENARIOS))
+        for result in report['results']:
+            self.assertEqual(result['errors'], 0)
+            self.assertLessEqual(result['p50Ms'], result['p99Ms'])
+            self.assertGreater(result['peakAllocBytes'], 0)
+
 class TestIntegrationScenarios(unittest.TestCase):
     """Integration test scenarios."""
     
@@ -272,6 +1599,22 @@ def run_tests():
     
     # Add test cases
     suite.addTests(loader.loadTestsFromTestCase(TestLambdaHandler))
+    suite.addTests(loader.loadTestsFromTestCase(TestBatchDecrypt))
+    suite.addTests(loader.loadTestsFromTestCase(TestEnvelopeDecrypt))
+    suite.addTests(loader.loadTestsFromTestCase(TestResultCache))
+    suite.addTests(loader.loadTestsFromTestCase(TestFramedDecrypt))
+    suite.addTests(loader.loadTestsFromTestCase(TestColdStart))
+    suite.addTests(loader.loadTestsFromTestCase(TestClientConfig))
+    suite.addTests(loader.loadTestsFromTestCase(TestBlobContainer))
+    suite.addTests(loader.loadTestsFromTestCase(TestMetrics))
+    suite.addTests(loader.loadTestsFromTestCase(TestWarmup))
+    suite.addTests(loader.loadTestsFromTestCase(TestKmsThrottling))
+    suite.addTests(loader.loadTestsFromTestCase(TestHedgedReads))
+    suite.addTests(loader.loadTestsFromTestCase(TestResponseEncoding))
+    suite.addTests(loader.loadTestsFromTestCase(TestDeadlines))
+    suite.addTests(loader.loadTestsFromTestCase(TestSegmentReads))
+    suite.addTests(loader.loadTestsFromTestCase(TestMemoryProfiling))
+    suite.addTests(loader.loadTestsFromTestCase(TestBenchmarkSuite))
     suite.addTests(loader.loadTestsFromTestCase(TestIntegrationScenarios))
     
     # Run tests
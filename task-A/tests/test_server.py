@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Test suite for the standalone asyncio HTTP server.
+"""
+
+import asyncio
+import base64
+import json
+import os
+import sys
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from unittest.mock import patch
+
+# Add the src and bench directories to the path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'bench'))
+
+import blob_format
+import handler
+import solacesdk_handler
+from fakes import FakeKMS, FakeS3
+from server import HandlerServer
+
+
+async def http_request(port, method, path, body=None, headers=None):
+    """Send one request on a new connection; returns (status, headers, body)."""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    payload = body.encode('utf-8') if body is not None else b''
+    head = f'{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(payload)}\r\n'
+    head += ''.join(f'{k}: {v}\r\n' for k, v in (headers or {}).items())
+    writer.write(head.encode('latin-1') + b'\r\n' + payload)
+    await writer.drain()
+
+    status_line = (await reader.readline()).decode('latin-1')
+    response_headers = {}
+    while True:
+        line = (await reader.readline()).decode('latin-1').strip()
+        if not line:
+            break
+        name, value = line.split(':', 1)
+        response_headers[name.strip()] = value.strip()
+    data = await reader.readexactly(int(response_headers['Content-Length']))
+    writer.close()
+    return int(status_line.split(' ')[1]), response_headers, data
+
+
+class TestHandlerServer(unittest.TestCase):
+    """Test cases for routing, read collapsing and load shedding."""
+
+    def setUp(self):
+        self.s3 = FakeS3(latency_ms=50)
+        self.kms = FakeKMS()
+        self.s3.put('test-bucket', 'secret', blob_format.pack_blob(
+            blob_format.ALG_AWS_KMS, b'', FakeKMS.encrypt(b'Secret message')
+        ))
+        patches = [
+            patch.dict(os.environ, {'S3_BUCKET': 'test-bucket', 'KMS_KEY_ID': 'test-key-id',
+                                    'METRICS_SAMPLE_RATE': '0'}),
+            patch.object(handler, 's3_client', self.s3),
+            patch.object(handler, 'kms_client', self.kms),
+            patch.object(solacesdk_handler, 's3', self.s3),
+            redirect_stdout(StringIO()),
+        ]
+        for p in patches:
+            p.__enter__()
+            self.addCleanup(p.__exit__, None, None, None)
+
+    def _decrypt_event(self, blob_key):
+        return {'httpMethod': 'POST', 'path': '/decrypt', 'headers': {},
+                'body': json.dumps({'blobKey': blob_key})}
+
+    def test_routes_requests_to_both_handlers_over_http(self):
+        """Test decrypt, upload and download round trips through the socket server."""
+        async def scenario():
+            app = HandlerServer(max_concurrency=4, max_queue=4)
+            server = await asyncio.start_server(app.handle_connection, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            try:
+                decrypted = await http_request(port, 'POST', '/decrypt', json.dumps({'blobKey': 'secret'}))
+                uploaded = await http_request(port, 'POST', '/upload', json.dumps({
+                    'iv': base64.b64encode(b'i' * 12).decode('ascii'),
+                    'ciphertext': base64.b64encode(b'cipher').decode('ascii')
+                }))
+                blob_key = json.loads(uploaded[2])['blobKey']
+                downloaded = await http_request(port, 'GET', f'/blob/{blob_key}',
+                                                headers={'Accept': blob_format.CONTENT_TYPE})
+                missing = await http_request(port, 'GET', '/nowhere')
+                return decrypted, uploaded, downloaded, missing
+            finally:
+                server.close()
+                await server.wait_closed()
+                app.close()
+
+        decrypted, uploaded, downloaded, missing = asyncio.run(scenario())
+
+        self.assertEqual(decrypted[0], 200)
+        self.assertEqual(json.loads(decrypted[2])['plaintext'], 'Secret message')
+        self.assertEqual(uploaded[0], 200)
+        # Base64 handler bodies are sent as raw bytes
+        self.assertEqual(downloaded[0], 200)
+        self.assertEqual(downloaded[1]['Content-Type'], blob_format.CONTENT_TYPE)
+        self.assertEqual(bytes(blob_format.parse_blob(downloaded[2]).ciphertext), b'cipher')
+        self.assertEqual(missing[0], 404)
+
+    def test_concurrent_identical_reads_share_one_backend_call(self):
+        """Test that identical in-flight decrypts are collapsed into one S3 read."""
+        async def scenario():
+            app = HandlerServer(max_concurrency=4, max_queue=4)
+            try:
+                return app, await asyncio.gather(*(
+                    app.handle_event(self._decrypt_event('secret')) for _ in range(5)
+                ))
+            finally:
+                app.close()
+
+        app, responses = asyncio.run(scenario())
+
+        self.assertEqual([r['statusCode'] for r in responses], [200] * 5)
+        self.assertEqual(self.s3.calls['GetObject'], 1)
+        self.assertEqual(app.stats()['collapsed'], 4)
+
+    def test_sheds_load_beyond_queue_depth(self):
+        """Test that requests beyond max_concurrency + max_queue get a 503."""
+        for index in range(3):
+            self.s3.put('test-bucket', f'blob-{index}', blob_format.pack_blob(
+                blob_format.ALG_AWS_KMS, b'', FakeKMS.encrypt(b'x')
+            ))
+
+        async def scenario():
+            app = HandlerServer(max_concurrency=1, max_queue=1)
+            try:
+                return app, await asyncio.gather(*(
+                    app.handle_event(self._decrypt_event(f'blob-{index}')) for index in range(3)
+                ))
+            finally:
+                app.close()
+
+        app, responses = asyncio.run(scenario())
+
+        self.assertEqual(sorted(r['statusCode'] for r in responses), [200, 200, 503])
+        overloaded = next(r for r in responses if r['statusCode'] == 503)
+        self.assertEqual(overloaded['headers']['Retry-After'], '1')
+        self.assertEqual(app.stats()['rejected'], 1)
+
+
+def run_tests():
+    """Run all tests and return results."""
+    loader = unittest.TestLoader()
+    suite = unittest.TestSuite()
+
+    suite.addTests(loader.loadTestsFromTestCase(TestHandlerServer))
+
+    runner = unittest.TextTestRunner(verbosity=2)
+    result = runner.run(suite)
+
+    return result.wasSuccessful()
+
+
+if __name__ == '__main__':
+    print("Running Solace Server Tests")
+    print("=" * 50)
+
+    success = run_tests()
+
+    print("=" * 50)
+    if success:
+        print("✅ All tests passed!")
+    else:
+        print("❌ Some tests failed!")
+
+    sys.exit(0 if success else 1)